@@ -0,0 +1,269 @@
+"""
+Micro-benchmark comparing the pydub and NumPy episode assembly paths of AudioGenerator.
+It also checks an intro and outro shorter than the fade, which the NumPy assembly crossfades over
+their whole length.
+With --mp3 it compares decoding MP3 chunks, assembling them with NumPy and encoding the
+episode against copying their MP3 frames (AUDIO_ASSEMBLY=frames), including the CPU time
+and number of the ffmpeg processes.
+With --disk it compares the peak memory of assembling and encoding MP3 chunks in memory with
+the out-of-core assembly (AUDIO_ASSEMBLY=disk), each in a process of its own so that its
+peak RSS isn't affected by the other.
+With --stream it checks that the parts StreamingAssembler encodes one section at a time join into one
+MP3 stream that decodes like the episode AudioGenerator.generate encodes at once: the same length
+(plus less than one frame), no tags between the parts, and the samples aligned with the episode.
+
+Run from the repository root:
+    python benchmarks/bench_audio_assembly.py --chunks 4 8 16 32
+    python benchmarks/bench_audio_assembly.py --mp3 --chunks 4 8 --chunk-seconds 90
+    python benchmarks/bench_audio_assembly.py --disk --chunks 10 30 --chunk-seconds 60
+    python benchmarks/bench_audio_assembly.py --stream --chunks 1 4 8 --chunk-seconds 10
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+from pydub import AudioSegment
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from audio_generation import AudioGenerator  # noqa: E402
+from audio_spool import assemble_episode_to_file  # noqa: E402
+from audio_stream import StreamingAssembler  # noqa: E402
+from audio_timeline import assemble_episode  # noqa: E402
+from mp3_frames import Mp3Assembler, parse_frames  # noqa: E402
+
+def noise_segment(seconds: float, channels: int, seed: int, frame_rate: int = 44100) -> AudioSegment:
+    rng = np.random.default_rng(seed)
+    samples = rng.integers(-12000, 12000, size=(int(seconds * frame_rate), channels), dtype=np.int16)
+    return AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=frame_rate, channels=channels)
+
+def run(chunk_count: int, chunk_seconds: float, generator: AudioGenerator, intro: AudioSegment, outro: AudioSegment):
+    # Uneven chunk lengths exercise pydub's millisecond rounding
+    chunks = [noise_segment(chunk_seconds + i * 0.0137, 1, seed=i) for i in range(chunk_count)]
+
+    start = time.perf_counter()
+    voice = generator._join_chunks(chunks)
+    expected = generator._add_outro(generator._add_intro(voice))
+    pydub_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = assemble_episode(chunks, intro, outro)
+    numpy_seconds = time.perf_counter() - start
+
+    identical = actual.raw_data == expected.raw_data and actual.frame_rate == expected.frame_rate \
+        and actual.channels == expected.channels
+    print(f"{chunk_count:>6} {len(expected) / 1000:>9.1f} {pydub_seconds:>9.3f} {numpy_seconds:>9.3f} "
+          f"{pydub_seconds / numpy_seconds:>8.1f}x {'yes' if identical else 'NO':>9}")
+    return identical
+
+def run_short_music(chunk_seconds: float, directory: str):
+    """
+    Checks an intro and outro shorter than the fade, where assemble_episode clamps the crossfade to
+    their length like AudioSegment.append(crossfade=...): the same samples as _add_intro and
+    _add_outro with the clamped fade_duration (unclamped, _add_intro drops part of the voice).
+    """
+    intro, outro = noise_segment(1.2, 2, seed=102), noise_segment(2.2, 2, seed=103)
+    generator = AudioGenerator()
+    generator.intro_path = os.path.join(directory, "short_intro.wav")
+    generator.outro_path = os.path.join(directory, "short_outro.wav")
+    intro.export(generator.intro_path, format="wav")
+    outro.export(generator.outro_path, format="wav")
+    chunks = [noise_segment(chunk_seconds + i * 0.0137, 1, seed=i) for i in range(2)]
+
+    voice = generator._join_chunks(chunks)
+    with_intro = generator._add_intro(voice, fade_duration=min(3000, len(intro), len(voice)))
+    expected = generator._add_outro(with_intro, fade_duration=min(3000, len(with_intro), len(outro)))
+    actual = assemble_episode(chunks, intro, outro)
+
+    identical = actual.raw_data == expected.raw_data and actual.frame_rate == expected.frame_rate \
+        and actual.channels == expected.channels
+    print(f"\nIntro and outro shorter than the fade ({len(intro)} and {len(outro)} ms), identical: "
+          f"{'yes' if identical else 'NO'}")
+    return identical
+
+def speech_mp3(seconds: float, seed: int, frame_rate: int = 44100) -> bytes:
+    """MP3 of bursts of a voiced tone and noise separated by short gaps, roughly shaped like speech"""
+    rng = np.random.default_rng(seed)
+    count = int(seconds * frame_rate)
+    envelope = np.zeros(count)
+    position = 0
+    while position < count:
+        length = int(rng.uniform(0.15, 0.5) * frame_rate)
+        envelope[position:position + length] = 1
+        position += length + int(rng.uniform(0.05, 0.6) * frame_rate)
+    t = np.arange(count) / frame_rate
+    signal = (0.5 * np.sin(2 * np.pi * rng.uniform(110, 220) * t) + rng.normal(0, 0.2, count)) * envelope * 9000
+    segment = AudioSegment(data=signal.astype(np.int16).tobytes(), sample_width=2, frame_rate=frame_rate, channels=1)
+    buffer = io.BytesIO()
+    segment.export(buffer, format="mp3", bitrate="128k")
+    return buffer.getvalue()
+
+def measure(fn):
+    """Runs fn and returns its wall time, the CPU time of this process and of its children, and the number of ffmpeg runs"""
+    processes = []
+    popen = subprocess.Popen
+
+    def counting_popen(*args, **kwargs):
+        processes.append(args[0])
+        return popen(*args, **kwargs)
+
+    before_self, before_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    with mock.patch("subprocess.Popen", counting_popen):
+        fn()
+    wall = time.perf_counter() - start
+    after_self, after_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = lambda before, after: after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime
+    return wall, cpu(before_self, after_self), cpu(before_children, after_children), len(processes)
+
+def run_mp3(chunk_count: int, chunk_seconds: float, intro: AudioSegment, outro: AudioSegment):
+    chunks = [speech_mp3(chunk_seconds + i * 0.0137, seed=i) for i in range(chunk_count)]
+
+    def reencode():
+        episode = assemble_episode([AudioSegment.from_file(io.BytesIO(chunk), format="mp3") for chunk in chunks], intro, outro)
+        episode.export(io.BytesIO(), format="mp3")
+
+    results = [measure(reencode), measure(lambda: Mp3Assembler().assemble(chunks, intro, outro))]
+    for name, (wall, own, children, processes) in zip(("re-encode", "frames"), results):
+        print(f"{chunk_count:>6} {name:>10} {wall:>9.2f} {own:>9.2f} {children:>11.2f} {processes:>7}")
+
+def disk_worker(assembly: str, chunk_paths: list, output_path: str):
+    """Assembles the chunks with one assembly and prints its wall time and the peak RSS of the process"""
+    intro = AudioSegment.from_file(os.environ["INTRO_AUDIO_PATH"])
+    outro = AudioSegment.from_file(os.environ["OUTRO_AUDIO_PATH"])
+    chunks = []
+    for path in chunk_paths:
+        with open(path, "rb") as f:
+            chunks.append(f.read())
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    if assembly == "memory":
+        # What AudioGenerator.generate does: every chunk decoded, the episode rendered, exported to bytes
+        episode = assemble_episode([AudioSegment.from_file(io.BytesIO(chunk), format="mp3") for chunk in chunks], intro, outro)
+        buffer = io.BytesIO()
+        episode.export(buffer, format="mp3")
+        with open(output_path, "wb") as f:
+            f.write(buffer.getvalue())
+    else:
+        decoded = (AudioSegment.from_file(io.BytesIO(chunks.pop(0)), format="mp3") for _ in range(len(chunks)))
+        assemble_episode_to_file(decoded, intro, outro, output_path)
+    wall = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1024 if sys.platform != "darwin" else 1
+    print(json.dumps({
+        "wall": wall,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 2 ** 20,
+        "baseline_rss_mb": baseline * scale / 2 ** 20,
+    }))
+
+def run_disk(chunk_count: int, chunk_seconds: float, directory: str):
+    chunk_paths = []
+    for i in range(chunk_count):
+        path = os.path.join(directory, f"chunk{i}.mp3")
+        with open(path, "wb") as f:
+            f.write(speech_mp3(chunk_seconds + i * 0.0137, seed=i))
+        chunk_paths.append(path)
+
+    outputs = {}
+    for assembly in ("memory", "disk"):
+        output_path = os.path.join(directory, f"episode-{assembly}.mp3")
+        result = subprocess.run(
+            [sys.executable, __file__, "--disk-worker", assembly, "--output-path", output_path, *chunk_paths],
+            check=True, capture_output=True, text=True,
+        )
+        stats = json.loads(result.stdout.strip().splitlines()[-1])
+        with open(output_path, "rb") as f:
+            outputs[assembly] = f.read()
+        print(f"{chunk_count:>6} {chunk_count * chunk_seconds / 60:>9.1f} {assembly:>8} {stats['wall']:>9.2f} "
+              f"{stats['peak_rss_mb']:>14.0f} {stats['peak_rss_mb'] - stats['baseline_rss_mb']:>13.0f}")
+    return outputs["memory"] == outputs["disk"]
+
+def coding_error(decoded: AudioSegment, reference: AudioSegment) -> float:
+    """RMS difference between decoded MP3 and the PCM it was encoded from, over the reference's length"""
+    expected = np.frombuffer(reference.raw_data, np.int16).astype(np.float64)
+    actual = np.frombuffer(decoded.raw_data, np.int16)[:len(expected)].astype(np.float64)
+    return float(np.sqrt(np.mean((actual - expected) ** 2)))
+
+def run_stream(section_count: int, section_seconds: float, intro: AudioSegment, outro: AudioSegment):
+    sections = [AudioSegment.from_file(io.BytesIO(speech_mp3(section_seconds + i * 0.0137, seed=i)), format="mp3")
+                for i in range(section_count)]
+    # What AudioGenerator.generate encodes with the numpy assembly
+    episode = assemble_episode(sections, intro, outro)
+    buffer = io.BytesIO()
+    episode.export(buffer, format="mp3")
+    generated = AudioSegment.from_file(io.BytesIO(buffer.getvalue()), format="mp3")
+
+    assembler = StreamingAssembler(intro, outro)
+    parts = [part for part in [assembler.push(section) for section in sections] + [assembler.finish()] if part]
+    streamed = AudioSegment.from_file(io.BytesIO(b"".join(parts)), format="mp3")
+
+    frame_samples = parse_frames(parts[-1])[0].samples
+    extra = int(streamed.frame_count() - generated.frame_count())
+    tags = sum(part[:3] == b"ID3" for part in parts[1:])
+    generated_error, streamed_error = coding_error(generated, episode), coding_error(streamed, episode)
+    ok = 0 <= extra < frame_samples and tags == 0 and streamed_error <= generated_error * 1.1
+    print(f"{section_count:>8} {len(parts):>6} {len(generated):>14} {len(streamed):>13} {extra:>13} {tags:>5} "
+          f"{generated_error:>10.0f} {streamed_error:>10.0f} {'yes' if ok else 'NO':>5}")
+    return ok
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, nargs="+", default=[4, 8, 16, 32])
+    parser.add_argument("--chunk-seconds", type=float, default=20.0)
+    parser.add_argument("--mp3", action="store_true", help="Compare re-encoding MP3 chunks with copying their frames")
+    parser.add_argument("--disk", action="store_true", help="Compare the peak RSS of in-memory and out-of-core assembly")
+    parser.add_argument("--stream", action="store_true", help="Check that streamed parts join into the generated episode")
+    parser.add_argument("--disk-worker", choices=("memory", "disk"), help=argparse.SUPPRESS)
+    parser.add_argument("--output-path", help=argparse.SUPPRESS)
+    parser.add_argument("chunk_paths", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.disk_worker:
+        disk_worker(args.disk_worker, args.chunk_paths, args.output_path)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        intro = noise_segment(8.3, 2, seed=100)
+        outro = noise_segment(6.1, 2, seed=101)
+        intro.export(os.path.join(directory, "intro.wav"), format="wav")
+        outro.export(os.path.join(directory, "outro.wav"), format="wav")
+        os.environ["INTRO_AUDIO_PATH"] = os.path.join(directory, "intro.wav")
+        os.environ["OUTRO_AUDIO_PATH"] = os.path.join(directory, "outro.wav")
+        generator = AudioGenerator()
+
+        if args.disk:
+            print(f"{'chunks':>6} {'audio (m)':>9} {'assembly':>8} {'wall (s)':>9} {'peak RSS (MB)':>14} "
+                  f"{'assembly (MB)':>13}")
+            identical = [run_disk(count, args.chunk_seconds, directory) for count in args.chunks]
+            print(f"\nSame MP3 output: {'yes' if all(identical) else 'NO'}")
+            sys.exit(0 if all(identical) else 1)
+
+        if args.stream:
+            print(f"{'sections':>8} {'parts':>6} {'generate (ms)':>14} {'stream (ms)':>13} {'extra samples':>13} "
+                  f"{'tags':>5} {'gen error':>10} {'str error':>10} {'ok':>5}")
+            results = [run_stream(count, args.chunk_seconds, intro, outro) for count in args.chunks]
+            sys.exit(0 if all(results) else 1)
+
+        if args.mp3:
+            print(f"{'chunks':>6} {'assembly':>10} {'wall (s)':>9} {'cpu (s)':>9} {'ffmpeg cpu':>11} {'ffmpeg':>7}")
+            for count in args.chunks:
+                run_mp3(count, args.chunk_seconds, intro, outro)
+            return
+
+        print(f"{'chunks':>6} {'audio (s)':>9} {'pydub (s)':>9} {'numpy (s)':>9} {'speedup':>9} {'identical':>9}")
+        results = [run(count, args.chunk_seconds, generator, intro, outro) for count in args.chunks]
+        results.append(run_short_music(args.chunk_seconds, directory))
+
+    sys.exit(0 if all(results) else 1)
+
+if __name__ == "__main__":
+    main()
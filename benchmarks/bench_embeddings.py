@@ -0,0 +1,132 @@
+"""
+Retrieval benchmark of the local hashing TF-IDF embeddings against the remote OpenAI embeddings.
+
+Indexes a corpus in FAISS with each backend and measures indexing and query latency,
+the share of queries whose source document is in the top k (queries are sentences
+taken from the documents), and the overlap between the local and remote top k.
+
+The corpus is either the search results saved in a run directory (search_results.json,
+see checkpoint.py) or synthetic documents. The remote backend is the real OpenAI API when
+OPENAI_API_KEY is set, otherwise the fake of fake_services.py: its latency is realistic
+but its vectors are random, so the top-k overlap is then meaningless.
+
+Run from the repository root:
+    python benchmarks/bench_embeddings.py --documents 300 --queries 100 --k 6
+    python benchmarks/bench_embeddings.py --corpus .runs/<topic>/search_results.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from langchain_community.vectorstores import FAISS  # noqa: E402
+
+from local_embeddings import HashingEmbeddings  # noqa: E402
+
+def synthetic_corpus(documents: int, seed: int) -> list:
+    """Documents of Zipf-distributed pseudo-words, so that term statistics look like natural text"""
+    rng = random.Random(seed)
+    vocabulary = [f"term{i}" for i in range(5000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    corpus = []
+    for i in range(documents):
+        # Each document has a few topic words of its own on top of the shared vocabulary
+        topic = rng.sample(vocabulary[500:], 8)
+        sentences = []
+        for _ in range(rng.randint(6, 14)):
+            words = rng.choices(vocabulary, weights, k=rng.randint(8, 16)) + rng.sample(topic, 2)
+            rng.shuffle(words)
+            sentences.append(" ".join(words).capitalize() + ".")
+        corpus.append(f"Title: Document {i}\n\nContent: {' '.join(sentences)}")
+    return corpus
+
+def load_corpus(path: str) -> list:
+    with open(path) as f:
+        search_results = json.load(f)
+    results = search_results["general"] + search_results["news"] if isinstance(search_results, dict) else search_results
+    return list(dict.fromkeys(
+        f"Title: {result['title']}\n\nSource: {result.get('source', result.get('url', ''))}\n\nContent: {result['content']}"
+        for result in results
+    ))
+
+def make_queries(corpus: list, queries: int, seed: int) -> list:
+    """(query, index of the source document) pairs, each query is a sentence of its document"""
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(queries):
+        index = rng.randrange(len(corpus))
+        sentences = [sentence for sentence in corpus[index].split(". ") if len(sentence.split()) >= 5]
+        pairs.append((rng.choice(sentences or [corpus[index]]), index))
+    return pairs
+
+def remote_embeddings(kind: str):
+    if kind == "openai":
+        from clients import get_embeddings
+        return get_embeddings()
+    import fake_services
+    fake_services.configure(fake_services.FakeConfig(latency_scale=1.0))
+    return fake_services.FakeOpenAIEmbeddings()
+
+def run_backend(name: str, embeddings, corpus: list, queries: list, k: int) -> dict:
+    start = time.perf_counter()
+    vectorstore = FAISS.from_texts(corpus, embeddings, metadatas=[{"index": i} for i in range(len(corpus))])
+    index_seconds = time.perf_counter() - start
+
+    latencies, top_k, hits = [], [], 0
+    for query, source in queries:
+        start = time.perf_counter()
+        documents = vectorstore.similarity_search(query, k=k)
+        latencies.append(time.perf_counter() - start)
+        indices = [document.metadata["index"] for document in documents]
+        top_k.append(indices)
+        hits += source in indices
+    latencies.sort()
+    print(f"{name:<8} index {index_seconds:>7.3f}s  query p50 {latencies[len(latencies) // 2] * 1e3:>7.2f} ms  "
+          f"p95 {latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)] * 1e3:>7.2f} ms  "
+          f"source in top {k}: {hits / len(queries):.0%}")
+    return {
+        "index_seconds": index_seconds,
+        "query_p50_seconds": latencies[len(latencies) // 2],
+        "query_p95_seconds": latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)],
+        "source_recall_at_k": hits / len(queries),
+        "top_k": top_k,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="search_results.json of a run, synthetic documents if not set")
+    parser.add_argument("--documents", type=int, default=300, help="Number of synthetic documents")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=6)
+    parser.add_argument("--remote", choices=("openai", "fake"), default="openai" if os.getenv('OPENAI_API_KEY') else "fake")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to a JSON file")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus) if args.corpus else synthetic_corpus(args.documents, args.seed)
+    queries = make_queries(corpus, args.queries, args.seed)
+    print(f"{len(corpus)} documents, {len(queries)} queries, remote embeddings: {args.remote}\n")
+
+    local = run_backend("hashing", HashingEmbeddings(), corpus, queries, args.k)
+    remote = run_backend("remote", remote_embeddings(args.remote), corpus, queries, args.k)
+    overlaps = [len(set(a) & set(b)) / args.k for a, b in zip(local["top_k"], remote["top_k"])]
+    print(f"\nTop {args.k} overlap with the remote embeddings: mean {statistics.mean(overlaps):.0%}, "
+          f"median {statistics.median(overlaps):.0%}")
+    if args.remote == "fake":
+        print("(the fake remote vectors are random, run with OPENAI_API_KEY set for a meaningful overlap)")
+
+    if args.output:
+        for result in (local, remote):
+            del result["top_k"]
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "hashing": local, "remote": remote,
+                       "top_k_overlap": statistics.mean(overlaps)}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
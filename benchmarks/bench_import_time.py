@@ -0,0 +1,66 @@
+"""
+Import-time profile of the entry point modules.
+
+Imports each module in a fresh interpreter with `python -X importtime`, reports the
+total and the slowest imports, and fails if one of the client libraries (LangChain,
+OpenAI, ElevenLabs, Tavily) is imported at startup or the import takes longer than
+--max-seconds. They are meant to be loaded the first time a stage needs them.
+
+Run from the repository root:
+    python benchmarks/bench_import_time.py --max-seconds 0.5
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+HEAVY_PACKAGES = ("langchain", "langchain_core", "langchain_community", "langchain_openai", "openai", "elevenlabs", "tavily")
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def profile_import(module: str) -> list:
+    """Returns (module, self µs, cumulative µs, depth) of every module imported by `import module`"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr}")
+    imports = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            imports.append((match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2))
+    return imports
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=["podcast_generator", "main"])
+    parser.add_argument("--max-seconds", type=float, default=0.5, help="Maximum import time of each module")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to show")
+    args = parser.parse_args()
+
+    failures = []
+    for module in args.modules:
+        imports = profile_import(module)
+        total = next(cumulative for name, _, cumulative, depth in reversed(imports) if name == module and depth == 0) / 1e6
+        print(f"\n=== import {module}: {total:.3f}s ===")
+        for name, own, cumulative, _ in sorted(imports, key=lambda entry: entry[1], reverse=True)[:args.top]:
+            print(f"  {name:<50} self {own / 1e3:>8.1f} ms  cumulative {cumulative / 1e3:>8.1f} ms")
+
+        heavy = sorted({name for name, *_ in imports if name.split(".")[0] in HEAVY_PACKAGES})
+        if heavy:
+            failures.append(f"import {module} loads {', '.join(heavy[:5])}{' ...' if len(heavy) > 5 else ''}")
+        if total > args.max_seconds:
+            failures.append(f"import {module} took {total:.3f}s, more than {args.max_seconds}s")
+
+    if failures:
+        print("\nFAILED")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    print("\nOK")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+End-to-end pipeline benchmark against in-process fake services (see fake_services.py).
+
+Measures per-stage and end-to-end latency, throughput and peak memory of
+PodcastGenerator.generate_podcast and of the v1, v2 and v3 ScriptGenerators,
+and writes the results to a JSON file so regressions can be tracked.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py --runs 3 --output pipeline_benchmark.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from pydub import AudioSegment
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import fake_services  # noqa: E402
+
+TARGETS = ("podcast", "script_v1", "script_v2", "script_v3")
+
+def configure_environment(directory: str, args: argparse.Namespace):
+    """Points every cache and output at a scratch directory, so each run hits the fake services"""
+    os.environ["SEARCH_CACHE_PATH"] = os.path.join(directory, "search_cache.sqlite")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(directory, "embedding_cache.sqlite")
+    os.environ["LLM_CACHE_PATH"] = os.path.join(directory, "llm_cache.sqlite")
+    os.environ["DOCUMENT_STORE_PATH"] = os.path.join(directory, "document_store.sqlite")
+    os.environ["TTS_CACHE_PATH"] = os.path.join(directory, "tts_cache.sqlite")
+    os.environ["LLM_CACHE_MODE"] = "on" if args.warm_cache else "off"
+    os.environ["CHECKPOINT_DIR"] = os.path.join(directory, "runs")
+    # The fakes are not rate limited, only the concurrency limits stay in place
+    for provider in ("OPENAI", "OPENAI_EMBEDDINGS", "OPENAI_IMAGES", "TAVILY", "ELEVENLABS"):
+        os.environ[f"RATE_LIMIT_{provider}_RPM"] = "0"
+        os.environ[f"RATE_LIMIT_{provider}_UPM"] = "0"
+
+    rng = np.random.default_rng(args.seed)
+    for name, seconds in (("intro", 8.0), ("outro", 6.0)):
+        samples = rng.integers(-8000, 8000, size=(int(seconds * 44100), 2), dtype=np.int16)
+        path = os.path.join(directory, f"{name}.wav")
+        AudioSegment(data=samples.tobytes(), sample_width=2, frame_rate=44100, channels=2).export(path, format="wav")
+        os.environ[f"{name.upper()}_AUDIO_PATH"] = path
+
+def clear_caches(directory: str):
+    """Removes the caches written by the previous run unless they are meant to stay warm"""
+    import document_store
+    import llm_cache
+    import tts_cache
+
+    # The process-wide caches keep their database open, the next run opens the new files
+    for module, name in ((llm_cache, "_cache"), (tts_cache, "_cache"), (document_store, "_store")):
+        singleton = getattr(module, name)
+        if singleton is not None:
+            singleton._connection.close()
+            setattr(module, name, None)
+    for name in ("search_cache.sqlite", "embedding_cache.sqlite", "llm_cache.sqlite", "document_store.sqlite",
+                 "tts_cache.sqlite"):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+def run_target(target: str, topic: str) -> dict:
+    """Runs one target once and returns its per-stage timings"""
+    from usage_meter import UsageMeter, use_meter
+
+    if target == "podcast":
+        from podcast_generator import PodcastGenerator
+        content = PodcastGenerator().generate_podcast(topic)
+        stages = dict(content.stage_timings)
+        stages.update({f"calls.{name}": stage["latency"] for name, stage in content.usage_report["stages"].items()})
+        return stages
+
+    meter = UsageMeter()
+    stages = {}
+    with use_meter(meter):
+        if target == "script_v3":
+            from script_generation_v3 import ScriptGenerator
+            ScriptGenerator().generate(topic)
+        else:
+            module = __import__(f"script_generation_{target[-2:]}")
+            start = time.perf_counter()
+            search_results = module.ContentSearcher().search(topic)
+            stages["search"] = time.perf_counter() - start
+            start = time.perf_counter()
+            module.ScriptGenerator().generate(topic, search_results)
+            stages["script"] = time.perf_counter() - start
+    stages.update({f"calls.{name}": stage["latency"] for name, stage in meter.report()["stages"].items()})
+    return stages
+
+def summarize(values: list) -> dict:
+    values = sorted(values)
+    return {
+        "mean": statistics.mean(values),
+        "p50": values[len(values) // 2],
+        "p95": values[min(int(len(values) * 0.95), len(values) - 1)],
+        "min": values[0],
+        "max": values[-1],
+    }
+
+def benchmark(target: str, args: argparse.Namespace, directory: str) -> dict:
+    latencies, stage_runs = [], []
+    started = time.perf_counter()
+    for run in range(args.runs):
+        if not args.warm_cache:
+            clear_caches(directory)
+        start = time.perf_counter()
+        stages = run_target(target, f"{args.topic} {run}" if args.distinct_topics else args.topic)
+        latencies.append(time.perf_counter() - start)
+        stage_runs.append(stages)
+    elapsed = time.perf_counter() - started
+
+    # Tracing allocations slows everything down, so peak memory is measured on a separate run
+    peak = None
+    if args.memory:
+        if not args.warm_cache:
+            clear_caches(directory)
+        tracemalloc.start()
+        run_target(target, args.topic)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    stage_names = sorted({name for stages in stage_runs for name in stages})
+    return {
+        "runs": args.runs,
+        "end_to_end": summarize(latencies),
+        "throughput_per_hour": args.runs / elapsed * 3600,
+        "stages": {name: summarize([stages[name] for stages in stage_runs if name in stages]) for name in stage_names},
+        "peak_traced_memory_bytes": peak,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--topic", default="quantum computing")
+    parser.add_argument("--distinct-topics", action="store_true", help="Use a different topic for every run")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep search, embedding and LLM caches and the document store between runs")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="Don't trace memory allocations")
+    parser.add_argument("--latency-scale", type=float, default=0.01, help="Multiplier of the fake services' latencies")
+    parser.add_argument("--error-rate", type=float, help="Error rate of every fake service")
+    parser.add_argument("--search-results", type=int, default=10)
+    parser.add_argument("--content-words", type=int, default=120)
+    parser.add_argument("--llm-words", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="pipeline_benchmark.json")
+    args = parser.parse_args()
+
+    config = fake_services.FakeConfig(
+        latency_scale=args.latency_scale,
+        search_results=args.search_results,
+        content_words=args.content_words,
+        llm_words=args.llm_words,
+        seed=args.seed,
+    )
+    if args.error_rate is not None:
+        for profile in config.profiles.values():
+            profile.error_rate = args.error_rate
+    fake_services.configure(config)
+
+    results = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "targets": {},
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        configure_environment(directory, args)
+        patchers = fake_services.install()
+        try:
+            for target in args.targets:
+                print(f"\n=== Benchmarking {target} ({args.runs} runs) ===")
+                results["targets"][target] = benchmark(target, args, directory)
+        finally:
+            for patcher in patchers:
+                patcher.stop()
+    results["service_calls"] = fake_services.call_counts()
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["max_rss_bytes"] = max_rss if sys.platform == "darwin" else max_rss * 1024
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n{'target':<10} {'p50 (s)':>9} {'p95 (s)':>9} {'eps/hour':>9} {'peak MB':>9}")
+    for target, result in results["targets"].items():
+        peak = result["peak_traced_memory_bytes"]
+        print(f"{target:<10} {result['end_to_end']['p50']:>9.2f} {result['end_to_end']['p95']:>9.2f} "
+              f"{result['throughput_per_hour']:>9.0f} {peak / 1e6 if peak else float('nan'):>9.1f}")
+    print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
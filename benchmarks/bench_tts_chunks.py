@@ -0,0 +1,118 @@
+"""
+Benchmark of the TTS chunk planner against the previous greedy chunking, which split the
+script on every period and filled each chunk up to 2000 characters.
+
+Reports the chunk lengths and the synthesis wall time estimated by the cost model for
+each parallelism, and how much of an edited script has to be synthesized again: random
+local edits (a sentence rewritten, inserted or deleted) are applied to the script, and the
+chunks and characters that miss the TTS cache, filled with the chunks of the original
+script, are counted.
+
+The script is synthetic, or a script saved in a run directory (script.json, see checkpoint.py).
+
+Run from the repository root:
+    python benchmarks/bench_tts_chunks.py --edits 100 --parallelism 1 4 8
+    python benchmarks/bench_tts_chunks.py --script .runs/<topic>/script.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from tts_chunks import ChunkPlanner, TTSCostModel, split_paragraphs, split_sentences  # noqa: E402
+
+def greedy_chunks(script: str) -> list:
+    """The chunking AudioGenerator used before: sentences split on periods, chunks filled up to 2000 chars"""
+    chunks = []
+    current_chunk = ""
+    for sentence in script.split('.'):
+        sentence = sentence.strip() + '.'
+        if len(current_chunk) + len(sentence) <= 2000:
+            current_chunk += sentence + ' '
+        else:
+            chunks.append(current_chunk.strip())
+            current_chunk = sentence + ' '
+    if current_chunk:
+        chunks.append(current_chunk.strip())
+    return chunks
+
+def synthetic_script(paragraphs: int, seed: int) -> str:
+    rng = random.Random(seed)
+    words = [f"word{i}" for i in range(2000)]
+    return "\n\n".join(
+        " ".join(" ".join(rng.choices(words, k=rng.randint(6, 30))).capitalize() + "."
+                 for _ in range(rng.randint(2, 9)))
+        for _ in range(paragraphs)
+    )
+
+def edit(script: str, rng: random.Random) -> str:
+    """Rewrites, inserts or deletes one sentence of the script"""
+    paragraphs = [split_sentences(paragraph) for paragraph in split_paragraphs(script)]
+    paragraph = rng.choice([p for p in paragraphs if p])
+    index = rng.randrange(len(paragraph))
+    kind = rng.choice(("rewrite", "insert", "delete"))
+    new_sentence = f"This sentence was added by an editor {rng.randrange(10 ** 6)}."
+    if kind == "rewrite":
+        paragraph[index] = paragraph[index][:-1] + f", edited {rng.randrange(10 ** 6)}."
+    elif kind == "insert":
+        paragraph.insert(index, new_sentence)
+    elif len(paragraph) > 1:
+        del paragraph[index]
+    return "\n\n".join(" ".join(sentences) for sentences in paragraphs if sentences)
+
+def redone(chunks: list, known: set) -> tuple:
+    """Number of chunks and characters that aren't in the cache"""
+    new = [chunk for chunk in chunks if chunk not in known]
+    return len(new), sum(len(chunk) for chunk in new)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--script", help="script.json of a run, a synthetic script if not set")
+    parser.add_argument("--paragraphs", type=int, default=60, help="Paragraphs of the synthetic script")
+    parser.add_argument("--edits", type=int, default=100)
+    parser.add_argument("--parallelism", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+    else:
+        script = synthetic_script(args.paragraphs, args.seed)
+    model = TTSCostModel.from_env()
+    print(f"Script of {len(script)} characters, cost model: {model.request_overhead}s per request, "
+          f"{model.characters_per_second:.0f} chars/s, {args.edits} single-sentence edits\n")
+    print(f"{'workers':>7} {'chunking':>8} {'chunks':>7} {'min chars':>9} {'max chars':>9} {'wall (s)':>9} "
+          f"{'plan (ms)':>9} {'chunks redone':>14} {'chars redone':>13} {'edit wall (s)':>14}")
+
+    for parallelism in args.parallelism:
+        model.parallelism = parallelism
+        planner = ChunkPlanner(model)
+        for name in ("greedy", "planner"):
+            start = time.perf_counter()
+            chunks = greedy_chunks(script) if name == "greedy" else planner.plan(script).chunks
+            plan_seconds = time.perf_counter() - start
+            wall = model.wall_time([model.duration(len(chunk)) for chunk in chunks])
+
+            known = set(chunks)
+            cached_planner = ChunkPlanner(model, lambda texts: {text for text in texts if text in known})
+            rng = random.Random(args.seed)
+            counts, characters, walls = [], [], []
+            for _ in range(args.edits):
+                edited = edit(script, rng)
+                edited_chunks = greedy_chunks(edited) if name == "greedy" else cached_planner.plan(edited).chunks
+                count, chars = redone(edited_chunks, known)
+                counts.append(count)
+                characters.append(chars)
+                walls.append(model.wall_time([model.duration(len(chunk), chunk in known) for chunk in edited_chunks]))
+            print(f"{parallelism:>7} {name:>8} {len(chunks):>7} {min(map(len, chunks)):>9} {max(map(len, chunks)):>9} "
+                  f"{wall:>9.1f} {plan_seconds * 1e3:>9.1f} {statistics.mean(counts):>14.2f} "
+                  f"{statistics.mean(characters) / len(script):>12.1%} {statistics.mean(walls):>14.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+In-process stand-ins for Tavily, OpenAI (chat, embeddings, images) and ElevenLabs.
+
+Each fake has a configurable latency distribution, error rate and payload size, so the
+pipeline can be benchmarked offline and deterministically. install() swaps the fakes
+into the client libraries in place of the real client classes.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+WORDS = (
+    "quantum network signal market energy policy model data research system network token "
+    "climate launch storage theory risk growth protocol sensor design region future value "
+    "history culture science budget robot language vision chip battery planet ocean city"
+).split()
+
+@dataclass
+class ServiceProfile:
+    """Latency (lognormal around median, plus a cost per unit of output) and error rate of a fake service"""
+    median: float
+    sigma: float = 0.3
+    per_unit: float = 0.0
+    error_rate: float = 0.0
+
+@dataclass
+class FakeConfig:
+    latency_scale: float = 0.01
+    search_results: int = 10
+    content_words: int = 120
+    llm_words: int = 400
+    search_queries: int = 10
+    concepts: int = 5
+    tts_chars_per_second: float = 15.0
+    embedding_dimensions: int = 256
+    seed: int = 0
+    profiles: Dict[str, ServiceProfile] = field(default_factory=lambda: {
+        "tavily": ServiceProfile(median=1.2, sigma=0.4),
+        "openai": ServiceProfile(median=1.0, sigma=0.4, per_unit=0.01),
+        "openai_embeddings": ServiceProfile(median=0.3, sigma=0.3, per_unit=0.0005),
+        "openai_images": ServiceProfile(median=8.0, sigma=0.2),
+        "elevenlabs": ServiceProfile(median=1.0, sigma=0.3, per_unit=0.001),
+    })
+
+class FakeServiceError(Exception):
+    """Error raised by a fake service, shaped like the HTTP errors of the real clients"""
+
+    def __init__(self, service: str, status_code: int):
+        message = "rate limit exceeded" if status_code == 429 else "internal server error"
+        super().__init__(f"{service}: {status_code} {message}")
+        self.status_code = status_code
+
+CONFIG = FakeConfig()
+_random = random.Random(CONFIG.seed)
+_random_lock = threading.Lock()
+_calls: Dict[str, int] = {}
+
+def configure(config: FakeConfig):
+    """Replaces the configuration of all fakes and resets their random state"""
+    global CONFIG
+    CONFIG = config
+    with _random_lock:
+        _random.seed(config.seed)
+        _calls.clear()
+
+def call_counts() -> Dict[str, int]:
+    return dict(_calls)
+
+def _service_call(service: str, units: float = 0):
+    """Sleeps for the latency of one call and raises the configured share of errors"""
+    profile = CONFIG.profiles[service]
+    with _random_lock:
+        _calls[service] = _calls.get(service, 0) + 1
+        latency = _random.lognormvariate(np.log(profile.median), profile.sigma) + profile.per_unit * units
+        failed = _random.random() < profile.error_rate
+        status_code = _random.choice((429, 429, 500, 503))
+    time.sleep(latency * CONFIG.latency_scale)
+    if failed:
+        raise FakeServiceError(service, status_code)
+
+def _text(seed: str, words: int) -> str:
+    """Deterministic pseudo-English text of about `words` words, in sentences and paragraphs"""
+    rng = random.Random(seed)
+    sentences = []
+    for _ in range(max(words // 12, 1)):
+        sentence = " ".join(rng.choice(WORDS) for _ in range(12))
+        sentences.append(sentence.capitalize() + ".")
+    paragraphs = [" ".join(sentences[i:i + 5]) for i in range(0, len(sentences), 5)]
+    return "\n\n".join(paragraphs)
+
+def _prompt_seed(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+class FakeTavilyClient:
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key
+
+    def search(self, query: str, search_depth: str = "basic", topic: str = "general", days: int = 3,
+               max_results: int = 5, **kwargs) -> Dict:
+        _service_call("tavily")
+        count = min(max_results, CONFIG.search_results)
+        return {
+            "query": query,
+            "results": [
+                {
+                    "title": f"{query} {topic} result {i}",
+                    "url": f"https://example.com/{topic}/{_prompt_seed(query)[:8]}/{i}",
+                    "content": _text(f"{query}|{topic}|{i}", CONFIG.content_words),
+                    "score": 1.0 - i / max(count, 1),
+                }
+                for i in range(count)
+            ],
+        }
+
+class FakeChatOpenAI(BaseChatModel):
+    """Chat model answering each pipeline prompt with output of the expected shape and size"""
+    model_name: str = "gpt-4o"
+    temperature: Optional[float] = 0.7
+    openai_api_key: Optional[str] = None
+    http_client: Any = None
+
+    def __init__(self, model: Optional[str] = None, **kwargs: Any):
+        if model is not None:
+            kwargs["model_name"] = model
+        super().__init__(**kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-openai-chat"
+
+    def _answer(self, prompt: str) -> str:
+        seed = _prompt_seed(prompt)
+        if "comma separated list" in prompt:
+            return ", ".join(f"subtopic {i} {WORDS[i % len(WORDS)]}" for i in range(CONFIG.search_queries))
+        if '{"concepts"' in prompt:
+            return json.dumps({"concepts": [
+                {"title": f"Concept {i} {WORDS[(i * 7) % len(WORDS)]}", "description": _text(f"{seed}{i}", 24)}
+                for i in range(CONFIG.concepts)
+            ]})
+        if '"boundaries"' in prompt:
+            boundaries, _ = json.JSONDecoder().raw_decode(prompt[prompt.index("["):])
+            return json.dumps({"boundaries": boundaries})
+        target = re.search(r"(?:around|about) (\d+)(?: more)? words", prompt)
+        return _text(seed, int(target.group(1)) if target else CONFIG.llm_words)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        prompt = "\n".join(str(message.content) for message in messages)
+        answer = self._answer(prompt)
+        _service_call("openai", units=len(answer.split()))
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(answer) // 4,
+                 "total_tokens": (len(prompt) + len(answer)) // 4}
+        message = AIMessage(content=answer, usage_metadata=usage)
+        token_usage = {"prompt_tokens": usage["input_tokens"], "completion_tokens": usage["output_tokens"],
+                       "total_tokens": usage["total_tokens"]}
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={"token_usage": token_usage, "model_name": self.model_name},
+        )
+
+class FakeOpenAIEmbeddings(Embeddings):
+    """Deterministic unit vectors derived from the hash of each text"""
+
+    def __init__(self, model: str = "text-embedding-ada-002", **kwargs: Any):
+        self.model = model
+
+    def _vector(self, text: str) -> List[float]:
+        rng = np.random.default_rng(int(_prompt_seed(text)[:16], 16))
+        vector = rng.standard_normal(CONFIG.embedding_dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        _service_call("openai_embeddings", units=sum(len(text) for text in texts) // 4)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+class FakeOpenAI:
+    """OpenAI client exposing images.generate"""
+
+    def __init__(self, api_key: Optional[str] = None, **kwargs: Any):
+        self.images = SimpleNamespace(generate=self._generate_image)
+
+    def _generate_image(self, model: str, prompt: str, **kwargs: Any):
+        _service_call("openai_images")
+        return SimpleNamespace(data=[SimpleNamespace(url=f"https://images.example.com/{_prompt_seed(prompt)[:16]}.png")])
+
+# MPEG-1 Layer III, 128 kbit/s, 44.1 kHz, mono, no CRC. A frame with zeroed side information
+# and main data decodes to 1152 samples of silence.
+MP3_FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0xC4])
+MP3_FRAME_BYTES = 144 * 128000 // 44100
+MP3_FRAME_SECONDS = 1152 / 44100
+
+def silent_mp3(seconds: float) -> bytes:
+    """Real MP3 bytes of the given duration, made of silent frames"""
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_BYTES - len(MP3_FRAME_HEADER))
+    return frame * max(int(round(seconds / MP3_FRAME_SECONDS)), 1)
+
+class FakeElevenLabs:
+    """ElevenLabs client whose generate streams MP3 audio as long as the text would take to read"""
+
+    def __init__(self, api_key: Optional[str] = None, **kwargs: Any):
+        self.api_key = api_key
+
+    def generate(self, text: str, voice: str = "", model: str = "", **kwargs: Any):
+        _service_call("elevenlabs", units=len(text))
+        audio = silent_mp3(len(text) / CONFIG.tts_chars_per_second)
+        for start in range(0, len(audio), 4096):
+            yield audio[start:start + 4096]
+
+# Client classes the shared client registry (clients.py) imports, by the module it imports them from
+PATCHES = {
+    "tavily": {"TavilyClient": FakeTavilyClient},
+    "langchain_openai.chat_models": {"ChatOpenAI": FakeChatOpenAI},
+    "langchain_openai.embeddings": {"OpenAIEmbeddings": FakeOpenAIEmbeddings},
+    "openai": {"OpenAI": FakeOpenAI},
+    "elevenlabs.client": {"ElevenLabs": FakeElevenLabs},
+}
+
+def install() -> List[Any]:
+    """
+    Replaces the real clients with the fakes.
+    Shared clients created before are dropped, so that the registry creates fakes from now on.
+    Returns:
+        list: The started patchers, stop them to restore the real clients
+    """
+    import importlib
+    from clients import close_clients
+    close_clients()
+    patchers = []
+    for module_name, replacements in PATCHES.items():
+        module = importlib.import_module(module_name)
+        for name, fake in replacements.items():
+            patcher = mock.patch.object(module, name, fake)
+            patcher.start()
+            patchers.append(patcher)
+    return patchers
@@ -1,57 +1,179 @@
-from elevenlabs.client import ElevenLabs
-from dotenv import load_dotenv
+from env import load_env
 from pydub import AudioSegment
+from audio_timeline import TimelineFormat, assemble_episode, assemble_track
+from audio_stream import StreamingAssembler
+from audio_spool import assemble_episode_to_file, encode_episode
+from mp3_frames import Mp3Assembler, Mp3FormatError
+from usage_meter import get_meter, propagate_context
+from rate_limiter import get_limiter
+from clients import get_elevenlabs_client
+from checkpoint import NullCheckpoint, RunCheckpoint
+from tts_cache import TTSCache, get_tts_cache
+from tts_chunks import TTSCostModel, plan_chunks
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set
+import hashlib
 import io
 import os
 # Load environment variables from .env file
-load_dotenv()
+load_env()
 
 class AudioGenerator:
-    def __init__(self):
-        self.client = ElevenLabs(api_key=os.getenv('ELEVENLABS_API_KEY'))
+    def __init__(self, max_workers: Optional[int] = None, max_retries: Optional[int] = None):
+        self.client = get_elevenlabs_client()
+        self.max_workers = max_workers or int(os.getenv('TTS_MAX_WORKERS', '4'))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('TTS_MAX_RETRIES', '3'))
+        self.voice = os.getenv('TTS_VOICE', 'Brian')
+        self.model = os.getenv('TTS_MODEL', 'eleven_multilingual_v2')
+        self.cache = get_tts_cache()
         self.intro_path = os.getenv('INTRO_AUDIO_PATH', 'assets/intro.mp3')
         self.outro_path = os.getenv('OUTRO_AUDIO_PATH', 'assets/intro.mp3')
+        # "numpy" assembles the episode in a single PCM buffer, "pydub" uses AudioSegment operations,
+        # "frames" copies the MP3 frames of the voice and only encodes the intro and outro fades,
+        # "disk" assembles the episode in a memory-mapped file and encodes it straight to the output file
+        self.assembly = os.getenv('AUDIO_ASSEMBLY', 'numpy')
 
-    def _generate_voice(self, script: str) -> AudioSegment:
+    def _split_script(self, script: str) -> List[str]:
         """
-        Generates the voice audio from the script by splitting into chunks and combining
+        Splits the script into chunks of max 2000 chars, ending at sentence ends
+        The chunks are planned to minimize the synthesis time of max_workers parallel requests
+        (see ChunkPlanner), and chunks already in the TTS cache are kept, so after an edit
+        only the chunks whose text changed are synthesized again.
         Args:
             script (str): The text to convert to speech
         Returns:
-            AudioSegment: The generated voice audio
+            list: The text chunks
+        Raises:
+            ValueError: If the script has no text to speak
         """
-        # Split script into chunks of max 10000 chars, ending at periods
-        chunks = []
-        current_chunk = ""
-        
-        for sentence in script.split('.'):
-            sentence = sentence.strip() + '.'
-            if len(current_chunk) + len(sentence) <= 2000:
-                current_chunk += sentence + ' '
-            else:
-                chunks.append(current_chunk.strip())
-                current_chunk = sentence + ' '
-        if current_chunk:
-            chunks.append(current_chunk.strip())
+        chunks = plan_chunks(script, TTSCostModel.from_env(self.max_workers), self._cached_chunks if self.cache else None)
+        if not chunks:
+            raise ValueError("The script is empty, there is no text to convert to speech")
+        return chunks
+
+    def _cached_chunks(self, texts: List[str]) -> Set[str]:
+        """Returns which of the chunk texts have audio in the TTS cache"""
+        keys = {TTSCache.make_key(text, self.voice, self.model): text for text in texts}
+        return {keys[key] for key in self.cache.contains(list(keys))}
 
-        # Generate audio for each chunk and combine with pauses
+    def _synthesize_chunk_bytes(self, chunk: str, checkpoint: Optional[RunCheckpoint] = None) -> bytes:
+        """
+        Converts a single chunk to speech, throttled and retried by the ElevenLabs rate limiter
+        Args:
+            chunk (str): The text to convert to speech
+            checkpoint (RunCheckpoint): Run directory where the synthesized chunk is saved
+        Returns:
+            bytes: The MP3 audio of the chunk
+        """
+        def request() -> bytes:
+            # The response is streamed, so errors can surface while reading it
+            return b"".join(self.client.generate(
+                text=chunk,
+                voice=self.voice,
+                model=self.model
+            ))
+
+        def synthesize() -> bytes:
+            if self.cache is not None:
+                key = TTSCache.make_key(chunk, self.voice, self.model)
+                audio = self.cache.get(key)
+                if audio is not None:
+                    return audio
+            with get_meter().track("tts", "elevenlabs", self.model, characters=len(chunk)):
+                audio = get_limiter("elevenlabs").call(request, units=len(chunk), max_retries=self.max_retries)
+            if self.cache is not None:
+                self.cache.put(key, self.voice, self.model, chunk, audio)
+            return audio
+
+        # Chunks are saved under the hash of their text, so they match the script they were made from
+        name = f"tts/{hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:16]}.mp3"
+        return (checkpoint or NullCheckpoint()).cached_bytes(name, synthesize)
+
+    def _synthesize_chunk(self, chunk: str, checkpoint: Optional[RunCheckpoint] = None) -> AudioSegment:
+        """
+        Converts a single chunk to speech and decodes it
+        Args:
+            chunk (str): The text to convert to speech
+            checkpoint (RunCheckpoint): Run directory where the synthesized chunk is saved
+        Returns:
+            AudioSegment: The generated voice audio for the chunk
+        """
+        return AudioSegment.from_file(io.BytesIO(self._synthesize_chunk_bytes(chunk, checkpoint)), format="mp3")
+
+    def _synthesize_chunks(self, script: str, checkpoint: Optional[RunCheckpoint] = None, decode: bool = True) -> list:
+        """
+        Converts the script to speech chunk by chunk.
+        Chunks are synthesized concurrently by up to max_workers requests and
+        returned in script order.
+        Args:
+            script (str): The text to convert to speech
+            checkpoint (RunCheckpoint): Run directory where synthesized chunks are saved and resumed from
+            decode (bool): Whether to decode the chunks, or return their MP3 bytes
+        Returns:
+            list: The generated voice audio of each chunk
+        """
+        chunks = self._split_script(script)
+        print(f"Synthesizing {len(chunks)} chunks ({self.max_workers} in parallel)")
+        hits = self.cache.stats["hits"] if self.cache is not None else 0
+
+        synthesize = self._synthesize_chunk if decode else self._synthesize_chunk_bytes
+        if self.max_workers <= 1:
+            results = [synthesize(chunk, checkpoint) for chunk in chunks]
+        else:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                results = list(executor.map(propagate_context(lambda chunk: synthesize(chunk, checkpoint)), chunks))
+        if self.cache is not None:
+            # Approximate when other scripts are synthesized at the same time, the counters are shared
+            print(f"Reused {self.cache.stats['hits'] - hits} of {len(chunks)} chunks from the TTS cache")
+        return results
+
+    def synthesize_section(self, text: str, checkpoint: Optional[RunCheckpoint] = None) -> AudioSegment:
+        """
+        Converts one section of the script to speech, used to stream an episode section by section
+        Args:
+            text (str): The section text
+            checkpoint (RunCheckpoint): Run directory where synthesized chunks are saved and resumed from
+        Returns:
+            AudioSegment: The voice audio of the section
+        """
+        return self._join_chunks(self._synthesize_chunks(text, checkpoint))
+
+    def stream_assembler(self, audio_format: str = "mp3") -> StreamingAssembler:
+        """Returns an assembler that adds this generator's intro and outro to streamed sections"""
+        return StreamingAssembler(
+            AudioSegment.from_file(self.intro_path),
+            AudioSegment.from_file(self.outro_path),
+            audio_format=audio_format
+        )
+
+    def _join_chunks(self, chunk_audios: List[AudioSegment]) -> AudioSegment:
+        """
+        Combines the voice chunks with pauses
+        Args:
+            chunk_audios (list): The generated voice audio of each chunk
+        Returns:
+            AudioSegment: The combined voice audio
+        """
         combined_audio = None
         pause = AudioSegment.silent(duration=500)  # 500ms pause between chunks
         
-        for chunk in chunks:
-            voice_audio_bytes = self.client.generate(
-                text=chunk,
-                voice="Brian", 
-                model="eleven_multilingual_v2"
-            )
-            chunk_audio = AudioSegment.from_file(io.BytesIO(b"".join(voice_audio_bytes)), format="mp3")
-            
+        for chunk_audio in chunk_audios:
             if combined_audio is None:
                 combined_audio = chunk_audio
             else:
                 combined_audio += pause + chunk_audio
 
         return combined_audio
+
+    def _generate_voice(self, script: str) -> AudioSegment:
+        """
+        Generates the voice audio from the script by splitting into chunks and combining
+        Args:
+            script (str): The text to convert to speech
+        Returns:
+            AudioSegment: The generated voice audio
+        """
+        return self._join_chunks(self._synthesize_chunks(script))
     
     def _add_intro(self, voice_segment: AudioSegment, fade_duration: int = 3000) -> AudioSegment:
         """
@@ -100,24 +222,92 @@ class AudioGenerator:
         
         return final_audio.overlay(outro_segment, position=outro_position)
     
-    def generate(self, script: str) -> bytes:
+    def generate(self, script: str, checkpoint: Optional[RunCheckpoint] = None) -> bytes:
         """
         Generates complete audio with intro and outro
+        With AUDIO_ASSEMBLY=frames the MP3 frames of the voice are copied as they are, and the
+        whole episode is only decoded and encoded again if the chunks can't be assembled that way.
         Args:
             script (str): The podcast script to convert to audio
+            checkpoint (RunCheckpoint): Run directory where synthesized chunks are saved and resumed from
         Returns:
             bytes: The final audio as bytes
         """
-        # Generate and combine all audio elements
-        voice_segment = self._generate_voice(script)
-        with_intro = self._add_intro(voice_segment)
-        final_audio = self._add_outro(with_intro)
+        if self.assembly == "frames":
+            chunk_bytes = self._synthesize_chunks(script, checkpoint, decode=False)
+            try:
+                return Mp3Assembler().assemble(
+                    chunk_bytes,
+                    AudioSegment.from_file(self.intro_path),
+                    AudioSegment.from_file(self.outro_path)
+                )
+            except Mp3FormatError as e:
+                print(f"Can't assemble the MP3 frames ({e}), encoding the whole episode")
+            chunk_audios = [AudioSegment.from_file(io.BytesIO(chunk), format="mp3") for chunk in chunk_bytes]
+        else:
+            # Generate and combine all audio elements
+            chunk_audios = self._synthesize_chunks(script, checkpoint)
+
+        if self.assembly in ("numpy", "frames"):
+            final_audio = assemble_episode(
+                chunk_audios,
+                AudioSegment.from_file(self.intro_path),
+                AudioSegment.from_file(self.outro_path)
+            )
+        else:
+            voice_segment = self._join_chunks(chunk_audios)
+            with_intro = self._add_intro(voice_segment)
+            final_audio = self._add_outro(with_intro)
         
         # Export to bytes
         buffer = io.BytesIO()
         final_audio.export(buffer, format="mp3")
         return buffer.getvalue()
 
+    def generate_to_file(
+        self,
+        script: str,
+        path: str,
+        checkpoint: Optional[RunCheckpoint] = None,
+        hls_dir: Optional[str] = None,
+    ) -> str:
+        """
+        Generates complete audio with intro and outro and writes it to a file
+        With AUDIO_ASSEMBLY=disk the chunks are decoded one at a time into a memory-mapped spool
+        file and the episode is encoded straight to path, so it is never held in memory as a whole.
+        With hls_dir the episode is also written as an HLS stream, encoded from the same assembled
+        PCM as the file (laid out like AUDIO_ASSEMBLY=numpy unless the assembly is disk).
+        Args:
+            script (str): The podcast script to convert to audio
+            path (str): The MP3 file to write
+            checkpoint (RunCheckpoint): Run directory where synthesized chunks are saved and resumed from
+            hls_dir (str): Directory the HLS playlists and segments are written to
+        Returns:
+            str: The path of the audio file
+        """
+        if self.assembly != "disk" and hls_dir is None:
+            with open(path, "wb") as f:
+                f.write(self.generate(script, checkpoint))
+            return path
+
+        intro = AudioSegment.from_file(self.intro_path)
+        outro = AudioSegment.from_file(self.outro_path)
+        if self.assembly != "disk":
+            chunk_audios = self._synthesize_chunks(script, checkpoint)
+            timeline = TimelineFormat(chunk_audios + [intro, outro])
+            track = assemble_track([timeline.track(chunk) for chunk in chunk_audios],
+                                   timeline.track(intro), timeline.track(outro), timeline)
+            return encode_episode(track, path, hls_dir=hls_dir)
+
+        chunk_bytes = self._synthesize_chunks(script, checkpoint, decode=False)
+
+        def decoded_chunks():
+            # Each chunk is released once it is spooled
+            while chunk_bytes:
+                yield AudioSegment.from_file(io.BytesIO(chunk_bytes.pop(0)), format="mp3")
+
+        return assemble_episode_to_file(decoded_chunks(), intro, outro, path, hls_dir=hls_dir)
+
 if __name__ == "__main__":
     # Create output directory if it doesn't exist
     script = """
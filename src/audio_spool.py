@@ -0,0 +1,191 @@
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, List, Optional
+import numpy as np
+from pydub import AudioSegment
+from pydub.exceptions import CouldntEncodeError
+from audio_timeline import _DTYPES, PCMTrack, TimelineFormat, assemble_track
+from hls_output import write_hls_track
+
+# Raw PCM formats of ffmpeg by sample width
+_RAW_FORMATS = {1: "s8", 2: "s16le", 4: "s32le"}
+
+@dataclass
+class SpooledAudio:
+    """Where a decoded segment is stored in the spool file, and its format"""
+    offset: int
+    frame_count: int
+    channels: int
+    frame_rate: int
+    sample_width: int
+
+class PCMSpool:
+    """
+    Temporary file of decoded PCM audio, so an episode can be assembled without holding it in memory.
+    Segments are appended one at a time in their own format, and read back as tracks whose pieces
+    are memory-mapped views of the file: the operating system pages the samples in while they are
+    rendered, and can drop them again, so memory use doesn't grow with the length of the episode.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        """
+        Args:
+            directory (str): Directory of the spool file, by default AUDIO_SPOOL_DIR or the system's temporary directory
+        """
+        self.file = tempfile.NamedTemporaryFile(
+            prefix="episode-", suffix=".pcm", dir=directory or os.getenv('AUDIO_SPOOL_DIR') or None
+        )
+        self.segments: List[SpooledAudio] = []
+        self._size = 0
+
+    def __enter__(self) -> "PCMSpool":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Removes the spool file"""
+        self.file.close()
+
+    def append(self, segment: AudioSegment) -> SpooledAudio:
+        """Writes a decoded segment to the end of the spool file"""
+        data = segment.raw_data
+        self.file.write(data)
+        spooled = SpooledAudio(self._size, int(segment.frame_count()), segment.channels,
+                               segment.frame_rate, segment.sample_width)
+        self._size += len(data)
+        # Keep every segment aligned for the memory maps of 4 byte samples
+        padding = -self._size % 4
+        self.file.write(bytes(padding))
+        self._size += padding
+        self.segments.append(spooled)
+        return spooled
+
+    def track(self, spooled: SpooledAudio, timeline: TimelineFormat) -> PCMTrack:
+        """Reads a spooled segment back as a track of the timeline format, memory-mapped when no conversion is needed"""
+        self.file.flush()
+        if (spooled.frame_rate == timeline.frame_rate and spooled.sample_width == timeline.sample_width
+                and spooled.channels in (1, timeline.channels)):
+            samples = np.memmap(self.file.name, dtype=_DTYPES[spooled.sample_width], mode="r",
+                                offset=spooled.offset, shape=(spooled.frame_count, spooled.channels))
+            return PCMTrack([samples], timeline.frame_rate, timeline.sample_width, timeline.channels)
+        # Converted like TimelineFormat.track, only this segment is loaded into memory
+        with open(self.file.name, "rb") as f:
+            f.seek(spooled.offset)
+            data = f.read(spooled.frame_count * spooled.channels * spooled.sample_width)
+        return timeline.track(AudioSegment(data=data, sample_width=spooled.sample_width,
+                                           frame_rate=spooled.frame_rate, channels=spooled.channels))
+
+def encode_to_file(
+    track: PCMTrack,
+    path: str,
+    audio_format: str = "mp3",
+    block_frames: int = 1 << 16,
+):
+    """
+    Encodes a track with ffmpeg straight to a file, feeding it the samples block by block,
+    so neither the rendered PCM nor the encoded audio is ever held in memory as a whole.
+    The output is the same as exporting the rendered track with AudioSegment.export.
+    Args:
+        track (PCMTrack): The audio to encode
+        path (str): The output file, written to a temporary name and renamed once complete
+        audio_format (str): The output format
+        block_frames (int): Number of frames written to ffmpeg at a time
+    Raises:
+        CouldntEncodeError: If ffmpeg fails
+    """
+    # A temporary name of its own, so two runs encoding the same path don't write to the same file
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    os.close(descriptor)
+    command = [
+        AudioSegment.converter, "-y", "-loglevel", "error",
+        "-f", _RAW_FORMATS[track.sample_width], "-ar", str(track.frame_rate), "-ac", str(track.channels),
+        "-i", "pipe:0", "-f", audio_format, temporary_path,
+    ]
+    # ffmpeg's errors go to a file, a full stderr pipe would block it while it is being fed
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=errors)
+        try:
+            for block in track.blocks(block_frames):
+                process.stdin.write(block.tobytes())
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+            process.wait()
+        if process.returncode != 0:
+            errors.seek(0)
+            os.remove(temporary_path)
+            raise CouldntEncodeError(f"Encoding {path} failed: {errors.read().decode(errors='replace')}")
+    # mkstemp makes the file readable by its owner only
+    os.chmod(temporary_path, 0o644)
+    os.replace(temporary_path, path)
+
+def encode_episode(track: PCMTrack, path: str, audio_format: str = "mp3", hls_dir: Optional[str] = None) -> str:
+    """
+    Encodes an assembled episode to a file, and with hls_dir also to an HLS stream.
+    The file and every HLS rendition are encoded from the same PCM track, at the same time,
+    instead of the renditions being transcoded again from the encoded file.
+    Args:
+        track (PCMTrack): The assembled episode
+        path (str): The output file
+        audio_format (str): The output format
+        hls_dir (str): Directory the HLS playlists and segments are written to
+    Returns:
+        str: The path of the encoded episode
+    """
+    if hls_dir is None:
+        encode_to_file(track, path, audio_format)
+        return path
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        encoded = executor.submit(encode_to_file, track, path, audio_format)
+        write_hls_track(track, hls_dir)
+        encoded.result()
+    return path
+
+def assemble_episode_to_file(
+    chunks: Iterable[AudioSegment],
+    intro: AudioSegment,
+    outro: AudioSegment,
+    path: str,
+    audio_format: str = "mp3",
+    pause_duration: int = 500,
+    fade_duration: int = 3000,
+    spool_dir: Optional[str] = None,
+    hls_dir: Optional[str] = None,
+) -> str:
+    """
+    Assembles an episode like assemble_episode, out of core, and encodes it to a file.
+    The chunks are consumed one at a time and spooled to disk, so only one decoded chunk, the
+    intro and outro and the mixed fade windows are in memory at any time.
+    Args:
+        chunks (iterable): The decoded voice chunks, in order, e.g. a generator decoding them lazily
+        intro (AudioSegment): The intro music
+        outro (AudioSegment): The outro music
+        path (str): The output file
+        audio_format (str): The output format
+        pause_duration (int): Pause between chunks in milliseconds
+        fade_duration (int): Duration of the intro/outro fades in milliseconds
+        spool_dir (str): Directory of the temporary PCM file
+        hls_dir (str): Directory the episode is also written to as an HLS stream, see encode_episode
+    Returns:
+        str: The path of the encoded episode
+    """
+    with PCMSpool(spool_dir) as spool:
+        for chunk in chunks:
+            spool.append(chunk)
+        timeline = TimelineFormat(spool.segments + [intro, outro])
+        track = assemble_track(
+            [spool.track(spooled, timeline) for spooled in spool.segments],
+            timeline.track(intro),
+            timeline.track(outro),
+            timeline,
+            pause_duration,
+            fade_duration,
+        )
+        encode_episode(track, path, audio_format, hls_dir)
+    return path
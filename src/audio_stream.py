@@ -0,0 +1,245 @@
+import subprocess
+import tempfile
+import threading
+from typing import List, Optional
+from pydub import AudioSegment
+from pydub.exceptions import CouldntEncodeError
+from audio_spool import _RAW_FORMATS
+from audio_timeline import _frames
+from hls_output import ENCODER_DELAY
+from mp3_frames import Mp3Frame, _parse_header, self_contained_frame
+
+class StreamingEncoder:
+    """
+    Encodes audio written to it part by part as one continuous stream, with a single ffmpeg process.
+    The parts returned by write and close concatenate to one file: only the first starts with the
+    ID3 tag, and there is no encoder delay, padding or silence between parts.
+    ffmpeg can't write the Xing header that tells players to skip the encoder delay to a pipe, so MP3
+    is primed like an HLS segment instead (see HlsWriter): the frames before the first sample are
+    dropped and the first kept frame is repacked to not need them, so the stream decodes from the
+    first sample on. The frames that only hold the encoder's padding are dropped at the end, and the
+    stream decodes to the samples written, plus less than one frame of silence.
+    """
+
+    def __init__(self, audio_format: str = "mp3"):
+        self.audio_format = audio_format
+        self._process: Optional[subprocess.Popen] = None
+        self._reader: Optional[threading.Thread] = None
+        self._errors = None
+        # Bytes read from ffmpeg and not returned yet
+        self._output = bytearray()
+        self._lock = threading.Lock()
+        self._segment: Optional[AudioSegment] = None
+        self._samples = 0
+        self._buffer = b""
+        self._frame_index = 0
+        # Frames dropped before the first sample, their bit reservoir is moved into the first kept frame
+        self._skipped: List[Mp3Frame] = []
+
+    def _start(self, segment: AudioSegment):
+        self._segment = segment
+        frame_samples = 1152 if segment.frame_rate >= 32000 else 576
+        self.skipped_frames = ENCODER_DELAY // frame_samples + 1
+        command = [
+            AudioSegment.converter, "-loglevel", "error",
+            "-f", _RAW_FORMATS[segment.sample_width], "-ar", str(segment.frame_rate), "-ac", str(segment.channels),
+            "-i", "pipe:0", "-flush_packets", "1", "-f", self.audio_format, "pipe:1",
+        ]
+        # A file, a full stderr pipe would block ffmpeg
+        self._errors = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self._errors)
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+        if self.audio_format == "mp3":
+            # Silence that fills the skipped frames up to the first sample
+            preroll = self.skipped_frames * frame_samples - ENCODER_DELAY
+            self._process.stdin.write(bytes(preroll * segment.frame_width))
+
+    def _read(self):
+        while True:
+            data = self._process.stdout.read1(1 << 16)
+            if not data:
+                return
+            with self._lock:
+                self._output += data
+
+    def write(self, segment: AudioSegment) -> bytes:
+        """
+        Adds audio to the end of the stream
+        Args:
+            segment (AudioSegment): The next part of the audio, converted to the format of the first part
+        Returns:
+            bytes: The audio encoded since the last call, possibly empty
+        """
+        if not len(segment):
+            return self._take()
+        if self._process is None:
+            self._start(segment)
+        else:
+            segment = (segment.set_frame_rate(self._segment.frame_rate).set_channels(self._segment.channels)
+                       .set_sample_width(self._segment.sample_width))
+        try:
+            self._process.stdin.write(segment.raw_data)
+        except BrokenPipeError:
+            self.close()
+        self._samples += int(segment.frame_count())
+        return self._take()
+
+    def close(self) -> bytes:
+        """
+        Ends the stream
+        Returns:
+            bytes: The rest of the encoded stream
+        Raises:
+            CouldntEncodeError: If ffmpeg fails
+        """
+        if self._process is None:
+            return b""
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self._process.wait()
+        self._reader.join()
+        if self._process.returncode != 0:
+            self._errors.seek(0)
+            raise CouldntEncodeError(f"Encoding the stream failed: {self._errors.read().decode(errors='replace')}")
+        self._errors.close()
+        return self._take(final=True)
+
+    def _take(self, final: bool = False) -> bytes:
+        with self._lock:
+            data = bytes(self._output)
+            self._output.clear()
+        if self.audio_format != "mp3":
+            return data
+
+        buffer = self._buffer + data
+        parts = []
+        offset = 0
+        if self._frame_index == 0 and not self._skipped and buffer[:3] == b"ID3":
+            # Wait for the whole tag
+            size = 10 + ((buffer[6] & 0x7F) << 21 | (buffer[7] & 0x7F) << 14
+                         | (buffer[8] & 0x7F) << 7 | (buffer[9] & 0x7F)) if len(buffer) >= 10 else None
+            if size is None or len(buffer) < size:
+                self._buffer = buffer
+                return b""
+            parts.append(buffer[:size])
+            offset = size
+        while True:
+            frame = _parse_header(buffer, offset)
+            if frame is None:
+                break
+            offset += len(frame.data)
+            if self._frame_index == 0 and not self._skipped and frame.is_vbr_header():
+                continue
+            index = self._frame_index - self.skipped_frames
+            self._frame_index += 1
+            if index < 0:
+                self._skipped.append(frame)
+            elif final and index * frame.samples >= self._samples:
+                # Only encoder padding
+                continue
+            elif index == 0:
+                parts.append(self_contained_frame(self._skipped + [frame], len(self._skipped)))
+            else:
+                parts.append(frame.data)
+        self._buffer = buffer[offset:]
+        return b"".join(parts)
+
+class StreamingAssembler:
+    """
+    Assembles an episode section by section and encodes each part as soon as it is known.
+    Lays out the episode like assemble_episode, with the intro fading into the first
+    section, pauses between sections and the outro fading in over the end of the voice
+    (the parts are split on frame boundaries and together have the same samples).
+    The last fade_duration ms of voice are held back after each section, because they are
+    only final once it is known whether the outro will be mixed over them.
+    """
+
+    def __init__(
+        self,
+        intro: AudioSegment,
+        outro: AudioSegment,
+        pause_duration: int = 500,
+        fade_duration: int = 3000,
+        audio_format: str = "mp3",
+    ):
+        self.intro = intro
+        self.outro = outro
+        self.pause_duration = pause_duration
+        self.fade_duration = fade_duration
+        self.audio_format = audio_format
+        # One encoder for the whole episode, so the encoded parts play back to back
+        self._encoder = StreamingEncoder(audio_format)
+        # Voice received before there was enough of it to mix with the intro
+        self._voice: Optional[AudioSegment] = None
+        # Last fade_duration ms of the assembled audio, not encoded yet
+        self._tail: Optional[AudioSegment] = None
+        # Frames of audio returned so far
+        self._position = 0
+
+    def _with_intro(self, voice: AudioSegment) -> AudioSegment:
+        # Voice starts fade_duration before the end of the fading out intro music, clamped like assemble_track
+        fade = min(self.fade_duration, len(self.intro), len(voice))
+        intro = self.intro.fade_out(fade)
+        audio = intro.overlay(voice[:fade], position=len(intro) - fade)
+        # Not voice[fade:], which pads the voice to whole milliseconds when more sections may follow
+        return audio + voice.get_sample_slice(_frames(fade, voice.frame_rate), None)
+
+    def push(self, voice: AudioSegment) -> bytes:
+        """
+        Adds the voice of the next section.
+        Args:
+            voice (AudioSegment): The synthesized section
+        Returns:
+            bytes: The encoded audio that is now final, empty if there is none yet
+        """
+        audio = self.push_audio(voice)
+        return self._encoder.write(audio) if audio is not None else b""
+
+    def push_audio(self, voice: AudioSegment) -> Optional[AudioSegment]:
+        """Like push, but returns the final audio without encoding it, None if there is none yet"""
+        pause = AudioSegment.silent(duration=self.pause_duration)
+        if self._tail is None:
+            # The intro is mixed over the first fade_duration ms of voice, which can span several sections
+            self._voice = voice if self._voice is None else self._voice + pause + voice
+            if len(self._voice) < min(self.fade_duration, len(self.intro)):
+                return None
+            audio = self._with_intro(self._voice)
+            self._voice = None
+        else:
+            audio = self._tail + pause + voice
+
+        # Split on a frame boundary, millisecond slices could pad the parts with a frame of silence
+        final_frames = max(int(audio.frame_count()) - int(self.fade_duration * audio.frame_rate / 1000), 0)
+        self._tail = audio.get_sample_slice(final_frames, None)
+        self._position += final_frames
+        return audio.get_sample_slice(0, final_frames) if final_frames else None
+
+    def finish(self) -> bytes:
+        """
+        Mixes the fading in outro over the end of the voice.
+        Returns:
+            bytes: The last encoded part of the episode
+        """
+        return self._encoder.write(self.finish_audio()) + self._encoder.close()
+
+    def finish_audio(self) -> AudioSegment:
+        """Like finish, but returns the last part of the episode without encoding it"""
+        if self._tail is None:
+            audio = self._with_intro(self._voice or AudioSegment.silent(duration=0))
+        else:
+            audio = self._tail
+        # Positions in ms of the whole episode, as assemble_episode rounds them
+        length = round(1000 * (self._position + int(audio.frame_count())) / audio.frame_rate)
+        fade = min(self.fade_duration, length, len(self.outro))
+        outro = self.outro.fade_in(fade)
+        outro_position = length - fade
+        if outro_position + len(outro) > length:
+            audio += AudioSegment.silent(duration=outro_position + len(outro) - length)
+        start = max(_frames(outro_position, audio.frame_rate) - self._position, 0)
+        self._voice = None
+        self._tail = None
+        self._position = 0
+        return audio.get_sample_slice(0, start) + audio.get_sample_slice(start, None).overlay(outro)
@@ -0,0 +1,257 @@
+from typing import Iterator, List, Optional
+import numpy as np
+from pydub import AudioSegment
+from pydub.utils import db_to_float
+
+_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}
+
+def _frames(ms: float, frame_rate: int) -> int:
+    """Millisecond to frame conversion, rounded exactly like pydub does."""
+    return int(ms * (frame_rate / 1000.0))
+
+def _mul(samples: np.ndarray, factor: np.ndarray, sample_width: int) -> np.ndarray:
+    """Vectorized audioop.mul: scale, floor and clip to the sample range."""
+    info = np.iinfo(_DTYPES[sample_width])
+    scaled = np.floor(samples.astype(np.float64) * factor)
+    return np.clip(scaled, info.min, info.max).astype(samples.dtype)
+
+def _add(a: np.ndarray, b: np.ndarray, sample_width: int) -> np.ndarray:
+    """Vectorized audioop.add: sum and clip to the sample range."""
+    info = np.iinfo(_DTYPES[sample_width])
+    return np.clip(a.astype(np.int64) + b, info.min, info.max).astype(a.dtype)
+
+class PCMTrack:
+    """
+    An immutable sequence of PCM arrays of shape (frames, channels), or (frames, 1) for
+    mono audio that is duplicated into every channel when rendered.
+    Slicing and concatenation only create views of the underlying arrays, so samples
+    are copied once, when the track is rendered into its final buffer.
+    Millisecond positions follow pydub's rounding, so operations on a track give the
+    same samples as the equivalent AudioSegment operations.
+    """
+
+    def __init__(self, pieces: List[np.ndarray], frame_rate: int, sample_width: int, channels: int):
+        self.pieces = [piece for piece in pieces if len(piece)]
+        self.frame_rate = frame_rate
+        self.sample_width = sample_width
+        self.channels = channels
+        self.frame_count = sum(len(piece) for piece in self.pieces)
+
+    def __len__(self) -> int:
+        """Length in milliseconds, like len(AudioSegment)"""
+        return round(1000 * (self.frame_count / self.frame_rate))
+
+    def __add__(self, other: "PCMTrack") -> "PCMTrack":
+        return self._spawn(self.pieces + other.pieces)
+
+    def _spawn(self, pieces: List[np.ndarray]) -> "PCMTrack":
+        return PCMTrack(pieces, self.frame_rate, self.sample_width, self.channels)
+
+    def zeros(self, frame_count: int) -> np.ndarray:
+        return np.zeros((frame_count, self.channels), dtype=_DTYPES[self.sample_width])
+
+    def frames(self, start: int, end: int) -> "PCMTrack":
+        """Returns frames [start, end), clipped to the track, as views"""
+        pieces = []
+        offset = 0
+        for piece in self.pieces:
+            piece_start, piece_end = max(start - offset, 0), min(end - offset, len(piece))
+            if piece_start < piece_end:
+                pieces.append(piece[piece_start:piece_end])
+            offset += len(piece)
+            if offset >= end:
+                break
+        return self._spawn(pieces)
+
+    def _padded_frames(self, start: int, end: int) -> "PCMTrack":
+        # Like AudioSegment.__getitem__: a slice running past the end is padded
+        # with silence, unless there is no data at all in it
+        track = self.frames(start, end)
+        missing = (end - start) - track.frame_count
+        if missing > 0 and track.frame_count:
+            track = track + self._spawn([self.zeros(missing)])
+        return track
+
+    def slice(self, start: Optional[float] = None, end: Optional[float] = None) -> "PCMTrack":
+        """Equivalent of segment[start:end] with positions in milliseconds"""
+        start = min(start if start is not None else 0, len(self))
+        end = min(end if end is not None else len(self), len(self))
+        return self._padded_frames(_frames(start, self.frame_rate), _frames(end, self.frame_rate))
+
+    def materialize(self) -> np.ndarray:
+        if len(self.pieces) == 1:
+            return self.pieces[0]
+        if not self.pieces:
+            return self.zeros(0)
+        return np.concatenate([np.broadcast_to(piece, (len(piece), self.channels)) for piece in self.pieces])
+
+    def fade(self, to_gain: float = 0, from_gain: float = 0, start: Optional[float] = None,
+             end: Optional[float] = None, duration: Optional[int] = None) -> "PCMTrack":
+        """
+        Equivalent of AudioSegment.fade for fades longer than 100ms (one gain step per ms),
+        with the gain curve applied as a single vectorized multiplication.
+        """
+        start = min(len(self), start) if start is not None else None
+        end = min(len(self), end) if end is not None else None
+        if duration is not None:
+            if start is not None:
+                end = start + duration
+            elif end is not None:
+                start = end - duration
+        else:
+            duration = end - start
+        if duration <= 100:
+            raise ValueError("PCMTrack.fade only supports fades longer than 100ms")
+
+        from_power = db_to_float(from_gain)
+        before_fade = self.slice(None, start)
+        if from_gain != 0:
+            before_fade = self._spawn([_mul(before_fade.materialize(), from_power, self.sample_width)])
+
+        # Each millisecond of the fade is a separate slice with its own gain step
+        bounds = np.array([_frames(start + i, self.frame_rate) for i in range(duration + 1)])
+        available = np.clip(self.frame_count - bounds[:-1], 0, np.diff(bounds))
+        lengths = np.where(available > 0, np.diff(bounds), 0)
+        scale_step = (db_to_float(to_gain) - from_power) / duration
+        gains = from_power + scale_step * np.arange(duration)
+        fading = self._padded_frames(int(bounds[0]), int(bounds[0] + lengths.sum())).materialize()
+        faded = _mul(fading, np.repeat(gains, lengths)[:, None], self.sample_width)
+
+        after_fade = self.slice(end, None)
+        if to_gain != 0:
+            after_fade = self._spawn([_mul(after_fade.materialize(), db_to_float(to_gain), self.sample_width)])
+
+        return before_fade + self._spawn([faded]) + after_fade
+
+    def fade_out(self, duration: int) -> "PCMTrack":
+        return self.fade(to_gain=-120, duration=duration, end=float('inf'))
+
+    def fade_in(self, duration: int) -> "PCMTrack":
+        return self.fade(from_gain=-120, duration=duration, start=0)
+
+    def overlay(self, other: "PCMTrack", position: float = 0) -> "PCMTrack":
+        """Equivalent of AudioSegment.overlay(other, position), only the overlapping frames are mixed"""
+        head = self.slice(None, position)
+        rest = self.slice(position, None)
+        overlap = min(rest.frame_count, other.frame_count)
+        mixed = _add(rest.frames(0, overlap).materialize(), other.frames(0, overlap).materialize(), self.sample_width)
+        return head + self._spawn([mixed]) + rest.frames(overlap, rest.frame_count)
+
+    def blocks(self, block_frames: int = 1 << 16) -> Iterator[np.ndarray]:
+        """Yields the track as contiguous (frames, channels) arrays of up to block_frames frames, rendering one at a time"""
+        for piece in self.pieces:
+            for start in range(0, len(piece), block_frames):
+                block = piece[start:start + block_frames]
+                yield np.ascontiguousarray(np.broadcast_to(block, (len(block), self.channels)))
+
+    def render(self) -> np.ndarray:
+        """Copies every piece into one preallocated buffer"""
+        buffer = self.zeros(self.frame_count)
+        offset = 0
+        for piece in self.pieces:
+            buffer[offset:offset + len(piece)] = piece
+            offset += len(piece)
+        return buffer
+
+    def to_segment(self) -> AudioSegment:
+        return AudioSegment(
+            data=self.render().tobytes(),
+            sample_width=self.sample_width,
+            frame_rate=self.frame_rate,
+            channels=self.channels,
+        )
+
+class TimelineFormat:
+    """The common channels, frame rate and sample width of all the episode's audio, like pydub's _sync"""
+
+    def __init__(self, segments: List[AudioSegment]):
+        self.channels = max(segment.channels for segment in segments)
+        self.frame_rate = max(segment.frame_rate for segment in segments)
+        self.sample_width = max(segment.sample_width for segment in segments)
+        if self.sample_width not in _DTYPES:
+            self.sample_width = 4
+
+    def track(self, segment: AudioSegment) -> PCMTrack:
+        """Decodes a segment into a track, converting it to the common format"""
+        # Mono is kept as a single column and broadcast later, which is what
+        # set_channels does for mono audio, without copying the samples
+        if segment.channels != 1:
+            segment = segment.set_channels(self.channels)
+        segment = segment.set_frame_rate(self.frame_rate).set_sample_width(self.sample_width)
+        samples = np.frombuffer(segment.raw_data, dtype=_DTYPES[self.sample_width])
+        return PCMTrack([samples.reshape(-1, segment.channels)], self.frame_rate, self.sample_width, self.channels)
+
+    def silence(self, duration: int) -> PCMTrack:
+        """Silence with the exact frame count of a converted AudioSegment.silent(duration)"""
+        return self.track(AudioSegment.silent(duration=duration))
+
+def assemble_track(
+    voice_tracks: List[PCMTrack],
+    intro: PCMTrack,
+    outro: PCMTrack,
+    timeline: TimelineFormat,
+    pause_duration: int = 500,
+    fade_duration: int = 3000,
+) -> PCMTrack:
+    """
+    Lays out the episode from tracks already in the timeline format, see assemble_episode.
+    The returned track only holds views of the voice tracks, apart from the pauses and the
+    windows where the intro and outro are mixed in, so nothing is copied until it is rendered.
+    """
+    # Voice: chunks separated by pauses
+    voice = voice_tracks[0]
+    pause = timeline.silence(pause_duration)
+    for track in voice_tracks[1:]:
+        voice = voice + pause + track
+
+    # Intro: voice starts fade_duration before the end of the fading out intro music,
+    # the crossfade is clamped to the shorter track like AudioSegment.append(crossfade=...)
+    intro_fade = min(fade_duration, len(intro), len(voice))
+    intro_track = intro.fade_out(intro_fade)
+    voice_overlap = voice.slice(None, intro_fade)
+    voice_remaining = voice.slice(intro_fade, None)
+    with_intro = intro_track.overlay(voice_overlap, position=len(intro_track) - intro_fade) + voice_remaining
+
+    # Outro: fading in outro music starts fade_duration before the voice ends
+    outro_fade = min(fade_duration, len(with_intro), len(outro))
+    outro_track = outro.fade_in(outro_fade)
+    outro_position = len(with_intro) - outro_fade
+    total_length = max(len(with_intro), outro_position + len(outro_track))
+    if total_length > len(with_intro):
+        with_intro = with_intro + timeline.silence(total_length - len(with_intro))
+
+    return with_intro.overlay(outro_track, position=outro_position)
+
+def assemble_episode(
+    chunks: List[AudioSegment],
+    intro: AudioSegment,
+    outro: AudioSegment,
+    pause_duration: int = 500,
+    fade_duration: int = 3000,
+) -> AudioSegment:
+    """
+    Assembles voice chunks, pauses and faded intro/outro music into the final episode.
+    Produces the same samples as joining chunks with `+` and calling AudioGenerator._add_intro
+    and _add_outro when all inputs share a frame rate and the intro and outro are at least
+    fade_duration long, but without copying the whole episode at every step: each input is
+    decoded once and written once into the output buffer. A shorter intro or outro is
+    crossfaded over its whole length, where _add_intro would overlay the voice at a negative
+    position and drop part of it.
+    Args:
+        chunks (list): The synthesized voice chunks, in order
+        intro (AudioSegment): The intro music
+        outro (AudioSegment): The outro music
+        pause_duration (int): Pause between chunks in milliseconds
+        fade_duration (int): Duration of the intro/outro fades in milliseconds
+    Returns:
+        AudioSegment: The final episode audio
+    """
+    timeline = TimelineFormat(chunks + [intro, outro])
+    return assemble_track(
+        [timeline.track(chunk) for chunk in chunks],
+        timeline.track(intro),
+        timeline.track(outro),
+        timeline,
+        pause_duration,
+        fade_duration,
+    ).to_segment()
@@ -0,0 +1,135 @@
+import json
+import os
+import re
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+from podcast_generator import PodcastContent, PodcastGenerator
+
+def read_topics(path: str) -> List[str]:
+    """Reads one topic per line, skipping blank lines and lines starting with '#'"""
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith("#")]
+
+def topic_slug(topic: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", topic.lower()).strip("_")
+
+def save_episode(content: PodcastContent, topic: str, output_dir: str, hls: bool = False) -> str:
+    """
+    Writes the artifacts of an episode to output_dir/<topic slug>/
+    With hls, the HLS stream generated with the episode is also written to its hls/ directory.
+    Returns:
+        str: The episode directory
+    """
+    episode_dir = os.path.join(output_dir, topic_slug(topic))
+    os.makedirs(episode_dir, exist_ok=True)
+    with open(os.path.join(episode_dir, "script.txt"), "w") as f:
+        f.write(content.script)
+    audio_path = os.path.join(episode_dir, "episode.mp3")
+    content.save_audio(audio_path)
+    if hls:
+        content.save_hls(os.path.join(episode_dir, "hls"))
+    with open(os.path.join(episode_dir, "cover_image_url.txt"), "w") as f:
+        f.write(content.cover_image_url)
+    with open(os.path.join(episode_dir, "tweet.txt"), "w") as f:
+        f.write(content.tweet)
+    with open(os.path.join(episode_dir, "report.json"), "w") as f:
+        json.dump({"topic": topic, "stage_timings": content.stage_timings, "usage": content.usage_report}, f, indent=2)
+    return episode_dir
+
+class BatchRunner:
+    """
+    Generates many episodes with a shared worker pool.
+    Clients are created once and shared by all episodes, and each stage has its own
+    concurrency limit, so e.g. many scripts can be written while only a few episodes
+    are synthesized at the same time.
+    """
+
+    def __init__(
+        self,
+        output_dir: str = "generated_episodes",
+        episode_workers: Optional[int] = None,
+        stage_workers: Optional[Dict[str, int]] = None,
+        hls: bool = False,
+    ):
+        """
+        Args:
+            output_dir (str): Directory the episodes are written to
+            episode_workers (int): Maximum number of episodes in progress at the same time
+            stage_workers (dict): Maximum number of episodes running each stage
+                ("script", "audio", "cover_image", "tweet") at the same time
+            hls (bool): Whether to also write the audio of each episode as an HLS stream
+        """
+        self.output_dir = output_dir
+        self.hls = hls
+        self.episode_workers = episode_workers or int(os.getenv('BATCH_EPISODE_WORKERS', '4'))
+        stage_workers = stage_workers or {}
+        self.stage_slots = {
+            stage: threading.BoundedSemaphore(stage_workers.get(stage) or int(os.getenv(f'BATCH_{stage.upper()}_WORKERS', default)))
+            for stage, default in (("script", "4"), ("audio", "2"), ("cover_image", "2"), ("tweet", "4"))
+        }
+
+        # Stateless generators and clients, shared by every episode.
+        # Imported here so that main.py starts without loading the client libraries
+        from script_generation_v3 import ContentSearcher
+        from audio_generation import AudioGenerator
+        from cover_image_generation import CoverImageGenerator
+        from tweet_generation import TweetGenerator
+
+        self.searcher = ContentSearcher()
+        self.audio_generator = AudioGenerator()
+        self.cover_image_generator = CoverImageGenerator()
+        self.tweet_generator = TweetGenerator()
+
+    def _generator(self) -> PodcastGenerator:
+        # ScriptGenerator keeps the retrieval chain of the episode it is writing,
+        # so each episode gets its own one on top of the shared searcher
+        from script_generation_v3 import ScriptGenerator
+
+        return PodcastGenerator(
+            script_generator=ScriptGenerator(searcher=self.searcher),
+            audio_generator=self.audio_generator,
+            cover_image_generator=self.cover_image_generator,
+            tweet_generator=self.tweet_generator,
+            stage_slots=self.stage_slots,
+        )
+
+    def _run_episode(self, topic: str) -> str:
+        content = self._generator().generate_podcast(topic, hls=self.hls)
+        return save_episode(content, topic, self.output_dir, self.hls)
+
+    def run(self, topics: List[str]) -> Dict[str, Dict]:
+        """
+        Generates an episode for every topic, writing each one to disk as soon as it is done.
+        A failed episode doesn't stop the batch, its error is written next to the other episodes.
+        Returns:
+            dict: For each topic, its status, duration and episode directory or error
+        """
+        results = {}
+        started = time.perf_counter()
+        print(f"Generating {len(topics)} episodes ({self.episode_workers} at a time)")
+
+        with ThreadPoolExecutor(max_workers=self.episode_workers) as executor:
+            futures = {executor.submit(self._run_episode, topic): (topic, time.perf_counter()) for topic in topics}
+            for future in as_completed(futures):
+                topic, submitted = futures[future]
+                duration = time.perf_counter() - submitted
+                try:
+                    episode_dir = future.result()
+                    results[topic] = {"status": "done", "seconds": duration, "path": episode_dir}
+                    print(f"Episode '{topic}' saved to {episode_dir} ({duration:.0f}s)")
+                except Exception as e:
+                    error_dir = os.path.join(self.output_dir, topic_slug(topic))
+                    os.makedirs(error_dir, exist_ok=True)
+                    with open(os.path.join(error_dir, "error.txt"), "w") as f:
+                        f.write(traceback.format_exc())
+                    results[topic] = {"status": "failed", "seconds": duration, "error": str(e)}
+                    print(f"Episode '{topic}' failed: {e}")
+
+        elapsed = time.perf_counter() - started
+        done = sum(result["status"] == "done" for result in results.values())
+        print(f"\nBatch finished: {done}/{len(topics)} episodes in {elapsed:.0f}s "
+              f"({done / elapsed * 3600:.1f} episodes/hour)")
+        return results
@@ -0,0 +1,193 @@
+import json
+import os
+import re
+import shutil
+import tempfile
+from typing import Any, Callable, Optional
+from env import load_env
+
+# Load environment variables from .env file
+load_env()
+
+class RunCheckpoint:
+    """
+    Local run directory where the pipeline saves each completed unit of work
+    (search results, concepts, script sections, TTS chunks, cover image, tweet).
+    A failed or killed run started again on the same directory skips the units
+    that were already completed.
+    Files are written to a temporary name and then renamed, so an interrupted
+    write never leaves a truncated checkpoint behind.
+    """
+
+    COMPLETE_MARKER = "complete"
+
+    def __init__(self, run_dir: str):
+        self.run_dir = run_dir
+        os.makedirs(run_dir, exist_ok=True)
+
+    @classmethod
+    def for_topic(cls, topic: str, root: Optional[str] = None) -> "RunCheckpoint":
+        """
+        Returns the run directory of a topic under root (CHECKPOINT_DIR, by default .runs).
+        The directory of a run that already completed is cleared, so only failed runs are resumed.
+        """
+        root = root or os.getenv('CHECKPOINT_DIR', '.runs')
+        slug = re.sub(r"[^a-z0-9]+", "_", topic.lower()).strip("_")
+        checkpoint = cls(os.path.join(root, slug))
+        if checkpoint.exists(cls.COMPLETE_MARKER):
+            checkpoint.clear()
+        return checkpoint
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.run_dir, name)
+
+    @staticmethod
+    def _temporary_file(path: str) -> str:
+        """
+        Creates an empty file next to path to write it under, with a name of its own
+        so that two runs of the same topic don't write to the same temporary file.
+        """
+        descriptor, temporary_path = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".tmp"
+        )
+        os.close(descriptor)
+        # mkstemp makes the file readable by its owner only
+        os.chmod(temporary_path, 0o644)
+        return temporary_path
+
+    def _write(self, name: str, data: bytes):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = self._temporary_file(path)
+        try:
+            with open(temporary_path, "wb") as f:
+                f.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self._path(name))
+
+    def load_bytes(self, name: str) -> Optional[bytes]:
+        if not self.exists(name):
+            return None
+        with open(self._path(name), "rb") as f:
+            return f.read()
+
+    def save_bytes(self, name: str, data: bytes):
+        self._write(name, data)
+
+    def load_json(self, name: str) -> Any:
+        data = self.load_bytes(name)
+        return None if data is None else json.loads(data)
+
+    def save_json(self, name: str, value: Any):
+        self._write(name, json.dumps(value, indent=2).encode("utf-8"))
+
+    def cached_json(self, name: str, fn: Callable[[], Any]) -> Any:
+        """Returns the checkpointed value of name, or computes it with fn and checkpoints it"""
+        value = self.load_json(name)
+        if value is not None:
+            print(f"Resuming from checkpoint: {name}")
+            return value
+        value = fn()
+        self.save_json(name, value)
+        return value
+
+    def cached_bytes(self, name: str, fn: Callable[[], bytes]) -> bytes:
+        """Same as cached_json for binary data"""
+        data = self.load_bytes(name)
+        if data is not None:
+            print(f"Resuming from checkpoint: {name}")
+            return data
+        data = fn()
+        self.save_bytes(name, data)
+        return data
+
+    def cached_file(self, name: str, fn: Callable[[str], Any]) -> str:
+        """
+        Returns the path of the checkpointed file name, or has fn write it first.
+        fn receives a temporary path to write to, which is renamed to name once it returns,
+        so large outputs go straight to disk without being held in memory.
+        """
+        path = self._path(name)
+        if os.path.exists(path):
+            print(f"Resuming from checkpoint: {name}")
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = self._temporary_file(path)
+        try:
+            fn(temporary_path)
+            os.replace(temporary_path, path)
+        except BaseException:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+        return path
+
+    def cached_dir(self, name: str, fn: Callable[[str], Any]) -> str:
+        """Same as cached_file for a directory, fn receives an empty temporary directory to write its files to"""
+        path = self._path(name)
+        if os.path.exists(path):
+            print(f"Resuming from checkpoint: {name}")
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = tempfile.mkdtemp(dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+        # mkdtemp makes the directory readable by its owner only
+        os.chmod(temporary_path, 0o755)
+        try:
+            fn(temporary_path)
+        except BaseException:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            raise
+        try:
+            os.replace(temporary_path, path)
+        except OSError:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+            # A directory can't replace a non-empty one: another run of the topic renamed its directory into place first
+            if not os.path.isdir(path):
+                raise
+        return path
+
+    def mark_complete(self):
+        """Marks the run as completed, a new run of the topic will start from scratch"""
+        self.save_json(self.COMPLETE_MARKER, True)
+
+    def clear(self):
+        shutil.rmtree(self.run_dir, ignore_errors=True)
+        os.makedirs(self.run_dir, exist_ok=True)
+
+class NullCheckpoint(RunCheckpoint):
+    """Checkpoint that saves nothing, used when a run is not checkpointed"""
+
+    def __init__(self):
+        self.run_dir = None
+
+    def exists(self, name: str) -> bool:
+        return False
+
+    def load_bytes(self, name: str) -> Optional[bytes]:
+        return None
+
+    def _write(self, name: str, data: bytes):
+        pass
+
+    def cached_file(self, name: str, fn: Callable[[str], Any]) -> str:
+        # Not checkpointed, but the file still has to be written somewhere
+        descriptor, path = tempfile.mkstemp(suffix=f"-{os.path.basename(name)}")
+        os.close(descriptor)
+        fn(path)
+        return path
+
+    def cached_dir(self, name: str, fn: Callable[[str], Any]) -> str:
+        path = tempfile.mkdtemp(suffix=f"-{os.path.basename(name)}")
+        fn(path)
+        return path
+
+    def mark_complete(self):
+        pass
+
+    def clear(self):
+        pass
@@ -0,0 +1,120 @@
+import atexit
+import os
+import threading
+from typing import Dict, Optional, Tuple
+from env import load_env
+
+# Load environment variables from .env file
+load_env()
+
+# Connection pools per host: OpenAI chat, embeddings and images all go to api.openai.com,
+# so they share one pool. The sizes are overridden by HTTP_<PROVIDER>_MAX_CONNECTIONS.
+# The OpenAI clients don't retry on their own: a 429 has to reach the provider's ProviderLimiter,
+# which backs off for every caller and is the only layer that retries.
+DEFAULT_POOL_SIZES = {
+    "openai": 32,
+    "elevenlabs": 8,
+}
+
+_http_clients: Dict[str, "httpx.Client"] = {}
+_clients: Dict[Tuple, object] = {}
+_lock = threading.Lock()
+
+def _setting(provider: str, name: str, default: str) -> str:
+    """Reads HTTP_<PROVIDER>_<NAME>, falling back to HTTP_<NAME> and then to the default"""
+    return os.getenv(f"HTTP_{provider.upper()}_{name}", os.getenv(f"HTTP_{name}", default))
+
+def _http_client(provider: str) -> "httpx.Client":
+    # Called with _lock held
+    if provider not in _http_clients:
+        import httpx
+
+        max_connections = int(_setting(provider, "MAX_CONNECTIONS", str(DEFAULT_POOL_SIZES.get(provider, 16))))
+        _http_clients[provider] = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=int(_setting(provider, "MAX_KEEPALIVE", str(max_connections))),
+                keepalive_expiry=float(_setting(provider, "KEEPALIVE_EXPIRY", "60")),
+            ),
+            timeout=httpx.Timeout(
+                float(_setting(provider, "TIMEOUT", "120")),
+                connect=float(_setting(provider, "CONNECT_TIMEOUT", "10")),
+            ),
+            follow_redirects=True,
+        )
+    return _http_clients[provider]
+
+def get_http_client(provider: str) -> "httpx.Client":
+    """
+    Returns the process-wide keep-alive connection pool of a provider.
+    Pool size and timeouts are read from HTTP_<PROVIDER>_MAX_CONNECTIONS, _MAX_KEEPALIVE,
+    _KEEPALIVE_EXPIRY, _TIMEOUT and _CONNECT_TIMEOUT (or the same settings without the provider).
+    """
+    with _lock:
+        return _http_client(provider)
+
+def _get_or_create(key: Tuple, create):
+    with _lock:
+        if key not in _clients:
+            _clients[key] = create()
+        return _clients[key]
+
+def get_chat_model(model: str = "gpt-4o", temperature: Optional[float] = None) -> "ChatOpenAI":
+    """Returns the shared chat model for a model and temperature, all of them use the OpenAI pool"""
+    def create():
+        from langchain_openai.chat_models import ChatOpenAI
+        return ChatOpenAI(
+            model=model,
+            temperature=temperature,
+            openai_api_key=os.getenv('OPENAI_API_KEY'),
+            http_client=_http_client("openai"),
+            max_retries=0,
+        )
+    return _get_or_create(("chat", model, temperature), create)
+
+def get_embeddings(model: str = "text-embedding-ada-002") -> "OpenAIEmbeddings":
+    """Returns the shared OpenAI embeddings client"""
+    def create():
+        from langchain_openai.embeddings import OpenAIEmbeddings
+        return OpenAIEmbeddings(
+            model=model,
+            openai_api_key=os.getenv('OPENAI_API_KEY'),
+            http_client=_http_client("openai"),
+            max_retries=0,
+        )
+    return _get_or_create(("embeddings", model), create)
+
+def get_openai_client() -> "OpenAI":
+    """Returns the shared OpenAI client"""
+    def create():
+        from openai import OpenAI
+        return OpenAI(api_key=os.getenv('OPENAI_API_KEY'), http_client=_http_client("openai"), max_retries=0)
+    return _get_or_create(("openai",), create)
+
+def get_elevenlabs_client() -> "ElevenLabs":
+    """Returns the shared ElevenLabs client"""
+    def create():
+        from elevenlabs.client import ElevenLabs
+        return ElevenLabs(api_key=os.getenv('ELEVENLABS_API_KEY'), httpx_client=_http_client("elevenlabs"))
+    return _get_or_create(("elevenlabs",), create)
+
+def get_tavily_client() -> "TavilyClient":
+    """
+    Returns the shared Tavily client.
+    tavily-python sends every request with requests.post, which opens a new connection
+    each time, so unlike the other clients it does not use a keep-alive pool.
+    """
+    def create():
+        from tavily import TavilyClient
+        return TavilyClient(api_key=os.getenv('TAVILY_API_KEY'))
+    return _get_or_create(("tavily",), create)
+
+def close_clients():
+    """Closes the connection pools and forgets every shared client, the next calls create new ones"""
+    with _lock:
+        for http_client in _http_clients.values():
+            http_client.close()
+        _http_clients.clear()
+        _clients.clear()
+
+atexit.register(close_clients)
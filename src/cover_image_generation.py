@@ -1,19 +1,37 @@
-from openai import OpenAI
-import os
-from dotenv import load_dotenv
+from env import load_env
+from llm_cache import LLMCache, get_llm_cache
+from usage_meter import get_meter
+from rate_limiter import get_limiter
+from clients import get_openai_client
 
-load_dotenv()
+load_env()
 
 class CoverImageGenerator:
     def __init__(self):
-        self.client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self.client = get_openai_client()
 
     def generate(self, topic: str) -> str:
-        response = self.client.images.generate(
-            model="dall-e-3",
-            prompt=f"a cover image for a podcast about {topic}",
-            size="1024x1024",
-            quality="hd",
-            n=1,
-        )
-        return response.data[0].url
\ No newline at end of file
+        """
+        Generates the cover image and returns its URL.
+        The URL is recorded in the LLM cache like a completion of the "cover_image" stage,
+        so LLM_CACHE_MODE=replay serves it without calling DALL-E.
+        """
+        prompt = f"a cover image for a podcast about {topic}"
+        cache = get_llm_cache()
+        key = LLMCache.make_key("dall-e-3", None, prompt)
+        cached = cache.get(key, "cover_image")
+        if cached is not None:
+            return cached
+
+        with get_meter().track("cover_image", "openai", "dall-e-3"):
+            response = get_limiter("openai_images").call(
+                self.client.images.generate,
+                model="dall-e-3",
+                prompt=prompt,
+                size="1024x1024",
+                quality="hd",
+                n=1,
+            )
+        url = response.data[0].url
+        cache.put(key, "cover_image", "dall-e-3", url)
+        return url
@@ -0,0 +1,108 @@
+import hashlib
+import re
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def normalize_url(url: str) -> str:
+    """Normalizes a URL so that scheme, www prefix, query string and trailing slash don't matter."""
+    if not url:
+        return ""
+    parts = urlsplit(url.strip().lower())
+    host = parts.netloc[4:] if parts.netloc.startswith("www.") else parts.netloc
+    return f"{host}{parts.path.rstrip('/')}"
+
+def _normalize_title(title: str) -> str:
+    return " ".join(_TOKEN_PATTERN.findall((title or "").lower()))
+
+def content_hash(content: str) -> str:
+    """Hash of a document's content, ignoring whitespace differences"""
+    return hashlib.sha256(" ".join(content.split()).encode("utf-8")).hexdigest()
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [
+    (int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME | 1,
+     int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME)
+    for i in range(64)
+]
+
+def minhash(text: str, shingle_size: int = 3) -> List[int]:
+    """
+    Computes a 64-value MinHash signature over word shingles of the text.
+    Args:
+        text (str): The text to fingerprint
+        shingle_size (int): Number of consecutive words per shingle
+    Returns:
+        list: The signature, the fraction of equal values estimates the Jaccard similarity of two texts
+    """
+    tokens = _TOKEN_PATTERN.findall(text.lower())
+    if len(tokens) < shingle_size:
+        shingles = {" ".join(tokens)}
+    else:
+        shingles = {" ".join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)}
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big") for shingle in shingles]
+    return [min((a * value + b) % _MERSENNE_PRIME for value in hashes) for a, b in _PERMUTATIONS]
+
+def deduplicate(results: List[Dict], threshold: float = 0.7, bands: int = 16) -> Tuple[List[Dict], Dict[str, int]]:
+    """
+    Removes exact (same URL, or same title and content) and near-duplicate (similar content)
+    search results, keeping the first occurrence of each document.
+    Args:
+        results (list): Search results with "title", "content" and optional "url" keys
+        threshold (float): Estimated Jaccard similarity above which two contents are near-duplicates
+        bands (int): Number of LSH bands the signature is split into to find candidate pairs
+    Returns:
+        tuple: The kept results and a dict with the number of "exact" and "near" duplicates removed
+    """
+    rows = len(_PERMUTATIONS) // bands
+    seen_urls, seen_documents = set(), set()
+    buckets: Dict[Tuple, List[int]] = {}
+    signatures: List[List[int]] = []
+    kept: List[Dict] = []
+    removed = {"exact": 0, "near": 0}
+
+    for result in results:
+        url = normalize_url(result.get("url", ""))
+        # A shared title alone doesn't make a duplicate, different content under it is left to MinHash
+        document = (_normalize_title(result.get("title", "")), content_hash(result.get("content", "")))
+        if (url and url in seen_urls) or document in seen_documents:
+            removed["exact"] += 1
+            continue
+
+        signature = minhash(result.get("content", ""))
+        keys = [(band, *signature[band * rows:(band + 1) * rows]) for band in range(bands)]
+        candidates = {index for key in keys for index in buckets.get(key, [])}
+        if any(
+            sum(x == y for x, y in zip(signature, signatures[index])) / len(signature) >= threshold
+            for index in candidates
+        ):
+            removed["near"] += 1
+            continue
+
+        if url:
+            seen_urls.add(url)
+        seen_documents.add(document)
+        for key in keys:
+            buckets.setdefault(key, []).append(len(signatures))
+        signatures.append(signature)
+        kept.append(result)
+
+    return kept, removed
+
+def deduplicate_search_results(search_results: Dict[str, List[Dict]], threshold: float = 0.7) -> Tuple[Dict[str, List[Dict]], Dict[str, int]]:
+    """
+    Deduplicates general and news results together, so an article returned by both
+    searches is kept only once (in the general results).
+    Args:
+        search_results (dict): General and news results as returned by ContentSearcher.search
+        threshold (float): Estimated Jaccard similarity above which two contents are near-duplicates
+    Returns:
+        tuple: The deduplicated results and the removed counts
+    """
+    kept, removed = deduplicate(search_results["general"] + search_results["news"], threshold)
+    deduplicated = {
+        "general": [result for result in kept if result["source"] == "general"],
+        "news": [result for result in kept if result["source"] == "news"],
+    }
+    return deduplicated, removed
@@ -0,0 +1,166 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional
+from env import load_env
+from dedup import content_hash, normalize_url
+
+# Load environment variables from .env file
+load_env()
+
+def _published_timestamp(result: Dict) -> Optional[float]:
+    """Publication time of a Tavily news result, None if it has none or it can't be parsed"""
+    published = result.get("published_date")
+    if not published:
+        return None
+    try:
+        return parsedate_to_datetime(published).timestamp()
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(published.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+class DocumentStore:
+    """
+    Persistent store of the search results of every episode, backed by SQLite.
+    Documents are indexed by normalized URL and content hash, and linked to the queries
+    that returned them, so a later episode searching the same queries only needs to fetch
+    what was published since the last refresh. Embeddings of the stored documents are kept
+    in the same database (see CachedEmbeddings).
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        general_ttl: Optional[float] = None,
+        news_window: Optional[float] = None,
+    ):
+        self.path = path or os.getenv('DOCUMENT_STORE_PATH', '.cache/document_store.sqlite')
+        # General results of a query are searched again once they are older than general_ttl
+        self.general_ttl = general_ttl if general_ttl is not None else float(os.getenv('DOCUMENT_STORE_GENERAL_TTL', str(7 * 24 * 3600)))
+        # News older than news_window are not part of the retrieval set anymore
+        self.news_window = news_window if news_window is not None else float(os.getenv('DOCUMENT_STORE_NEWS_WINDOW', str(30 * 24 * 3600)))
+        self.stats = {"stored": 0, "known": 0, "refreshed": 0, "reused": 0}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.executescript(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "id INTEGER PRIMARY KEY, url TEXT, content_hash TEXT UNIQUE, kind TEXT, title TEXT, content TEXT, "
+            "raw_url TEXT, published REAL, first_seen REAL);"
+            "CREATE INDEX IF NOT EXISTS documents_url ON documents (url);"
+            "CREATE TABLE IF NOT EXISTS query_documents ("
+            "query TEXT, kind TEXT, document_id INTEGER, PRIMARY KEY (query, kind, document_id));"
+            "CREATE TABLE IF NOT EXISTS refreshes ("
+            "query TEXT, kind TEXT, fetched REAL, PRIMARY KEY (query, kind));"
+        )
+        self._connection.commit()
+
+    def last_refresh(self, query: str, kind: str) -> Optional[float]:
+        """Time the results of a query were last fetched, None if they never were"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT fetched FROM refreshes WHERE query = ? AND kind = ?", (query, kind)
+            ).fetchone()
+        return row[0] if row else None
+
+    def needs_refresh(self, query: str, kind: str) -> bool:
+        """Whether a query has to be searched: news always do (for the delta), general results once expired"""
+        fetched = self.last_refresh(query, kind)
+        refresh = fetched is None or kind == "news" or time.time() - fetched > self.general_ttl
+        with self._lock:
+            self.stats["refreshed" if refresh else "reused"] += 1
+        return refresh
+
+    def news_days(self, query: str, default: int = 30) -> int:
+        """Number of days of news to request to get everything published since the last refresh"""
+        fetched = self.last_refresh(query, "news")
+        if fetched is None:
+            return default
+        return min(max(math.ceil((time.time() - fetched) / 86400), 1), default)
+
+    def add(self, query: str, kind: str, results: List[Dict]):
+        """
+        Stores the results of a query and records the refresh.
+        A result with the URL or content of a stored document is linked to the existing document.
+        General results replace the ones of the previous refresh, news are a delta added to them.
+        """
+        now = time.time()
+        with self._lock:
+            if kind != "news":
+                self._connection.execute("DELETE FROM query_documents WHERE query = ? AND kind = ?", (query, kind))
+            for result in results:
+                url = normalize_url(result.get("url", ""))
+                digest = content_hash(result["content"])
+                row = self._connection.execute(
+                    "SELECT id FROM documents WHERE content_hash = ? OR (url != '' AND url = ?)", (digest, url)
+                ).fetchone()
+                if row:
+                    document_id = row[0]
+                    self.stats["known"] += 1
+                else:
+                    document_id = self._connection.execute(
+                        "INSERT INTO documents (url, content_hash, kind, title, content, raw_url, published, first_seen) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (url, digest, kind, result["title"], result["content"], result.get("url", ""),
+                         _published_timestamp(result), now),
+                    ).lastrowid
+                    self.stats["stored"] += 1
+                self._connection.execute(
+                    "INSERT OR IGNORE INTO query_documents (query, kind, document_id) VALUES (?, ?, ?)",
+                    (query, kind, document_id),
+                )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO refreshes (query, kind, fetched) VALUES (?, ?, ?)", (query, kind, now)
+            )
+            self._connection.commit()
+
+    def documents(self, query: str, kind: str, limit: Optional[int] = None) -> List[Dict]:
+        """
+        Returns the stored results of a query, in the format of Tavily results, newest first.
+        News published (or first seen) before the news window are left out.
+        """
+        sql = ("SELECT d.title, d.content, d.raw_url, d.published, d.first_seen FROM documents d "
+               "JOIN query_documents q ON q.document_id = d.id WHERE q.query = ? AND q.kind = ?")
+        parameters = [query, kind]
+        if kind == "news":
+            sql += " AND COALESCE(d.published, d.first_seen) >= ?"
+            parameters.append(time.time() - self.news_window)
+        sql += " ORDER BY COALESCE(d.published, d.first_seen) DESC, d.id"
+        if limit:
+            sql += " LIMIT ?"
+            parameters.append(limit)
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+        return [
+            {"title": title, "content": content, "url": url, "published": published or first_seen}
+            for title, content, url, published, first_seen in rows
+        ]
+
+    def clear(self):
+        """Removes every stored document"""
+        with self._lock:
+            self._connection.executescript("DELETE FROM documents; DELETE FROM query_documents; DELETE FROM refreshes;")
+            self._connection.commit()
+
+_store: Optional[DocumentStore] = None
+_store_lock = threading.Lock()
+
+def get_document_store() -> Optional[DocumentStore]:
+    """Returns the process-wide document store, None unless DOCUMENT_STORE is "on" """
+    global _store
+    if os.getenv('DOCUMENT_STORE', 'off') != 'on':
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = DocumentStore()
+        return _store
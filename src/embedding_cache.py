@@ -0,0 +1,163 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from array import array
+from typing import List, Optional
+from env import load_env
+from langchain_core.embeddings import Embeddings
+from usage_meter import get_meter
+from rate_limiter import get_limiter
+from clients import get_embeddings
+
+# Load environment variables from .env file
+load_env()
+
+# "openai" embeds documents with the OpenAI API, "hashing" computes local TF-IDF vectors with NumPy
+EMBEDDING_BACKENDS = ("openai", "hashing")
+
+class CachedEmbeddings(Embeddings):
+    """
+    Content-addressed cache in front of an embeddings model.
+    Vectors are stored in SQLite keyed by the hash of the embedding model and the text,
+    so only texts that were never embedded with that model reach the embeddings API.
+    """
+
+    def __init__(self, embeddings: Embeddings, path: Optional[str] = None):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", type(embeddings).__name__)
+        self.path = path or os.getenv('EMBEDDING_CACHE_PATH', '.cache/embedding_cache.sqlite')
+        self.stats = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, vector BLOB)")
+        self._connection.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> dict:
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM vectors WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def _store(self, items: List[tuple]):
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO vectors (key, vector) VALUES (?, ?)",
+                [(key, array("f", vector).tobytes()) for key, vector in items],
+            )
+            self._connection.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors = self._lookup(keys)
+
+        # Embed each missing text once, even if it appears several times in texts
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        self.stats["hits"] += len(texts) - len(missing)
+        self.stats["misses"] += len(missing)
+
+        if missing:
+            new_texts = list(missing.values())
+            prompt_tokens = sum(len(text) for text in new_texts) // 4
+            with get_meter().track("embeddings", "openai", self.model, prompt_tokens=prompt_tokens):
+                new_vectors = get_limiter("openai_embeddings").call(
+                    self.embeddings.embed_documents, new_texts, units=prompt_tokens
+                )
+            new_items = list(zip(missing.keys(), new_vectors))
+            self._store(new_items)
+            vectors.update(new_items)
+
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+def embedding_backend() -> str:
+    """The embedding backend selected by EMBEDDING_BACKEND"""
+    backend = os.getenv('EMBEDDING_BACKEND', 'openai')
+    if backend not in EMBEDDING_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}', expected one of {EMBEDDING_BACKENDS}")
+    return backend
+
+def get_retrieval_embeddings(store: Optional["DocumentStore"] = None) -> Embeddings:
+    """
+    Returns the embeddings to index search results with, from the backend selected by EMBEDDING_BACKEND.
+    Local vectors are cheaper to compute than to look up, so they are not cached, and each
+    call returns a new model because it keeps the document frequencies of the texts it indexes.
+    Args:
+        store (DocumentStore): Document store to keep the vectors in, next to the documents,
+            instead of the embedding cache
+    """
+    if embedding_backend() == "hashing":
+        from local_embeddings import HashingEmbeddings
+        return HashingEmbeddings()
+    return CachedEmbeddings(get_embeddings(), path=store.path if store is not None else None)
+
+def topic_index_dir(topic: str, version: str) -> Optional[str]:
+    """
+    Returns the directory where the FAISS index for a topic is persisted,
+    or None if FAISS_INDEX_DIR is not configured.
+    Indexes built with a backend other than OpenAI are kept apart, their vectors are not comparable.
+    """
+    root = os.getenv('FAISS_INDEX_DIR')
+    if not root:
+        return None
+    slug = re.sub(r"[^a-z0-9]+", "_", topic.lower()).strip("_")
+    backend = embedding_backend()
+    return os.path.join(root, f"{version}_{slug}" if backend == "openai" else f"{version}_{backend}_{slug}")
+
+def load_or_build_vectorstore(texts: List[str], embeddings: Embeddings, index_dir: Optional[str] = None) -> "FAISS":
+    """
+    Builds a FAISS store for the texts, reusing the index saved in index_dir if there is one.
+    Only texts that are not already in the saved index are embedded and added to it, and
+    documents of earlier runs that are not in texts are removed from it, so retrieval only
+    sees the documents of this run.
+    Args:
+        texts (list): The documents to index
+        embeddings (Embeddings): The embeddings model
+        index_dir (str): Directory to load the index from and save it to, None disables persistence
+    Returns:
+        FAISS: The vector store
+    """
+    from langchain_community.vectorstores import FAISS
+
+    if index_dir and os.path.exists(os.path.join(index_dir, "index.faiss")):
+        vectorstore = FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+        wanted = set(texts)
+        stale = [doc_id for doc_id, document in vectorstore.docstore._dict.items() if document.page_content not in wanted]
+        if stale:
+            vectorstore.delete(stale)
+        indexed = {document.page_content for document in vectorstore.docstore._dict.values()}
+        if hasattr(embeddings, "fit"):
+            # Models weighting queries by document frequency need to see the documents loaded from disk
+            embeddings.fit(indexed)
+        new_texts = list(dict.fromkeys(text for text in texts if text not in indexed))
+        print(f"Loaded FAISS index from {index_dir}, reusing {len(indexed)} documents, "
+              f"removing {len(stale)} and adding {len(new_texts)}")
+        if not new_texts and not stale:
+            return vectorstore
+        if new_texts:
+            vectorstore.add_texts(new_texts)
+    else:
+        vectorstore = FAISS.from_texts(texts, embeddings)
+
+    if index_dir:
+        vectorstore.save_local(index_dir)
+    return vectorstore
@@ -0,0 +1,17 @@
+import threading
+
+_loaded = False
+_lock = threading.Lock()
+
+def load_env():
+    """
+    Loads environment variables from the .env file.
+    Every module calls it at import time, but the file is only searched for and parsed once per process.
+    """
+    global _loaded
+    with _lock:
+        if _loaded:
+            return
+        from dotenv import load_dotenv
+        load_dotenv()
+        _loaded = True
@@ -0,0 +1,247 @@
+import io
+import math
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence
+from pydub import AudioSegment
+from env import load_env
+from audio_timeline import PCMTrack
+from mp3_frames import Mp3FormatError, parse_frames, self_contained_frame
+
+# Load environment variables from .env file
+load_env()
+
+# Samples LAME outputs before the first input sample (576 of encoder delay and 529 of decoder delay)
+ENCODER_DELAY = 1105
+# Owner of the ID3 PRIV frame giving the presentation time of a packed audio segment (RFC 8216, 3.4)
+TIMESTAMP_OWNER = b"com.apple.streaming.transportStreamTimestamp\x00"
+# RFC 6381 codec of MPEG-1/2 Layer III audio
+MP3_CODEC = "mp4a.40.34"
+
+def parse_bitrates(value: str) -> List[int]:
+    """Parses a list of bitrates like "64k,128k" to kbit/s"""
+    return sorted({int(bitrate.strip().lower().rstrip("k")) for bitrate in value.split(",") if bitrate.strip()})
+
+def _syncsafe(value: int) -> bytes:
+    return bytes([value >> 21 & 0x7F, value >> 14 & 0x7F, value >> 7 & 0x7F, value & 0x7F])
+
+def timestamp_tag(seconds: float) -> bytes:
+    """ID3v2.4 tag with the 33 bit, 90kHz MPEG-2 timestamp of the first sample of a segment"""
+    data = TIMESTAMP_OWNER + (round(seconds * 90000) & (1 << 33) - 1).to_bytes(8, "big")
+    frame = b"PRIV" + _syncsafe(len(data)) + b"\x00\x00" + data
+    return b"ID3\x04\x00\x00" + _syncsafe(len(frame)) + frame
+
+def _write_atomic(path: str, data: bytes):
+    # Readers polling the playlist never see a partially written file,
+    # and a temporary name of its own keeps two writers of the same path apart
+    descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(data)
+        # mkstemp makes the file readable by its owner only
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+class HlsWriter:
+    """
+    Writes an episode as an HLS stream while its audio is still being produced: fixed-duration
+    MP3 segments and their playlists are written as soon as enough audio is known, so players
+    can start before the episode is complete.
+    Every segment is encoded once per bitrate from the same PCM timeline, into one rendition
+    directory per bitrate, all listed in master.m3u8. Each segment is encoded with the samples
+    around it and cut on whole frames, so that it starts exactly at its timestamp, and its first
+    frame is repacked to not need the bit reservoir of the previous segment: the segments play
+    back to back without the gap encoder delay would otherwise add at every boundary.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        bitrates: Optional[Sequence[int]] = None,
+        segment_duration: Optional[float] = None,
+    ):
+        """
+        Args:
+            output_dir (str): Directory the playlists and segments are written to
+            bitrates (list): Bitrates of the renditions in kbit/s, by default from HLS_BITRATES ("64k,128k")
+            segment_duration (float): Target duration of the segments in seconds, by default from
+                HLS_SEGMENT_DURATION (6), rounded to whole MP3 frames
+        """
+        self.output_dir = output_dir
+        self.bitrates = sorted(bitrates) if bitrates else parse_bitrates(os.getenv('HLS_BITRATES', '64k,128k'))
+        self.segment_duration = segment_duration or float(os.getenv('HLS_SEGMENT_DURATION', '6'))
+        self.master_path = os.path.join(output_dir, "master.m3u8")
+        self.durations: List[float] = []
+        # Audio not written to a segment yet
+        self._pending: Optional[AudioSegment] = None
+        # End of the last segment, encoded again before the next one to prime the encoder
+        self._previous: Optional[AudioSegment] = None
+        self._position = 0
+        self._finished = False
+        self._executor = ThreadPoolExecutor(max_workers=len(self.bitrates))
+
+        for bitrate in self.bitrates:
+            os.makedirs(self._rendition_dir(bitrate), exist_ok=True)
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3"]
+        for bitrate in self.bitrates:
+            # Peak bandwidth, with room for the repacked first frames and the timestamp tags
+            lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bitrate * 1050},CODECS="{MP3_CODEC}"')
+            lines.append(f"{bitrate}k/playlist.m3u8")
+        _write_atomic(self.master_path, ("\n".join(lines) + "\n").encode())
+
+    def _rendition_dir(self, bitrate: int) -> str:
+        return os.path.join(self.output_dir, f"{bitrate}k")
+
+    def _start(self, audio: AudioSegment):
+        """Fixes the format of the stream from its first audio"""
+        self._pending = audio
+        self.frame_rate = audio.frame_rate
+        self.frame_samples = 1152 if audio.frame_rate >= 32000 else 576
+        self.segment_samples = max(round(self.segment_duration * self.frame_rate / self.frame_samples), 1) * self.frame_samples
+        # Encoded frames dropped before the segment: the encoder delay, plus a frame of the previous
+        # segment's audio so that the MDCT of the first kept frame overlaps real audio and not silence
+        self.skipped_frames = ENCODER_DELAY // self.frame_samples + 2
+        self.preroll = self.skipped_frames * self.frame_samples - ENCODER_DELAY
+        # Samples after the segment that the encoder looks ahead at and overlaps its last frame with
+        self.postroll = 2 * self.frame_samples
+        self._write_playlists()
+
+    def write(self, audio: AudioSegment):
+        """
+        Adds audio to the end of the stream and writes every segment that is complete
+        Args:
+            audio (AudioSegment): The next part of the episode, converted to the format of the first part
+        """
+        if not len(audio):
+            return
+        if self._pending is None:
+            self._start(audio)
+        else:
+            audio = (audio.set_frame_rate(self.frame_rate).set_channels(self._pending.channels)
+                     .set_sample_width(self._pending.sample_width))
+            self._pending += audio
+        while self._pending.frame_count() >= self.segment_samples + self.postroll:
+            self._write_segment(self.segment_samples)
+
+    def write_track(self, track: PCMTrack, block_frames: int = 1 << 16):
+        """
+        Adds an assembled track to the end of the stream, rendering it a block at a time
+        so that only the audio of the segment being written is held in memory
+        """
+        for block in track.blocks(block_frames):
+            self.write(AudioSegment(data=block.tobytes(), sample_width=track.sample_width,
+                                    frame_rate=track.frame_rate, channels=track.channels))
+
+    def finish(self) -> str:
+        """
+        Writes the remaining audio and ends the playlists
+        Returns:
+            str: Path of the master playlist
+        """
+        if self._pending is not None:
+            while self._pending.frame_count() > self.segment_samples:
+                self._write_segment(self.segment_samples)
+            if self._pending.frame_count():
+                self._write_segment(int(self._pending.frame_count()))
+        self._finished = True
+        self._write_playlists()
+        self._executor.shutdown()
+        return self.master_path
+
+    def _write_segment(self, samples: int):
+        pending = self._pending
+        preroll = self._previous
+        if preroll is None:
+            # The first segment is primed with silence
+            preroll = AudioSegment(bytes(self.preroll * pending.frame_width), frame_rate=self.frame_rate,
+                                   sample_width=pending.sample_width, channels=pending.channels)
+        body = pending.get_sample_slice(0, samples)
+        source = preroll + body + pending.get_sample_slice(samples, samples + self.postroll)
+
+        index = len(self.durations)
+        start = self._position / self.frame_rate
+        # ffmpeg runs in a process of its own, so the renditions are encoded in parallel
+        list(self._executor.map(lambda bitrate: self._encode(source, bitrate, samples, index, start), self.bitrates))
+
+        self._previous = (preroll + body).get_sample_slice(int((preroll + body).frame_count()) - self.preroll, None)
+        self._pending = pending.get_sample_slice(samples, None)
+        self._position += samples
+        self.durations.append(samples / self.frame_rate)
+        self._write_playlists()
+
+    def _encode(self, source: AudioSegment, bitrate: int, samples: int, index: int, start: float):
+        buffer = io.BytesIO()
+        source.export(buffer, format="mp3", bitrate=f"{bitrate}k")
+        frames = parse_frames(buffer.getvalue())
+        count = math.ceil(samples / self.frame_samples)
+        first = self.skipped_frames
+        if len(frames) < first + count or frames[first].samples != self.frame_samples:
+            raise Mp3FormatError(f"Segment {index} was encoded to {len(frames)} frames, {first + count} expected")
+        data = [self_contained_frame(frames, first)] + [frame.data for frame in frames[first + 1:first + count]]
+        path = os.path.join(self._rendition_dir(bitrate), f"segment_{index:05d}.mp3")
+        _write_atomic(path, timestamp_tag(start) + b"".join(data))
+
+    def _write_playlists(self):
+        """Rewrites the playlist of every rendition with the segments written so far"""
+        # Segment durations rounded to the nearest second must not exceed the target duration
+        target_duration = max(round(self.segment_samples / self.frame_rate) if self._pending is not None else 1, 1)
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{target_duration}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            # An event playlist only grows, a player can start at the first segment before it ends
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+        ]
+        for index, duration in enumerate(self.durations):
+            lines.append(f"#EXTINF:{duration:.3f},")
+            lines.append(f"segment_{index:05d}.mp3")
+        if self._finished:
+            lines.append("#EXT-X-ENDLIST")
+        playlist = ("\n".join(lines) + "\n").encode()
+        for bitrate in self.bitrates:
+            _write_atomic(os.path.join(self._rendition_dir(bitrate), "playlist.m3u8"), playlist)
+
+def write_hls(
+    audio: AudioSegment,
+    output_dir: str,
+    bitrates: Optional[Sequence[int]] = None,
+    segment_duration: Optional[float] = None,
+) -> str:
+    """
+    Writes a complete episode as an HLS stream
+    Args:
+        audio (AudioSegment): The decoded episode
+        output_dir (str): Directory the playlists and segments are written to
+        bitrates (list): Bitrates of the renditions in kbit/s
+        segment_duration (float): Target duration of the segments in seconds
+    Returns:
+        str: Path of the master playlist
+    """
+    writer = HlsWriter(output_dir, bitrates, segment_duration)
+    writer.write(audio)
+    return writer.finish()
+
+def write_hls_track(
+    track: PCMTrack,
+    output_dir: str,
+    bitrates: Optional[Sequence[int]] = None,
+    segment_duration: Optional[float] = None,
+) -> str:
+    """
+    Writes an assembled episode as an HLS stream, see write_hls
+    Args:
+        track (PCMTrack): The assembled episode, e.g. memory-mapped from a spool file
+        output_dir (str): Directory the playlists and segments are written to
+        bitrates (list): Bitrates of the renditions in kbit/s
+        segment_duration (float): Target duration of the segments in seconds
+    Returns:
+        str: Path of the master playlist
+    """
+    writer = HlsWriter(output_dir, bitrates, segment_duration)
+    writer.write_track(track)
+    return writer.finish()
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+from env import load_env
+
+# Load environment variables from .env file
+load_env()
+
+# Cache modes:
+#   "off"     never read or write the cache
+#   "on"      reuse the completions of the stages listed in LLM_CACHE_STAGES
+#   "record"  call the model for every stage and store all completions
+#   "replay"  serve every completion from the cache, a missing one is an error
+# The cover image URL is cached like a completion of the "cover_image" stage, so a replayed run makes no calls
+MODES = ("off", "on", "record", "replay")
+
+class LLMCacheMissError(RuntimeError):
+    """Raised in replay mode when a completion was never recorded."""
+
+class LLMCache:
+    """
+    Exact-match cache of LLM completions, backed by SQLite.
+    Completions are keyed by model, temperature, prompt and a fingerprint of the
+    retrieved context, and the least recently used ones are evicted once the
+    cache holds more than max_entries completions.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        mode: Optional[str] = None,
+        stages: Optional[list] = None,
+        max_entries: Optional[int] = None,
+    ):
+        self.path = path or os.getenv('LLM_CACHE_PATH', '.cache/llm_cache.sqlite')
+        self.mode = mode or os.getenv('LLM_CACHE_MODE', 'on')
+        if self.mode not in MODES:
+            raise ValueError(f"Unknown LLM cache mode '{self.mode}', expected one of {MODES}")
+        if stages is None:
+            stages = os.getenv('LLM_CACHE_STAGES', 'search_queries,concepts,tweet').split(",")
+        self.stages = {stage.strip() for stage in stages if stage.strip()}
+        self.max_entries = max_entries or int(os.getenv('LLM_CACHE_MAX_ENTRIES', '10000'))
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, stage TEXT, model TEXT, created REAL, accessed REAL, response TEXT)"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(model: str, temperature: Optional[float], prompt: str, context: str = "") -> str:
+        """Builds the cache key of a completion request."""
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        context_hash = hashlib.sha256(context.encode("utf-8")).hexdigest()
+        payload = json.dumps([model, temperature, prompt_hash, context_hash])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def enabled_for(self, stage: str) -> bool:
+        """Whether completions of the stage are read from and written to the cache"""
+        if self.mode == "off":
+            return False
+        return self.mode != "on" or stage in self.stages
+
+    def get(self, key: str, stage: str) -> Optional[str]:
+        """
+        Returns the cached completion for key, or None if the stage is not cached or it is missing.
+        Raises:
+            LLMCacheMissError: If the completion is missing in replay mode
+        """
+        if not self.enabled_for(stage) or self.mode == "record":
+            return None
+        with self._lock:
+            row = self._connection.execute("SELECT response FROM completions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+            else:
+                self._connection.execute("UPDATE completions SET accessed = ? WHERE key = ?", (time.time(), key))
+                self._connection.commit()
+                self.stats["hits"] += 1
+        if row is None:
+            if self.mode == "replay":
+                raise LLMCacheMissError(f"No recorded completion for stage '{stage}' (key {key[:12]})")
+            return None
+        return json.loads(row[0])
+
+    def put(self, key: str, stage: str, model: str, response: str):
+        """Stores a completion and evicts the least recently used entries above max_entries."""
+        if not self.enabled_for(stage):
+            return
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO completions (key, stage, model, created, accessed, response) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, stage, model, now, now, json.dumps(response)),
+            )
+            count = self._connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            if count > self.max_entries:
+                evicted = count - self.max_entries
+                self._connection.execute(
+                    "DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY accessed ASC LIMIT ?)",
+                    (evicted,),
+                )
+                self.stats["evictions"] += evicted
+            self._connection.commit()
+
+    def clear(self):
+        """Removes every cached completion."""
+        with self._lock:
+            self._connection.execute("DELETE FROM completions")
+            self._connection.commit()
+
+def retrieval_fingerprint(chain) -> str:
+    """
+    Fingerprint of the documents a retrieval chain can draw its context from.
+    The same question asked over a different set of search results must not hit the cache.
+    """
+    vectorstore = getattr(getattr(chain, "retriever", None), "vectorstore", None)
+    docstore = getattr(getattr(vectorstore, "docstore", None), "_dict", None)
+    if not docstore:
+        return ""
+    digest = hashlib.sha256()
+    for content in sorted(document.page_content for document in docstore.values()):
+        digest.update(content.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+def chain_temperature(chain) -> Optional[float]:
+    """Temperature of the model answering in a ConversationalRetrievalChain, if it can be found"""
+    llm = getattr(getattr(getattr(chain, "combine_docs_chain", None), "llm_chain", None), "llm", None)
+    return getattr(llm, "temperature", None)
+
+_cache: Optional[LLMCache] = None
+_cache_lock = threading.Lock()
+
+def get_llm_cache() -> LLMCache:
+    """Returns the process-wide LLM cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMCache()
+        return _cache
@@ -0,0 +1,92 @@
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+from typing import Iterable, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:['.][a-z0-9]+)*")
+
+# Too common to say anything about a document, dropped before hashing
+STOP_WORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between both
+but by can could did do does doing down during each few for from further had has have having he her here hers
+him his how i if in into is it its itself just me more most my no nor not now of off on once only or other our
+ours out over own same she should so some such than that the their theirs them then there these they this those
+through to too under until up very was we were what when where which while who whom why will with you your
+""".split())
+
+class HashingEmbeddings(Embeddings):
+    """
+    Local TF-IDF embeddings computed with the hashing trick, on the CPU and without any network call.
+    Words and word bigrams are hashed into a fixed number of signed buckets, weighted by
+    1 + log(term frequency) and L2-normalized, so a document's vector only depends on its text
+    and can be cached or persisted. Document frequencies of the indexed documents are counted
+    as they are embedded, and queries are weighted by the inverse document frequency, so rare
+    terms drive the ranking as they do in TF-IDF.
+    """
+
+    def __init__(self, dimensions: Optional[int] = None, batch_size: int = 256):
+        self.dimensions = dimensions or int(os.getenv('HASHING_EMBEDDING_DIMENSIONS', '4096'))
+        self.batch_size = batch_size
+        self.model = f"hashing-tfidf-{self.dimensions}"
+        self._document_frequencies = np.zeros(self.dimensions, dtype=np.float64)
+        self._documents = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _terms(text: str) -> List[str]:
+        words = [word for word in TOKEN_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+        return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+    def _hash(self, term: str) -> int:
+        # crc32 is stable across processes, unlike hash(), so persisted indexes stay valid
+        return zlib.crc32(term.encode("utf-8"))
+
+    def _vectorize(self, texts: List[str]) -> np.ndarray:
+        """Term frequency matrix of the texts, one row per text, in hashed (bucket, sign) space"""
+        rows, columns, values = [], [], []
+        for row, text in enumerate(texts):
+            for term, count in Counter(self._terms(text)).items():
+                hashed = self._hash(term)
+                rows.append(row)
+                columns.append(hashed % self.dimensions)
+                values.append((1.0 + np.log(count)) * (1.0 if hashed & 0x80000000 else -1.0))
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        np.add.at(matrix, (np.asarray(rows, dtype=np.intp), np.asarray(columns, dtype=np.intp)), values)
+        return matrix
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def fit(self, texts: Iterable[str]):
+        """Counts the document frequencies of texts that are indexed without being embedded again"""
+        texts = list(texts)
+        for start in range(0, len(texts), self.batch_size):
+            self._count(self._vectorize(texts[start:start + self.batch_size]))
+
+    def _count(self, matrix: np.ndarray):
+        with self._lock:
+            self._document_frequencies += (matrix != 0).sum(axis=0)
+            self._documents += len(matrix)
+
+    def _idf(self) -> np.ndarray:
+        with self._lock:
+            return np.log((1 + self._documents) / (1 + self._document_frequencies)) + 1
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            matrix = self._vectorize(texts[start:start + self.batch_size])
+            self._count(matrix)
+            vectors.append(self._normalize(matrix))
+        if not vectors:
+            return []
+        return np.concatenate(vectors).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._normalize(self._vectorize([text]) * self._idf())[0].tolist()
@@ -1,30 +1,71 @@
+import argparse
 import os
 # Use absolute import since we're running this file directly
 from podcast_generator import PodcastGenerator
+from batch import BatchRunner, read_topics
 
-# In your backend route/handler
-topic = "quantum computing"  # Get this from the request
-podcast_content = PodcastGenerator().generate_podcast(topic)
-
-
-script = podcast_content.script
-audio_bytes = podcast_content.audio_bytes
-cover_image_url = podcast_content.cover_image_url
-tweet = podcast_content.tweet
-# Access the generated content
-# Print the generated content
-print("\nGenerated Script:\n")
-print(script)
-print("\nCover Image URL:\n")
-print(cover_image_url)
-print("\nTweet:\n") 
-print(tweet)
-
-# Save the audio file
-
-audio_dir = "generated_audio"
-os.makedirs(audio_dir, exist_ok=True)
-audio_path = os.path.join(audio_dir, f"{topic.replace(' ', '_')}.mp3")
-with open(audio_path, "wb") as f:
-        f.write(audio_bytes)
-print(f"\nAudio saved to: {audio_path}")
+def generate_single(topic: str):
+    # In your backend route/handler
+    podcast_content = PodcastGenerator().generate_podcast(topic)
+
+
+    script = podcast_content.script
+    cover_image_url = podcast_content.cover_image_url
+    tweet = podcast_content.tweet
+    # Access the generated content
+    # Print the generated content
+    print("\nGenerated Script:\n")
+    print(script)
+    print("\nCover Image URL:\n")
+    print(cover_image_url)
+    print("\nTweet:\n")
+    print(tweet)
+
+    # Save the audio file
+
+    audio_dir = "generated_audio"
+    os.makedirs(audio_dir, exist_ok=True)
+    audio_path = os.path.join(audio_dir, f"{topic.replace(' ', '_')}.mp3")
+    podcast_content.save_audio(audio_path)
+    print(f"\nAudio saved to: {audio_path}")
+
+def generate_single_hls(topic: str):
+    # Segments are written while the episode is generated, so it can be served before it is complete
+    output_dir = os.path.join("generated_audio", topic.replace(' ', '_'))
+    master_path = PodcastGenerator().stream_podcast_hls(topic, output_dir)
+    print(f"\nHLS stream saved to: {master_path}")
+
+def generate_batch(args: argparse.Namespace):
+    runner = BatchRunner(
+        output_dir=args.output_dir,
+        episode_workers=args.episode_workers,
+        stage_workers={
+            "script": args.script_workers,
+            "audio": args.audio_workers,
+            "cover_image": args.cover_image_workers,
+            "tweet": args.tweet_workers,
+        },
+        hls=args.hls,
+    )
+    runner.run(read_topics(args.topics_file))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate AI Joe podcast episodes")
+    parser.add_argument("topic", nargs="?", default="quantum computing", help="Topic of a single episode")
+    parser.add_argument("--topics-file", help="Batch mode: file with one topic per line")
+    parser.add_argument("--output-dir", default="generated_episodes", help="Batch mode: where episodes are written")
+    parser.add_argument("--episode-workers", type=int, help="Batch mode: episodes in progress at the same time")
+    parser.add_argument("--script-workers", type=int, help="Batch mode: concurrent script generations")
+    parser.add_argument("--audio-workers", type=int, help="Batch mode: concurrent audio generations")
+    parser.add_argument("--cover-image-workers", type=int, help="Batch mode: concurrent cover image generations")
+    parser.add_argument("--tweet-workers", type=int, help="Batch mode: concurrent tweet generations")
+    parser.add_argument("--hls", action="store_true",
+                        help="Write the audio as HLS segments and playlists (a single episode then only has audio)")
+    args = parser.parse_args()
+
+    if args.topics_file:
+        generate_batch(args)
+    elif args.hls:
+        generate_single_hls(args.topic)
+    else:
+        generate_single(args.topic)
@@ -0,0 +1,315 @@
+import io
+import math
+from dataclasses import dataclass
+from typing import List, Optional
+import numpy as np
+from pydub import AudioSegment
+
+# Layer III bitrates in kbit/s by bitrate index, for MPEG-1 and for MPEG-2/2.5
+_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+_SAMPLE_RATES = {1: [44100, 48000, 32000], 2: [22050, 24000, 16000], 25: [11025, 12000, 8000]}
+_VERSIONS = {3: 1, 2: 2, 0: 25}
+
+class Mp3FormatError(ValueError):
+    """Raised when audio can't be assembled frame by frame, e.g. it isn't MPEG Layer III"""
+
+@dataclass
+class Mp3Frame:
+    """One MPEG Layer III frame: header, side information and main data"""
+    data: bytes
+    version: int
+    bitrate: int
+    sample_rate: int
+    channels: int
+
+    @property
+    def _table(self) -> int:
+        return 1 if self.version == 1 else 2
+
+    @property
+    def samples(self) -> int:
+        return 1152 if self.version == 1 else 576
+
+    @property
+    def side_info_start(self) -> int:
+        # The 16 bit CRC follows the header when the protection bit is 0
+        return 4 if self.data[1] & 1 else 6
+
+    @property
+    def side_info_length(self) -> int:
+        if self.version == 1:
+            return 17 if self.channels == 1 else 32
+        return 9 if self.channels == 1 else 17
+
+    @property
+    def side_info(self) -> bytes:
+        return self.data[self.side_info_start:self.side_info_start + self.side_info_length]
+
+    @property
+    def payload(self) -> bytes:
+        """The bytes after the side information, where main data is stored"""
+        return self.data[self.side_info_start + self.side_info_length:]
+
+    @property
+    def main_data_begin(self) -> int:
+        """How many bytes before its payload the frame's main data starts (the bit reservoir)"""
+        side = self.side_info
+        return (side[0] << 1 | side[1] >> 7) if self.version == 1 else side[0]
+
+    @property
+    def main_data_length(self) -> int:
+        """Length in bytes of the frame's own main data, from the part2_3_length of every granule"""
+        bits = int.from_bytes(self.side_info, "big")
+        total = self.side_info_length * 8
+        if self.version == 1:
+            # main_data_begin, private bits and scfsi come before the granules, 59 bits per granule and channel
+            offset, granules, block = 9 + (5 if self.channels == 1 else 3) + 4 * self.channels, 2, 59
+        else:
+            offset, granules, block = 8 + self.channels, 1, 63
+        length = 0
+        for i in range(granules * self.channels):
+            start = offset + i * block
+            length += (bits >> (total - start - 12)) & 0xFFF
+        return math.ceil(length / 8)
+
+    def is_vbr_header(self) -> bool:
+        """Whether this is the Xing/Info/VBRI header frame encoders write before the audio"""
+        start = self.side_info_start + self.side_info_length
+        return self.data[start:start + 4] in (b"Xing", b"Info") or self.data[36:40] == b"VBRI"
+
+def _parse_header(data: bytes, offset: int) -> Optional[Mp3Frame]:
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+    version = _VERSIONS.get(data[offset + 1] >> 3 & 3)
+    layer = data[offset + 1] >> 1 & 3
+    bitrate_index, sample_rate_index = data[offset + 2] >> 4, data[offset + 2] >> 2 & 3
+    if version is None or layer != 1 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    bitrate = _BITRATES[1 if version == 1 else 2][bitrate_index]
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = data[offset + 2] >> 1 & 1
+    length = (144 if version == 1 else 72) * bitrate * 1000 // sample_rate + padding
+    if offset + length > len(data):
+        return None
+    channels = 1 if data[offset + 3] >> 6 == 3 else 2
+    return Mp3Frame(data[offset:offset + length], version, bitrate, sample_rate, channels)
+
+def parse_frames(data: bytes) -> List[Mp3Frame]:
+    """
+    Splits an MP3 stream into its audio frames.
+    ID3 tags and the Xing/Info/VBRI header frame are dropped, their values would be wrong for the
+    concatenated stream; bytes that aren't frames are skipped until the next two consecutive frames.
+    Args:
+        data (bytes): The MP3 file
+    Returns:
+        list: The audio frames, in order
+    Raises:
+        Mp3FormatError: If the stream has no MPEG Layer III frames
+    """
+    offset = 0
+    if data[:3] == b"ID3":
+        offset = 10 + ((data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F))
+    frames = []
+    while offset < len(data) and data[offset:offset + 3] != b"TAG":
+        frame = _parse_header(data, offset)
+        if frame is None or (not frames and _parse_header(data, offset + len(frame.data)) is None
+                             and offset + len(frame.data) < len(data)):
+            offset += 1
+            continue
+        if not (not frames and frame.is_vbr_header()):
+            frames.append(frame)
+        offset += len(frame.data)
+    if not frames:
+        raise Mp3FormatError("No MPEG Layer III frames found")
+    return frames
+
+def _header(template: Mp3Frame, bitrate_index: int, padding: int) -> bytes:
+    """Header with the template's version, sample rate and channel mode, without CRC"""
+    return bytes([
+        0xFF,
+        template.data[1] | 1,
+        bitrate_index << 4 | (template.data[2] & 0x0D) | padding << 1,
+        template.data[3],
+    ])
+
+def _frame_length(template: Mp3Frame, bitrate_index: int, padding: int) -> int:
+    bitrate = _BITRATES[template._table][bitrate_index]
+    return (144 if template.version == 1 else 72) * bitrate * 1000 // template.sample_rate + padding
+
+def silent_frame(template: Mp3Frame) -> bytes:
+    """
+    A frame of the template's format that decodes to silence: its side information and main data
+    are zeroed, so it has no spectral data and uses none of the bit reservoir.
+    """
+    bitrate_index = _BITRATES[template._table].index(template.bitrate)
+    header = _header(template, bitrate_index, 0)
+    return header + bytes(_frame_length(template, bitrate_index, 0) - len(header))
+
+def self_contained_frame(frames: List[Mp3Frame], index: int) -> bytes:
+    """
+    Rewrites frames[index] so that it can be decoded without the frames before it.
+    The main data it takes from the bit reservoir is moved into the frame itself, whose bitrate
+    is raised to make room. The bytes the following frames keep in their own reservoir stay
+    in the same place relative to them, so they decode unchanged after it.
+    Raises:
+        Mp3FormatError: If the frame doesn't fit in a frame of the highest bitrate
+    """
+    frame = frames[index]
+    backstep = frame.main_data_begin
+    reservoir = b""
+    previous = index - 1
+    while len(reservoir) < backstep and previous >= 0:
+        reservoir = frames[previous].payload + reservoir
+        previous -= 1
+    if len(reservoir) < backstep:
+        raise Mp3FormatError(f"Frame {index} refers to {backstep} bytes before the start of the stream")
+    main_data = (reservoir[len(reservoir) - backstep:] if backstep else b"") + frame.payload
+
+    side = bytearray(frame.side_info)
+    side[0] = 0
+    if frame.version == 1:
+        side[1] &= 0x7F
+    needed = 4 + len(side) + len(main_data)
+    for bitrate_index in range(1, 15):
+        for padding in (0, 1):
+            length = _frame_length(frame, bitrate_index, padding)
+            if length >= needed:
+                # Filler goes right after the frame's own main data, which no later frame reads
+                own = frame.main_data_length
+                filler = bytes(length - needed)
+                return (_header(frame, bitrate_index, padding) + bytes(side)
+                        + main_data[:own] + filler + main_data[own:])
+    raise Mp3FormatError(f"Frame {index} with {backstep} bytes of reservoir doesn't fit in a single frame")
+
+def decode_frames(frames: List[bytes]) -> AudioSegment:
+    """Decodes frames that don't depend on earlier ones, exactly one frame of samples per frame"""
+    return AudioSegment.from_file(io.BytesIO(b"".join(frames)), format="mp3")
+
+def _frame_levels(segment: AudioSegment, samples: int) -> np.ndarray:
+    """RMS level of every frame of the decoded audio, relative to full scale"""
+    data = np.frombuffer(segment.raw_data, dtype={1: np.int8, 2: np.int16, 4: np.int32}[segment.sample_width])
+    if len(data) % (samples * segment.channels):
+        raise Mp3FormatError("Decoded audio isn't a whole number of frames")
+    data = data.reshape(-1, samples * segment.channels).astype(np.float64) / (1 << (8 * segment.sample_width - 1))
+    return np.sqrt(np.mean(data ** 2, axis=1))
+
+def _quietest_cut(levels: np.ndarray, candidates: range, offset: int) -> int:
+    """Index of the frame in candidates that starts the quietest join (it and the frame before it)"""
+    return min(candidates, key=lambda cut: max(levels[cut - offset - 1], levels[cut - offset]))
+
+class Mp3Assembler:
+    """
+    Assembles an episode from MP3 voice chunks by copying their frames, instead of decoding the
+    whole episode and encoding it again.
+    Only the windows where the intro and outro are mixed with the voice are decoded, mixed and
+    encoded with the voice's sample rate, channels and bitrate (so the intro and outro are
+    converted to the voice's channels). Pauses are silent frames. The joins between encoded and
+    copied frames are placed at the quietest frame within search_duration ms of the fades, or at
+    a chunk boundary, so the few ms of encoder delay and padding they add fall in silence.
+    """
+
+    def __init__(self, pause_duration: int = 500, fade_duration: int = 3000, search_duration: int = 10000):
+        self.pause_duration = pause_duration
+        self.fade_duration = fade_duration
+        self.search_duration = search_duration
+
+    def _encode(self, segment: AudioSegment, template: Mp3Frame) -> List[bytes]:
+        segment = segment.set_frame_rate(template.sample_rate).set_channels(template.channels)
+        buffer = io.BytesIO()
+        segment.export(buffer, format="mp3", bitrate=f"{template.bitrate}k")
+        return [frame.data for frame in parse_frames(buffer.getvalue())]
+
+    def _start_window(self, frames: List[Mp3Frame], intro: AudioSegment, fade_frames: int,
+                      search_frames: int, limit: int) -> tuple:
+        """Encodes the intro mixed with the start of the voice, returns the frames and the index of the join"""
+        decoded_count = min(len(frames), fade_frames + search_frames + 1, limit)
+        voice = decode_frames([frame.data for frame in frames[:decoded_count]])
+        if decoded_count == len(frames):
+            # The whole chunk fits in the window, the join is in the pause after it
+            cut = len(frames)
+        else:
+            candidates = range(fade_frames + 1, decoded_count)
+            if not candidates:
+                raise Mp3FormatError("The voice is too short to mix the intro over it")
+            cut = _quietest_cut(_frame_levels(voice, frames[0].samples), candidates, 0)
+        voice = voice.get_sample_slice(0, cut * frames[0].samples)
+
+        # Voice starts fade_duration before the end of the fading out intro music, like AudioGenerator._add_intro
+        intro = intro.set_frame_rate(voice.frame_rate).set_channels(voice.channels).fade_out(self.fade_duration)
+        audio = intro.overlay(voice[:self.fade_duration], position=len(intro) - self.fade_duration)
+        return self._encode(audio + voice[self.fade_duration:], frames[0]), cut
+
+    def _end_window(self, frames: List[Mp3Frame], outro: AudioSegment, fade_frames: int,
+                    search_frames: int, start: int) -> tuple:
+        """Encodes the end of the voice mixed with the outro, returns the frames and the index of the join"""
+        last = len(frames) - fade_frames - 1
+        first = max(last - search_frames, start)
+        if first > last:
+            raise Mp3FormatError("The voice is too short to mix the outro over it")
+        # Decoding starts a frame early: the first decoded frame lacks the overlap of the one before it
+        decode_from = max(first - 2, start)
+        to_decode = [frame.data for frame in frames[decode_from:]]
+        if decode_from > 0:
+            to_decode[0] = self_contained_frame(frames, decode_from)
+        voice = decode_frames(to_decode)
+        if first == 0:
+            cut = 0
+        else:
+            candidates = range(max(first, decode_from + 2), last + 1)
+            if not candidates:
+                raise Mp3FormatError("The voice is too short to mix the outro over it")
+            cut = _quietest_cut(_frame_levels(voice, frames[0].samples), candidates, decode_from)
+        voice = voice.get_sample_slice((cut - decode_from) * frames[0].samples, None)
+
+        # Fading in outro music starts fade_duration before the voice ends, like AudioGenerator._add_outro
+        outro = outro.set_frame_rate(voice.frame_rate).set_channels(voice.channels).fade_in(self.fade_duration)
+        outro_position = len(voice) - self.fade_duration
+        if outro_position + len(outro) > len(voice):
+            voice += AudioSegment.silent(duration=outro_position + len(outro) - len(voice), frame_rate=voice.frame_rate)
+        return self._encode(voice.overlay(outro, position=outro_position), frames[0]), cut
+
+    def assemble(self, chunks: List[bytes], intro: AudioSegment, outro: AudioSegment) -> bytes:
+        """
+        Args:
+            chunks (list): The MP3 voice chunks, in order
+            intro (AudioSegment): The intro music
+            outro (AudioSegment): The outro music
+        Returns:
+            bytes: The MP3 episode
+        Raises:
+            Mp3FormatError: If the chunks aren't Layer III streams of a single format, or too short for the fades
+        """
+        streams = [parse_frames(chunk) for chunk in chunks]
+        template = streams[0][0]
+        formats = {(frame.version, frame.sample_rate, frame.channels) for frames in streams for frame in frames}
+        if len(formats) > 1:
+            raise Mp3FormatError(f"Voice chunks have different formats: {sorted(formats)}")
+
+        frame_ms = template.samples * 1000 / template.sample_rate
+        fade_frames = math.ceil(self.fade_duration / frame_ms)
+        search_frames = math.ceil(self.search_duration / frame_ms)
+        pause = [silent_frame(template)] * round(self.pause_duration / frame_ms)
+        first, last = streams[0], streams[-1]
+
+        # With a single chunk both windows are cut from it, and must leave the end window its fade
+        limit = len(first) - fade_frames - 2 if len(streams) == 1 else len(first)
+        start_frames, start_cut = self._start_window(first, intro, fade_frames, search_frames, limit)
+        end_frames, end_cut = self._end_window(last, outro, fade_frames, search_frames,
+                                               start_cut if len(streams) == 1 else 0)
+
+        output = list(start_frames)
+        for i, frames in enumerate(streams):
+            begin = start_cut if i == 0 else 0
+            end = end_cut if i == len(streams) - 1 else len(frames)
+            if i > 0:
+                output.extend(pause)
+            if begin >= end:
+                continue
+            # The first copied frame can't use the reservoir of the frames that were encoded again
+            output.append(self_contained_frame(frames, begin) if begin else frames[begin].data)
+            output.extend(frame.data for frame in frames[begin + 1:end])
+        output.extend(end_frames)
+        return b"".join(output)
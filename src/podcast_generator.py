@@ -1,47 +1,313 @@
-from dataclasses import dataclass
-from script_generation_v3 import ScriptGenerator
-from audio_generation import AudioGenerator
-from cover_image_generation import CoverImageGenerator
-from tweet_generation import TweetGenerator
+import os
+import queue
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from contextlib import nullcontext
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional
+from stage_graph import StageGraph
+from usage_meter import Budget, UsageMeter, propagate_context, use_meter
+from checkpoint import RunCheckpoint
+
+if TYPE_CHECKING:
+    from pydub import AudioSegment
+    from script_generation_v3 import ScriptGenerator
+    from audio_generation import AudioGenerator
+    from cover_image_generation import CoverImageGenerator
+    from tweet_generation import TweetGenerator
 
 @dataclass
 class PodcastContent:
-    """Data class to hold generated podcast content"""
+    """
+    Data class to hold generated podcast content
+    With AUDIO_ASSEMBLY=disk the audio is only written to audio_path and audio_bytes is empty.
+    audio_path is in the run directory, which the next run of the topic clears, so use save_audio to keep it.
+    hls_dir, the audio as an HLS stream when it was asked for, is in the run directory as well, see save_hls.
+    """
     script: str
     audio_bytes: bytes
     cover_image_url: str
     tweet: str
+    stage_timings: Dict[str, float] = field(default_factory=dict)
+    usage_report: Dict = field(default_factory=dict)
+    audio_path: Optional[str] = None
+    hls_dir: Optional[str] = None
+
+    def save_audio(self, path: str):
+        """Writes the episode audio to path, copying the audio file when it is on disk"""
+        if self.audio_path:
+            shutil.copyfile(self.audio_path, path)
+        else:
+            with open(path, "wb") as f:
+                f.write(self.audio_bytes)
+
+    def save_hls(self, directory: str):
+        """Copies the HLS stream of the episode to directory, replacing a previous one"""
+        if not self.hls_dir:
+            raise ValueError("The episode was generated without an HLS stream")
+        shutil.rmtree(directory, ignore_errors=True)
+        shutil.copytree(self.hls_dir, directory)
 
 class PodcastGenerator:
-    def __init__(self):
+    def __init__(
+        self,
+        script_generator: Optional["ScriptGenerator"] = None,
+        audio_generator: Optional["AudioGenerator"] = None,
+        cover_image_generator: Optional["CoverImageGenerator"] = None,
+        tweet_generator: Optional["TweetGenerator"] = None,
+        stage_slots: Optional[Dict[str, threading.Semaphore]] = None,
+    ):
+        """
+        Args:
+            script_generator, audio_generator, cover_image_generator, tweet_generator:
+                Existing generators to reuse (and share with other PodcastGenerators), new ones are created
+                (and their clients imported) the first time a stage needs them if None
+            stage_slots (dict): Semaphores limiting how many episodes can run each stage at the same time
+        """
         #self.content_searcher = ContentSearcher()
-        self.script_generator = ScriptGenerator()
-        self.audio_generator = AudioGenerator()
-        self.cover_image_generator = CoverImageGenerator()
-        self.tweet_generator = TweetGenerator()
+        self._script_generator = script_generator
+        self._audio_generator = audio_generator
+        self._cover_image_generator = cover_image_generator
+        self._tweet_generator = tweet_generator
+        self._generators_lock = threading.Lock()
+        self.stage_slots = stage_slots or {}
 
-    def generate_podcast(self, topic: str) -> PodcastContent:
-        """Main function to generate all podcast content"""
-        # Search for content
-        #search_results = self.content_searcher.search(topic)
-        
-        # Generate script
-        script = self.script_generator.generate(topic)
+    @property
+    def script_generator(self) -> "ScriptGenerator":
+        with self._generators_lock:
+            if self._script_generator is None:
+                from script_generation_v3 import ScriptGenerator
+                self._script_generator = ScriptGenerator()
+            return self._script_generator
+
+    @property
+    def audio_generator(self) -> "AudioGenerator":
+        with self._generators_lock:
+            if self._audio_generator is None:
+                from audio_generation import AudioGenerator
+                self._audio_generator = AudioGenerator()
+            return self._audio_generator
+
+    @property
+    def cover_image_generator(self) -> "CoverImageGenerator":
+        with self._generators_lock:
+            if self._cover_image_generator is None:
+                from cover_image_generation import CoverImageGenerator
+                self._cover_image_generator = CoverImageGenerator()
+            return self._cover_image_generator
+
+    @property
+    def tweet_generator(self) -> "TweetGenerator":
+        with self._generators_lock:
+            if self._tweet_generator is None:
+                from tweet_generation import TweetGenerator
+                self._tweet_generator = TweetGenerator()
+            return self._tweet_generator
+
+    def _limited(self, stage: str, fn: Callable) -> Callable:
+        """Wraps a stage so that it waits for a free slot of that stage before running"""
+        def run(*args):
+            with self.stage_slots.get(stage) or nullcontext():
+                return fn(*args)
+        return run
+
+    def _generate_script(self, topic: str, checkpoint: RunCheckpoint) -> str:
+        script = self.script_generator.generate(topic, checkpoint)
 
         print("Final Generated script:")
         print(script)
-        # Generate audio # TODO: change to script
-        audio_bytes = self.audio_generator.generate(script)
-        
-        # Generate cover image
-        cover_image_url = self.cover_image_generator.generate(topic)
+        return script
+
+    def generate_podcast(
+        self,
+        topic: str,
+        budget: Optional[Budget] = None,
+        checkpoint: Optional[RunCheckpoint] = None,
+        hls: bool = False,
+    ) -> PodcastContent:
+        """
+        Main function to generate all podcast content.
+        Cover image and tweet only depend on the topic, so they are generated
+        while the script and audio are being produced.
+        Every external call is recorded in the returned usage report, and checked
+        against the budget (by default read from the BUDGET_* environment variables).
+        Each completed step is saved to the checkpoint run directory (by default the topic's
+        directory under CHECKPOINT_DIR), and a failed run of the same topic resumes from it.
+        With hls, the audio is also written as an HLS stream, encoded from the same PCM as the MP3.
+        """
+        # Search for content
+        #search_results = self.content_searcher.search(topic)
         
-        # Generate tweet
-        tweet = self.tweet_generator.generate(topic)
+        checkpoint = checkpoint or RunCheckpoint.for_topic(topic)
+        print(f"Checkpointing to {checkpoint.run_dir}")
+
+        graph = StageGraph()
+        graph.add_stage("script", self._limited("script", lambda: checkpoint.cached_json(
+            "script.json", lambda: self._generate_script(topic, checkpoint)
+        )))
+        if hls:
+            # The MP3 and the HLS renditions are checkpointed together, in one directory
+            graph.add_stage("audio", self._limited("audio", lambda script: checkpoint.cached_dir(
+                "audio", lambda directory: self.audio_generator.generate_to_file(
+                    script, os.path.join(directory, "audio.mp3"), checkpoint, os.path.join(directory, "hls")
+                )
+            )), ["script"])
+        elif self.audio_generator.assembly == "disk":
+            # The episode is encoded straight into the checkpoint and only its path is kept
+            graph.add_stage("audio", self._limited("audio", lambda script: checkpoint.cached_file(
+                "audio.mp3", lambda path: self.audio_generator.generate_to_file(script, path, checkpoint)
+            )), ["script"])
+        else:
+            graph.add_stage("audio", self._limited("audio", lambda script: checkpoint.cached_bytes(
+                "audio.mp3", lambda: self.audio_generator.generate(script, checkpoint)
+            )), ["script"])
+        graph.add_stage("cover_image", self._limited("cover_image", lambda: checkpoint.cached_json(
+            "cover_image.json", lambda: self.cover_image_generator.generate(topic)
+        )))
+        graph.add_stage("tweet", self._limited("tweet", lambda: checkpoint.cached_json(
+            "tweet.json", lambda: self.tweet_generator.generate(topic)
+        )))
+        meter = UsageMeter(budget or Budget.from_env())
+        with use_meter(meter):
+            results = graph.run()
+        checkpoint.mark_complete()
+
+        print("\nStage timings:")
+        for name, seconds in graph.timings.items():
+            print(f"  {name}: {seconds:.1f}s")
+        meter.print_report()
         
+        audio = results["audio"]
+        audio_path = None if isinstance(audio, bytes) else audio
+        hls_dir = None
+        if hls:
+            audio_path, hls_dir = os.path.join(audio, "audio.mp3"), os.path.join(audio, "hls")
         return PodcastContent(
-            script=script,
-            audio_bytes=audio_bytes,
-            cover_image_url=cover_image_url,
-            tweet=tweet
-        )
\ No newline at end of file
+            script=results["script"],
+            audio_bytes=audio if isinstance(audio, bytes) else b"",
+            cover_image_url=results["cover_image"],
+            tweet=results["tweet"],
+            stage_timings=dict(graph.timings),
+            usage_report=meter.report(),
+            audio_path=audio_path,
+            hls_dir=hls_dir
+        )
+
+    def _synthesized_sections(
+        self,
+        topic: str,
+        budget: Optional[Budget] = None,
+        checkpoint: Optional[RunCheckpoint] = None,
+    ) -> Iterator["AudioSegment"]:
+        """
+        Yields the voice of each section of the episode, in order, while the script is still being written.
+        Each section is sent to TTS as soon as the script generator finishes it, and is yielded as
+        soon as it and all the sections before it are synthesized.
+        """
+        checkpoint = checkpoint or RunCheckpoint.for_topic(topic)
+        meter = UsageMeter(budget or Budget.from_env())
+        sections: queue.Queue = queue.Queue()
+        end = object()
+
+        def write_script():
+            try:
+                with use_meter(meter):
+                    self.script_generator.generate(topic, checkpoint, on_section=sections.put)
+            except Exception as e:
+                sections.put(e)
+            finally:
+                sections.put(end)
+
+        def synthesize(section: str):
+            with use_meter(meter):
+                return self.audio_generator.synthesize_section(section, checkpoint)
+
+        writer = threading.Thread(target=propagate_context(write_script), daemon=True)
+        writer.start()
+        pending = deque()
+        script_done = False
+
+        # The next section can be synthesized while the current one is, the chunks of each are already parallel
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            while pending or not script_done:
+                if pending and (pending[0].done() or script_done):
+                    yield pending.popleft().result()
+                    continue
+                try:
+                    item = sections.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is end:
+                    script_done = True
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    pending.append(executor.submit(propagate_context(synthesize), item))
+
+        checkpoint.mark_complete()
+        meter.print_report()
+
+    def stream_podcast(
+        self,
+        topic: str,
+        budget: Optional[Budget] = None,
+        checkpoint: Optional[RunCheckpoint] = None,
+        audio_format: str = "mp3",
+    ) -> Iterator[bytes]:
+        """
+        Generates the episode audio and yields it part by part while the script is still being written.
+        Each section is sent to TTS as soon as the script generator finishes it, and its encoded
+        audio is yielded as soon as it and all the sections before it are synthesized.
+        The parts are one continuous stream from a single encoder: concatenated, they decode to the episode
+        generate would produce, plus less than an MP3 frame of silence; cover image and tweet are not generated.
+        Args:
+            topic (str): The topic of the episode
+            budget (Budget): Budget of the episode, by default read from the BUDGET_* environment variables
+            checkpoint (RunCheckpoint): Run directory, by default the topic's directory under CHECKPOINT_DIR
+            audio_format (str): Format the parts are encoded to
+        Returns:
+            iterator: The encoded audio parts, in order
+        """
+        assembler = self.audio_generator.stream_assembler(audio_format)
+        for voice in self._synthesized_sections(topic, budget, checkpoint):
+            part = assembler.push(voice)
+            if part:
+                yield part
+        yield assembler.finish()
+
+    def stream_podcast_hls(
+        self,
+        topic: str,
+        output_dir: str,
+        budget: Optional[Budget] = None,
+        checkpoint: Optional[RunCheckpoint] = None,
+        bitrates: Optional[List[int]] = None,
+        segment_duration: Optional[float] = None,
+    ) -> str:
+        """
+        Generates the episode audio as an HLS stream while the script is still being written.
+        Sections are synthesized like in stream_podcast, and the segments of every rendition and
+        their playlists are written to output_dir as soon as the audio they contain is final, so the
+        episode can be served from master.m3u8 before it is complete; cover image and tweet are not generated.
+        Args:
+            topic (str): The topic of the episode
+            output_dir (str): Directory the playlists and segments are written to
+            budget (Budget): Budget of the episode, by default read from the BUDGET_* environment variables
+            checkpoint (RunCheckpoint): Run directory, by default the topic's directory under CHECKPOINT_DIR
+            bitrates (list): Bitrates of the renditions in kbit/s, by default from HLS_BITRATES
+            segment_duration (float): Duration of the segments in seconds, by default from HLS_SEGMENT_DURATION
+        Returns:
+            str: Path of the master playlist
+        """
+        from hls_output import HlsWriter
+
+        writer = HlsWriter(output_dir, bitrates, segment_duration)
+        assembler = self.audio_generator.stream_assembler()
+        for voice in self._synthesized_sections(topic, budget, checkpoint):
+            audio = assembler.push_audio(voice)
+            if audio is not None:
+                writer.write(audio)
+        writer.write(assembler.finish_audio())
+        return writer.finish()
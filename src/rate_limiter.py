@@ -0,0 +1,189 @@
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+from env import load_env
+
+# Load environment variables from .env file
+load_env()
+
+# Default limits per provider: requests per minute, units (tokens or characters) per minute,
+# maximum concurrent requests. They are overridden by RATE_LIMIT_<PROVIDER>_RPM/_UPM/_CONCURRENCY.
+DEFAULT_LIMITS = {
+    "openai": {"rpm": 500, "upm": 30000, "concurrency": 16},
+    "openai_embeddings": {"rpm": 3000, "upm": 1000000, "concurrency": 8},
+    "openai_images": {"rpm": 5, "upm": 0, "concurrency": 2},
+    "tavily": {"rpm": 100, "upm": 0, "concurrency": 8},
+    "elevenlabs": {"rpm": 100, "upm": 0, "concurrency": 5},
+}
+
+def is_rate_limited(error: Exception) -> bool:
+    """Whether the error is a 429 / rate limit response, whatever client raised it"""
+    status = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    if status == 429:
+        return True
+    name = type(error).__name__
+    return name in ("RateLimitError", "UsageLimitExceededError") or "rate limit" in str(error).lower()
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, timeouts, connection errors and 5xx responses are worth retrying"""
+    if is_rate_limited(error):
+        return True
+    status = getattr(error, "status_code", None)
+    response = getattr(error, "response", None)
+    if status is None and response is not None:
+        status = getattr(response, "status_code", None)
+    if isinstance(status, int) and status >= 500:
+        return True
+    name = type(error).__name__
+    return isinstance(error, (TimeoutError, ConnectionError)) or "Timeout" in name or "Connection" in name
+
+class TokenBucket:
+    """Continuously refilled bucket allowing `per_minute` units per minute, 0 means unlimited"""
+
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        """Blocks until amount units are available and takes them"""
+        if self.per_minute <= 0 or amount <= 0:
+            return
+        # A single request bigger than the bucket would never fit, let it drain the bucket instead
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_minute / 60)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) * 60 / self.per_minute
+            time.sleep(wait)
+
+class ProviderLimiter:
+    """
+    Throttles and retries the calls made to one provider.
+    Requests and units (tokens or characters) per minute are enforced with token buckets.
+    The number of concurrent requests adapts AIMD-style: it grows by one every
+    `limit` successful calls and is halved on a 429 or when latency exceeds latency_target.
+    Failed calls are retried with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_minute: float = 0,
+        units_per_minute: float = 0,
+        max_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        latency_target: Optional[float] = None,
+    ):
+        self.name = name
+        self.requests = TokenBucket(requests_per_minute)
+        self.units = TokenBucket(units_per_minute)
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.latency_target = latency_target
+        self.limit = float(max_concurrency)
+        self.in_flight = 0
+        self.stats = {"calls": 0, "retries": 0, "rate_limited": 0}
+        self._condition = threading.Condition()
+
+    def _acquire_slot(self):
+        with self._condition:
+            while self.in_flight >= max(int(self.limit), self.min_concurrency):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def _release_slot(self, latency: Optional[float] = None, rate_limited: bool = False):
+        with self._condition:
+            self.in_flight -= 1
+            if rate_limited:
+                self.stats["rate_limited"] += 1
+            elif latency is not None:
+                self.stats["calls"] += 1
+            if rate_limited or (latency is not None and self.latency_target and latency > self.latency_target):
+                # Multiplicative decrease
+                self.limit = max(self.min_concurrency, self.limit / 2)
+            elif latency is not None:
+                # Additive increase: about +1 per `limit` successful calls
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = None
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if headers is not None:
+            try:
+                retry_after = float(headers.get("retry-after"))
+            except (TypeError, ValueError):
+                retry_after = None
+        # Full jitter
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after or 0)
+
+    def call(self, fn: Callable, *args, units: float = 0, max_retries: Optional[int] = None, **kwargs):
+        """
+        Calls fn(*args, **kwargs) within the provider limits, retrying retryable errors.
+        Args:
+            fn (callable): The function making the request
+            units (float): Tokens or characters the request will use
+            max_retries (int): Overrides the limiter's number of retries
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(max_retries + 1):
+            self.requests.acquire(1)
+            self.units.acquire(units)
+            self._acquire_slot()
+            start = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                rate_limited = is_rate_limited(e)
+                self._release_slot(rate_limited=rate_limited)
+                if attempt == max_retries or not is_retryable(e):
+                    raise
+                delay = self._backoff(attempt, e)
+                with self._condition:
+                    self.stats["retries"] += 1
+                print(f"{self.name} request failed ({e}), retrying in {delay:.1f}s (concurrency limit {int(self.limit)})")
+                time.sleep(delay)
+                continue
+            self._release_slot(latency=time.monotonic() - start)
+            return result
+
+_limiters: Dict[str, ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    """Returns the process-wide limiter of a provider, shared by all generators"""
+    with _limiters_lock:
+        if provider not in _limiters:
+            defaults = DEFAULT_LIMITS.get(provider, {"rpm": 0, "upm": 0, "concurrency": 8})
+            prefix = f"RATE_LIMIT_{provider.upper()}"
+            latency_target = os.getenv(f"{prefix}_LATENCY_TARGET")
+            _limiters[provider] = ProviderLimiter(
+                provider,
+                requests_per_minute=float(os.getenv(f"{prefix}_RPM", defaults["rpm"])),
+                units_per_minute=float(os.getenv(f"{prefix}_UPM", defaults["upm"])),
+                max_concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", defaults["concurrency"])),
+                max_retries=int(os.getenv('RATE_LIMIT_MAX_RETRIES', '5')),
+                latency_target=float(latency_target) if latency_target else None,
+            )
+        return _limiters[provider]
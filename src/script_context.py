@@ -0,0 +1,118 @@
+import os
+from typing import Dict, List, Optional
+from env import load_env
+from usage_meter import invoke_llm
+
+# Load environment variables from .env file
+load_env()
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English text (about 4 characters per token)"""
+    return (len(text) + 3) // 4
+
+def truncate_to_budget(text: str, token_budget: int, keep: str = "start") -> str:
+    """
+    Truncates text on a word boundary so that it fits in token_budget.
+    Args:
+        text (str): The text to truncate
+        token_budget (int): Maximum estimated tokens
+        keep (str): "start" keeps the beginning of the text, "end" keeps the end
+    Returns:
+        str: The truncated text
+    """
+    if estimate_tokens(text) <= token_budget:
+        return text
+    max_chars = token_budget * 4
+    if keep == "end":
+        truncated = text[-max_chars:]
+        return truncated[truncated.find(" ") + 1:] if " " in truncated else truncated
+    truncated = text[:max_chars]
+    return truncated[:truncated.rfind(" ")] if " " in truncated else truncated
+
+class RollingContext:
+    """
+    Bounded view of a script that is being written section by section.
+    Keeps the last window_words words verbatim, an incrementally updated summary of
+    everything before them and the list of concepts already covered, so prompts built
+    from it stay within token_budget however long the episode gets.
+    """
+
+    def __init__(self, llm=None, window_words: Optional[int] = None, token_budget: Optional[int] = None):
+        """
+        Args:
+            llm: Chat model used to update the summary, if None earlier sections are only tracked by concept
+            window_words (int): Number of most recent words kept verbatim
+            token_budget (int): Maximum estimated tokens of the rendered context
+        """
+        self.llm = llm
+        self.window_words = window_words or int(os.getenv('CONTEXT_WINDOW_WORDS', '600'))
+        self.token_budget = token_budget or int(os.getenv('CONTEXT_TOKEN_BUDGET', '1500'))
+        self.summary = ""
+        self.covered_concepts: List[str] = []
+        self._words: List[str] = []
+        self._summarized_words = 0
+
+    def add_section(self, text: str, concept: Optional[str] = None):
+        """
+        Appends a new section of the script and folds the words that leave
+        the verbatim window into the summary.
+        """
+        self._words.extend(text.split())
+        if concept:
+            self.covered_concepts.append(concept)
+
+        window_start = max(len(self._words) - self.window_words, 0)
+        if window_start > self._summarized_words:
+            evicted = " ".join(self._words[self._summarized_words:window_start])
+            self._summarized_words = window_start
+            self._update_summary(evicted)
+
+    def _update_summary(self, evicted: str):
+        if self.llm is None:
+            return
+        summary_words = max(self.token_budget // 6, 50)
+        prompt = (
+            f"This is a running summary of a podcast script: {self.summary or '(empty)'}\n\n"
+            f"Update it with the following new part of the script: {evicted}\n\n"
+            f"Keep the key facts, names, numbers and ideas already discussed so that they are not repeated later. "
+            f"Important: The summary must be at most {summary_words} words. Only answer with the updated summary."
+        )
+        response = invoke_llm(self.llm, prompt, "context_summary")
+        self.summary = response.content.strip()
+
+    def state(self) -> Dict:
+        """Serializable state of the context, used to checkpoint it"""
+        return {
+            "summary": self.summary,
+            "covered_concepts": list(self.covered_concepts),
+            "words": list(self._words),
+            "summarized_words": self._summarized_words,
+        }
+
+    def restore(self, state: Dict):
+        """Restores a state returned by state() without summarizing again"""
+        self.summary = state["summary"]
+        self.covered_concepts = list(state["covered_concepts"])
+        self._words = list(state["words"])
+        self._summarized_words = state["summarized_words"]
+
+    def recent_text(self) -> str:
+        return " ".join(self._words[-self.window_words:])
+
+    def render(self) -> str:
+        """
+        Returns the context for the next prompt: summary, covered concepts and
+        the most recent words, trimmed to the token budget.
+        """
+        parts = []
+        if self.summary:
+            parts.append(f"Summary of the script so far: {self.summary}")
+        if self.covered_concepts:
+            parts.append(f"Concepts already covered: {'; '.join(self.covered_concepts)}")
+        if not parts:
+            return truncate_to_budget(self.recent_text(), self.token_budget, keep="end")
+
+        header = truncate_to_budget("\n\n".join(parts), self.token_budget // 2)
+        header = f"{header}\n\nMost recent part of the script: "
+        recent = truncate_to_budget(self.recent_text(), self.token_budget - estimate_tokens(header) - 1, keep="end")
+        return header + recent
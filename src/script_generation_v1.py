@@ -1,18 +1,18 @@
 from typing import List, Dict
-from tavily import TavilyClient
-from langchain_community.vectorstores import FAISS
-from langchain_openai.embeddings import OpenAIEmbeddings
-from langchain_openai.chat_models import ChatOpenAI
+from search_cache import CachedSearchClient
+from clients import get_chat_model, get_tavily_client
+from usage_meter import get_meter, invoke_chain
+from embedding_cache import get_retrieval_embeddings, load_or_build_vectorstore, topic_index_dir
 from langchain.chains import ConversationalRetrievalChain
 import os
-from dotenv import load_dotenv
+from env import load_env
 
 # Load environment variables from .env file
-load_dotenv()
+load_env()
 
 class ContentSearcher:
     def __init__(self):
-        self.client = TavilyClient(api_key=os.getenv('TAVILY_API_KEY'))
+        self.client = CachedSearchClient(get_tavily_client())
 
     def search(self, topic: str) -> List[Dict]:
         """
@@ -67,17 +67,16 @@ class ScriptGenerator:
             for result in search_results
         ]
         
-        vectorstore = FAISS.from_texts(
+        vectorstore = load_or_build_vectorstore(
             combined_texts,
-            OpenAIEmbeddings(openai_api_key=self.openai_api_key)
+            get_retrieval_embeddings(),
+            topic_index_dir(topic, "v1")
         )
+        retriever = vectorstore.as_retriever()
         
         chain = ConversationalRetrievalChain.from_llm(
-            llm=ChatOpenAI(
-                model="gpt-4o",
-                openai_api_key=self.openai_api_key
-            ),
-            retriever=vectorstore.as_retriever()
+            llm=get_chat_model("gpt-4o"),
+            retriever=retriever
         )
         
         chat_history = []
@@ -88,10 +87,10 @@ class ScriptGenerator:
             "chat_history": []
         }
         
-        result = chain.invoke(input_data)
+        result = invoke_chain(chain, input_data, "first_section", "gpt-4o")
         podcast_script = result["answer"]
         
-        while len(podcast_script.split()) < 2300:
+        while len(podcast_script.split()) < 2300 and not get_meter().degraded:
             chat_history.append((query, podcast_script))
 
             print("--------------------------------")
@@ -110,20 +109,16 @@ class ScriptGenerator:
                 "question": query,
                 "chat_history": []
             }
-            result = chain.invoke(input_data)
+            result = invoke_chain(chain, input_data, "expansion", "gpt-4o")
             
             new_content = result["answer"]
             podcast_script += f"\n\n{new_content}"
 
-        conclusion_llm = ChatOpenAI(
-            model="gpt-4o",
-            openai_api_key=self.openai_api_key,
-            temperature=0.9
-        )
+        conclusion_llm = get_chat_model("gpt-4o", temperature=0.9)
 
         conclusion_chain = ConversationalRetrievalChain.from_llm(
             llm=conclusion_llm,
-            retriever=vectorstore.as_retriever()
+            retriever=retriever
         )
 
         query = (
@@ -141,7 +136,7 @@ class ScriptGenerator:
             "chat_history": []
         }
 
-        result = conclusion_chain.invoke(input_data)
+        result = invoke_chain(conclusion_chain, input_data, "conclusion", "gpt-4o")
         conclusion = result["answer"]
         podcast_script += f"\n\n{conclusion}"
         
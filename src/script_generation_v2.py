@@ -1,18 +1,19 @@
 from typing import List, Dict
-from tavily import TavilyClient
-from langchain_community.vectorstores import FAISS
-from langchain_openai.embeddings import OpenAIEmbeddings
-from langchain_openai.chat_models import ChatOpenAI
+from search_cache import CachedSearchClient
+from clients import get_chat_model, get_tavily_client
+from usage_meter import get_meter, invoke_chain
+from embedding_cache import get_retrieval_embeddings, load_or_build_vectorstore, topic_index_dir
+from script_context import RollingContext, truncate_to_budget
 from langchain.chains import ConversationalRetrievalChain
 import os
-from dotenv import load_dotenv
+from env import load_env
 
 # Load environment variables from .env file
-load_dotenv()
+load_env()
 
 class ContentSearcher:
     def __init__(self):
-        self.client = TavilyClient(api_key=os.getenv('TAVILY_API_KEY'))
+        self.client = CachedSearchClient(get_tavily_client())
 
     def search(self, topic: str) -> List[Dict]:
         """
@@ -72,17 +73,16 @@ class ScriptGenerator:
             for result in search_results["news"]
         ]
         
-        vectorstore = FAISS.from_texts(
+        vectorstore = load_or_build_vectorstore(
             general_texts + news_texts,
-            OpenAIEmbeddings(openai_api_key=self.openai_api_key)
+            get_retrieval_embeddings(),
+            topic_index_dir(topic, "v2")
         )
+        retriever = vectorstore.as_retriever()
         
         chain = ConversationalRetrievalChain.from_llm(
-            llm=ChatOpenAI(
-                model="gpt-4o",
-                openai_api_key=self.openai_api_key
-            ),
-            retriever=vectorstore.as_retriever()
+            llm=get_chat_model("gpt-4o"),
+            retriever=retriever
         )
         
         chat_history = []
@@ -105,10 +105,18 @@ class ScriptGenerator:
             "chat_history": []
         }
         
-        result = chain.invoke(input_data)
+        result = invoke_chain(chain, input_data, "first_section", "gpt-4o")
         podcast_script = result["answer"]
+
+        # Expansion prompts only get a bounded view of the script and of the search
+        # results, so their size doesn't grow with the script
+        context = RollingContext(llm=get_chat_model(os.getenv('CONTEXT_SUMMARY_MODEL', 'gpt-4o-mini'), temperature=0))
+        context.add_section(podcast_script)
+        sources_budget = int(os.getenv('CONTEXT_SOURCES_TOKEN_BUDGET', '2000'))
+        general_digest = truncate_to_budget(str(general_texts), sources_budget)
+        news_digest = truncate_to_budget(str(news_texts), sources_budget)
         
-        while len(podcast_script.split()) < 2300:
+        while len(podcast_script.split()) < 2300 and not get_meter().degraded:
             chat_history.append((query, podcast_script))
 
             print("--------------------------------")
@@ -116,10 +124,10 @@ class ScriptGenerator:
             print("--------------------------------")
 
             query = (
-                f"Given the current podcast script about {topic}: {podcast_script} "
+                f"Given the current podcast script about {topic}: {context.render()} "
                 f"Provide an expansion to add at the end of the script. It must be as long as possible."
-                f"These are web search results about {topic}: {general_texts}. "
-                f"These are the news of the last 30 days about {topic}: {news_texts}. "
+                f"These are web search results about {topic}: {general_digest}. "
+                f"These are the news of the last 30 days about {topic}: {news_digest}. "
                 f"Only answer with the expansion to add at the end of the script, not the entire script. "
                 f"It must be a meaningful expansion that starts from where the current script ends. "
                 f"Important: Don't repeat the same information and concepts already present in the current script. "
@@ -130,24 +138,21 @@ class ScriptGenerator:
                 "question": query,
                 "chat_history": []
             }
-            result = chain.invoke(input_data)
+            result = invoke_chain(chain, input_data, "expansion", "gpt-4o")
             
             new_content = result["answer"]
             podcast_script += f"\n\n{new_content}"
+            context.add_section(new_content)
 
-        conclusion_llm = ChatOpenAI(
-            model="gpt-4o",
-            openai_api_key=self.openai_api_key,
-            temperature=0.9
-        )
+        conclusion_llm = get_chat_model("gpt-4o", temperature=0.9)
 
         conclusion_chain = ConversationalRetrievalChain.from_llm(
             llm=conclusion_llm,
-            retriever=vectorstore.as_retriever()
+            retriever=retriever
         )
 
         query = (
-            f"Given the current podcast script about {topic}: {podcast_script} "
+            f"Given the current podcast script about {topic}: {context.render()} "
             f"Provide a conclusion to the script of at least 200 words. "
             f"It must contain: "
             f"A conclusive summary of the key takeaways of the script, "
@@ -161,7 +166,7 @@ class ScriptGenerator:
             "chat_history": []
         }
 
-        result = conclusion_chain.invoke(input_data)
+        result = invoke_chain(conclusion_chain, input_data, "conclusion", "gpt-4o")
         conclusion = result["answer"]
         podcast_script += f"\n\n{conclusion}"
         
@@ -1,21 +1,34 @@
-from typing import List, Dict
-from tavily import TavilyClient
-from langchain_openai.chat_models import ChatOpenAI
+from typing import Callable, List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor
+from search_cache import CachedSearchClient
+from document_store import DocumentStore, get_document_store
+from clients import get_chat_model, get_tavily_client
+from dedup import deduplicate_search_results
+from embedding_cache import get_retrieval_embeddings, load_or_build_vectorstore, topic_index_dir
+from script_context import RollingContext
+from usage_meter import get_meter, invoke_chain, invoke_llm, propagate_context
+from checkpoint import NullCheckpoint, RunCheckpoint
 import os
 import json
-from dotenv import load_dotenv
-from langchain_community.vectorstores import FAISS
+from env import load_env
 from langchain.chains import ConversationalRetrievalChain
-from langchain_openai.embeddings import OpenAIEmbeddings
 
 # Load environment variables from .env file
-load_dotenv()
+load_env()
 
 class ContentSearcher:
-    def __init__(self):
-        self.client = TavilyClient(api_key=os.getenv('TAVILY_API_KEY'))
+    def __init__(self, max_in_flight: Optional[int] = None, store: Optional[DocumentStore] = None):
+        """
+        Args:
+            max_in_flight (int): Maximum number of concurrent Tavily requests
+            store (DocumentStore): Store to keep results across episodes in, by default the
+                process-wide one if DOCUMENT_STORE is "on"
+        """
+        self.max_in_flight = max_in_flight or int(os.getenv('SEARCH_MAX_IN_FLIGHT', '8'))
+        self.client = CachedSearchClient(get_tavily_client())
+        self.store = store or get_document_store()
         # self.embeddings = OpenAIEmbeddings(openai_api_key=os.getenv('OPENAI_API_KEY'))
-        self.llm = ChatOpenAI(model="gpt-4o", openai_api_key=os.getenv('OPENAI_API_KEY'))
+        self.llm = get_chat_model("gpt-4o")
         # self.vectorstore = None
 
     def get_search_queries(self, main_topic: str) -> List[str]:
@@ -42,68 +55,119 @@ class ContentSearcher:
             f"aspects of the topic. Do not include '{main_topic}' as it is in the response search queries. "
             f"Make sure to only include the comma separated list of search queries in your response."
         )
-        response = self.llm.invoke(prompt)
+        response = invoke_llm(self.llm, prompt, "search_queries")
         topics = [topic.strip() for topic in response.content.split(",")]
         topics = [main_topic] + topics
         print(f"Generated topics: {topics}\n")
         return topics
 
-    def search(self, topics: List[str]) -> Dict[str, List[Dict]]:
-        """Perform searches for each topic and combine results."""
-        all_results = {"general": [], "news": []}
-        #documents = []
-        
-        for topic in topics:
-            print(f"Searching for: {topic}")
-            general_results = self.client.search(
-                query=topic,
-                search_depth="advanced",
-                max_results=15
-            )
-            news_results = self.client.search(
+    def _search_one(self, topic: str, kind: str) -> Dict:
+        """Run a single Tavily request for a topic, either "general" or "news"."""
+        if self.store is not None:
+            return self._search_with_store(topic, kind)
+        if kind == "news":
+            return self.client.search(
                 query=topic,
                 topic="news",
                 days=30,
                 search_depth="advanced",
                 max_results=10
             )
-            
+        return self.client.search(
+            query=topic,
+            search_depth="advanced",
+            max_results=15
+        )
+
+    def _search_with_store(self, topic: str, kind: str) -> Dict:
+        """
+        Serves a search from the document store, only fetching what is missing from it:
+        news published since the last refresh of the topic, and general results once they expired.
+        """
+        max_results = 10 if kind == "news" else 15
+        if self.store.needs_refresh(topic, kind):
+            if kind == "news":
+                response = self.client.search(
+                    query=topic,
+                    topic="news",
+                    days=self.store.news_days(topic),
+                    search_depth="advanced",
+                    max_results=max_results
+                )
+            else:
+                response = self.client.search(query=topic, search_depth="advanced", max_results=max_results)
+            self.store.add(topic, kind, response["results"])
+        # News accumulate across refreshes, the most recent ones of the window are kept
+        return {"results": self.store.documents(topic, kind, limit=2 * max_results if kind == "news" else None)}
+
+    def search(self, topics: List[str], max_in_flight: Optional[int] = None) -> Dict[str, List[Dict]]:
+        """
+        Perform searches for each topic and combine results.
+        Requests are fanned out over a bounded thread pool, but results are always
+        combined in topic order so the output is deterministic.
+        Args:
+            topics (list): The search queries to run
+            max_in_flight (int): Maximum number of concurrent Tavily requests, 1 runs them sequentially
+        Returns:
+            dict: General and news results for all topics
+        """
+        max_in_flight = max_in_flight or self.max_in_flight
+        all_results = {"general": [], "news": []}
+        jobs = [(topic, kind) for topic in topics for kind in ("general", "news")]
+
+        print(f"Searching for {len(topics)} topics ({max_in_flight} requests in flight)")
+        if max_in_flight <= 1:
+            responses = [self._search_one(topic, kind) for topic, kind in jobs]
+        else:
+            with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+                responses = list(executor.map(propagate_context(lambda job: self._search_one(*job)), jobs))
+
+        for i, topic in enumerate(topics):
+            general_results, news_results = responses[2 * i], responses[2 * i + 1]
+
             # Process results for the dictionary return
             all_results["general"].extend([
-                {"title": result["title"], "content": result["content"], "source": "general"}
+                {"title": result["title"], "content": result["content"], "url": result.get("url", ""), "source": "general"}
                 for result in general_results["results"]
             ])
             
             all_results["news"].extend([
-                {"title": result["title"], "content": result["content"], "source": "news"}
+                {"title": result["title"], "content": result["content"], "url": result.get("url", ""), "source": "news"}
                 for result in news_results["results"]
             ])
             
-            # Prepare documents for vector store
-            # for result in general_results["results"] + news_results["results"]:
-            #     documents.append(
-            #         f"Title: {result['title']}\n\nContent: {result['content']}"
-            #     )
-            
-            print(f"Found {len(general_results['results'])} general and {len(news_results['results'])} news results")
-        
-        # # Create vector store from documents
-        # print("\nCreating vector store from search results...")
-        # self.vectorstore = FAISS.from_texts(
-        #     documents,
-        #     self.embeddings
-        # )
-        
+            print(f"Found {len(general_results['results'])} general and {len(news_results['results'])} news results for: {topic}")
+
+        stats = self.client.cache.stats
+        print(f"Search cache: {stats['hits']} hits, {stats['misses']} misses")
+        if self.store is not None:
+            stats = self.store.stats
+            print(f"Document store: {stats['reused']} searches served from the store, {stats['refreshed']} refreshed, "
+                  f"{stats['stored']} new and {stats['known']} known documents")
         return all_results
 
 class ScriptGenerator:
-    def __init__(self):
+    def __init__(self, searcher: Optional[ContentSearcher] = None, mode: Optional[str] = None):
+        """
+        Args:
+            searcher (ContentSearcher): Searcher to use, and possibly share with other generators
+            mode (str): "sequential" expands the concepts one after another, each one following
+                the script so far; "parallel" writes all sections at the same time from the
+                outline and then smooths the transitions between them
+        """
         self.openai_api_key = os.getenv('OPENAI_API_KEY')
         self.llm_chain = None
-        self.searcher = ContentSearcher()
+        self.vectorstore = None
+        # The searcher holds no per-episode state, so it can be shared between generators
+        self.searcher = searcher or ContentSearcher()
+        self.mode = mode or os.getenv('SCRIPT_GENERATION_MODE', 'sequential')
+        self.section_workers = int(os.getenv('SCRIPT_SECTION_WORKERS', '6'))
         
-    def extract_concepts(self, topic: str, search_results: Dict[str, List[Dict]]) -> List[Dict]:
-        print("\nExtracting key concepts from search results...")
+    def build_retrieval_chain(self, topic: str, search_results: Dict[str, List[Dict]]):
+        """Indexes the search results and builds the retrieval chain used for every section of the script"""
+        # Drop repeated and near-identical articles returned by overlapping queries
+        search_results, removed = deduplicate_search_results(search_results)
+        print(f"Removed {removed['exact']} exact and {removed['near']} near-duplicate documents")
         
         # Combine general and news results into documents
         documents = []
@@ -113,15 +177,21 @@ class ScriptGenerator:
             )
             
         # Create vector store from documents
-        vectorstore = FAISS.from_texts(
+        vectorstore = load_or_build_vectorstore(
             documents,
-            OpenAIEmbeddings(openai_api_key=self.openai_api_key)
+            get_retrieval_embeddings(self.searcher.store),
+            topic_index_dir(topic, "v3")
         )
         
+        self.vectorstore = vectorstore
         self.llm_chain = ConversationalRetrievalChain.from_llm(
-            llm=ChatOpenAI(model="gpt-4o", openai_api_key=self.openai_api_key, temperature=0.5),
+            llm=get_chat_model("gpt-4o", temperature=0.5),
             retriever=vectorstore.as_retriever(),
         )
+
+    def extract_concepts(self, topic: str, search_results: Dict[str, List[Dict]]) -> List[Dict]:
+        print("\nExtracting key concepts from search results...")
+        self.build_retrieval_chain(topic, search_results)
         
         prompt = (
             f"""
@@ -138,7 +208,7 @@ class ScriptGenerator:
             #Make sure to incorporate both general knowledge and recent news.
         )
         
-        response = self.llm_chain.invoke({"question": prompt, "chat_history": []})
+        response = invoke_chain(self.llm_chain, {"question": prompt, "chat_history": []}, "concepts", "gpt-4o")
         try:
             concepts = json.loads(response["answer"])
             print("\nExtracted concepts:")
@@ -163,7 +233,7 @@ class ScriptGenerator:
             f"Important: Only include words that can be pronounced by a native English speaker."
         )
         
-        response = self.llm_chain.invoke({"question": prompt, "chat_history": []})
+        response = invoke_chain(self.llm_chain, {"question": prompt, "chat_history": []}, "introduction", "gpt-4o")
         intro = response["answer"]
         print(f"Generated introduction of {len(intro.split())} words")
         return intro
@@ -183,16 +253,16 @@ class ScriptGenerator:
             f"Important: Only include words that can be pronounced by a native English speaker (e.g. no special characters, no emojis, etc.)."
         )
         
-        response = self.llm_chain.invoke({"question": prompt, "chat_history": []})
+        response = invoke_chain(self.llm_chain, {"question": prompt, "chat_history": []}, "expansion", "gpt-4o")
         content = response["answer"]
         print(f"Generated {len(content.split())} words for this concept")
         return content
 
-    def generate_conclusion(self, topic: str, full_script: str) -> str:
+    def generate_conclusion(self, topic: str, script_context: str) -> str:
         print("\nGenerating conclusion...")
         
         prompt = (
-            f"Generate a conclusion for this podcast episode script about {topic}: {full_script}"
+            f"Generate a conclusion for this podcast episode script about {topic}: {script_context}"
             f"Include: "
             f"1. A summary of key takeaways\n"
             f"2. A motivating statement for listeners to learn more\n"
@@ -203,29 +273,169 @@ class ScriptGenerator:
             f"Important: Only include words that can be pronounced by a native English speaker in the podcast scripts."
         )
         
-        response = self.llm_chain.invoke({"question": prompt, "chat_history": []})
+        response = invoke_chain(self.llm_chain, {"question": prompt, "chat_history": []}, "conclusion", "gpt-4o")
         conclusion = response["answer"]
         print(f"Generated conclusion of {len(conclusion.split())} words")
         return conclusion
 
-    def generate(self, topic: str) -> str:
-        print(f"\nGenerating podcast script for: {topic}")
-        
-        search_queries = self.searcher.get_search_queries(topic)
-        search_results = self.searcher.search(search_queries)
-        # Extract and order key concepts
-        concepts = self.extract_concepts(topic, search_results)["concepts"]
-        
+    def write_section(self, topic: str, concept: Dict, outline: List[Dict], target_words: int) -> str:
+        """
+        Writes the section of one concept on its own, from the documents retrieved for that concept.
+        The section doesn't see the rest of the script, only the outline, so all sections can be written at the same time.
+        Args:
+            topic (str): The topic of the episode
+            concept (dict): The concept of this section
+            outline (list): All the concepts of the episode, in order
+            target_words (int): Target length of the section
+        Returns:
+            str: The section text
+        """
+        print(f"\nWriting section: {concept['title']}")
+        k = int(os.getenv('SECTION_RETRIEVAL_K', '6'))
+        documents = self.vectorstore.similarity_search(f"{concept['title']}: {concept['description']}", k=k)
+        sources = "\n\n".join(document.page_content for document in documents)
+        other_concepts = "; ".join(other["title"] for other in outline if other is not concept)
+        llm = get_chat_model("gpt-4o", temperature=0.5)
+
+        prompt = (
+            f"You are writing one section of a podcast script about {topic}.\n"
+            f"This section is about: {concept['title']} - {concept['description']}\n"
+            f"Other sections of the episode cover: {other_concepts}. Do not cover them here.\n\n"
+            f"Use these sources:\n{sources}\n\n"
+            f"Make it engaging and informative. "
+            f"Important: It should be around {target_words} words without repeating the same information and concepts or becoming boring and repetitive. "
+            f"Don't open with a greeting or an introduction to the episode and don't close with a conclusion, "
+            f"as the section will be placed between other sections. "
+            f"Don't explicitly announce the topic or use phrases like 'now let's talk about' or 'moving on to'. "
+            f"Important: Only include words that can be pronounced by a native English speaker (e.g. no special characters, no emojis, etc.)."
+        )
+        content = invoke_llm(llm, prompt, "section").content.strip()
+
+        # A section well short of its target is continued once, so the episode keeps its length
+        words = len(content.split())
+        if words < 0.8 * target_words:
+            prompt = (
+                f"This is a section of a podcast script about {topic}, on {concept['title']}: {content}\n\n"
+                f"Continue it with about {target_words - words} more words, adding new information from these sources:\n{sources}\n\n"
+                f"Only answer with the continuation, it must follow the last sentence naturally. "
+                f"Important: Only include words that can be pronounced by a native English speaker (e.g. no special characters, no emojis, etc.)."
+            )
+            content += "\n\n" + invoke_llm(llm, prompt, "section").content.strip()
+
+        print(f"Generated {len(content.split())} words for section: {concept['title']}")
+        return content
+
+    def stitch_sections(self, topic: str, sections: List[str]) -> List[str]:
+        """
+        Rewrites the boundaries between independently written sections into smooth transitions.
+        Only the last paragraph of each section and the first paragraph of the next one are sent
+        to the model, in a single request; the rest of the script is left untouched.
+        Args:
+            topic (str): The topic of the episode
+            sections (list): The sections of the script, in order
+        Returns:
+            list: The sections with rewritten boundaries
+        """
+        print("\nStitching section boundaries...")
+        paragraphs = [section.split("\n\n") for section in sections]
+        # A single-paragraph section can only take part in one boundary, or its rewrites would overlap
+        positions = []
+        for i in range(len(sections) - 1):
+            if len(paragraphs[i]) == 1 and positions and positions[-1] == i - 1:
+                continue
+            positions.append(i)
+        if not positions:
+            return sections
+        boundaries = [{"end": paragraphs[i][-1], "start": paragraphs[i + 1][0]} for i in positions]
+
+        prompt = (
+            f"These are the boundaries between consecutive sections of a podcast script about {topic}. "
+            f"Each one has the last paragraph of a section (\"end\") and the first paragraph of the next one (\"start\"):\n"
+            f"{json.dumps(boundaries, indent=2)}\n\n"
+            f"Rewrite each pair so that the script flows naturally from one section into the next, "
+            f"with a smooth transition that doesn't explicitly announce the topic or use phrases like 'now let's talk about' or 'moving on to'. "
+            f"Keep the information and about the same length, change as little as possible. "
+            f"Important: only include a json object in the following format, with one entry per boundary in the same order: "
+            f"{{\"boundaries\": [{{\"end\": \"...\", \"start\": \"...\"}}, ...]}}\n"
+            f"Important: Do not include any other text or comments in your response."
+        )
+        llm = get_chat_model(os.getenv('STITCH_MODEL', 'gpt-4o-mini'), temperature=0)
+        response = invoke_llm(llm, prompt, "stitching")
+        try:
+            rewritten = json.loads(response.content.strip().removeprefix("```json").removesuffix("```"))["boundaries"]
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            print(f"Error parsing stitched boundaries ({e}), keeping the original ones")
+            return sections
+        if len(rewritten) != len(boundaries):
+            print("Stitching returned a different number of boundaries, keeping the original ones")
+            return sections
+
+        for i, boundary in zip(positions, rewritten):
+            paragraphs[i][-1] = boundary["end"].strip()
+            paragraphs[i + 1][0] = boundary["start"].strip()
+        return ["\n\n".join(section_paragraphs) for section_paragraphs in paragraphs]
+
+    def _generate_parallel(self, topic: str, concepts: List[Dict], checkpoint: RunCheckpoint, on_section: Callable[[str], None]) -> str:
+        """Writes introduction, concept sections and conclusion concurrently, then stitches them together"""
+        target_words = round(2100.0 / float(len(concepts)))
+        outline = "\n".join(f"{i + 1}. {concept['title']} - {concept['description']}" for i, concept in enumerate(concepts))
+
+        def section(i: int, concept: Dict) -> Optional[str]:
+            if get_meter().degraded:
+                print(f"Budget exceeded, skipping section: {concept['title']}")
+                return None
+            return checkpoint.cached_json(
+                f"sections/section_{i:02d}.json", lambda: self.write_section(topic, concept, concepts, target_words)
+            )
+
+        jobs = [lambda: checkpoint.cached_json("sections/introduction.json", lambda: self.generate_introduction(topic))]
+        jobs += [lambda i=i, concept=concept: section(i, concept) for i, concept in enumerate(concepts)]
+        jobs += [lambda: checkpoint.cached_json(
+            "sections/conclusion.json",
+            lambda: self.generate_conclusion(topic, f"The episode covers, in this order:\n{outline}\n")
+        )]
+        print(f"\nWriting {len(jobs)} sections ({self.section_workers} in parallel)")
+        with ThreadPoolExecutor(max_workers=self.section_workers) as executor:
+            sections = list(executor.map(propagate_context(lambda job: job()), jobs))
+
+        sections = [section for section in sections if section]
+        sections = checkpoint.cached_json("sections/stitched.json", lambda: self.stitch_sections(topic, sections))
+        # Boundaries change when stitching, so sections are only final once all of them are written
+        for section in sections:
+            on_section(section)
+        return "\n\n".join(sections)
+
+    def _generate_sequential(self, topic: str, concepts: List[Dict], checkpoint: RunCheckpoint, on_section: Callable[[str], None]) -> str:
+        """Expands the concepts one after another, each one following the script written so far"""
         # Generate introduction
         print("\nGenerating introduction...")
-        script = self.generate_introduction(topic)
+        script = checkpoint.cached_json("sections/introduction.json", lambda: self.generate_introduction(topic))
         print(f"Introduction length: {len(script.split())} words")
+        on_section(script)
+
+        # Later prompts only see a bounded window of the script, not the whole of it
+        context = RollingContext(llm=get_chat_model(os.getenv('CONTEXT_SUMMARY_MODEL', 'gpt-4o-mini'), temperature=0))
+        context.add_section(script)
 
         # Expand concepts one by one until reaching target length
         for i, concept in enumerate(concepts):
             print(f"\nExpanding concept {i}/{len(concepts)}: {concept['title']} - {concept['description']}")
-            concept_content = self.expand_concept(topic, concept, script, len(concepts))
+            # Each section is saved with the context that follows it, so resuming doesn't summarize again
+            section = checkpoint.load_json(f"sections/concept_{i:02d}.json")
+            if section is not None:
+                print(f"Resuming from checkpoint: concept {i}")
+                script += f"\n\n{section['content']}"
+                context.restore(section["context"])
+                on_section(section["content"])
+                continue
+            if get_meter().degraded:
+                print("Budget exceeded, skipping the remaining concepts")
+                break
+            concept_content = self.expand_concept(topic, concept, context.render(), len(concepts))
             script += f"\n\n{concept_content}"
+            context.add_section(concept_content, concept['title'])
+            checkpoint.save_json(f"sections/concept_{i:02d}.json", {"content": concept_content, "context": context.state()})
+            on_section(concept_content)
             
             current_length = len(script.split())
             print(f"Current script length: {current_length} words")
@@ -236,9 +446,43 @@ class ScriptGenerator:
         
         # Add conclusion
         print("\nGenerating conclusion...")
-        conclusion = self.generate_conclusion(topic, script)
+        conclusion = checkpoint.cached_json("sections/conclusion.json", lambda: self.generate_conclusion(topic, context.render()))
         script += f"\n\n{conclusion}"
+        on_section(conclusion)
+        return script
+
+    def generate(
+        self,
+        topic: str,
+        checkpoint: Optional[RunCheckpoint] = None,
+        on_section: Optional[Callable[[str], None]] = None,
+    ) -> str:
+        """
+        Generates the script of an episode.
+        Args:
+            topic (str): The topic of the episode
+            checkpoint (RunCheckpoint): Run directory where completed steps are saved,
+                steps already saved there by a previous run are not generated again
+            on_section (callable): Called with each section of the script, in order, as soon as it is final
+        Returns:
+            str: The podcast script
+        """
+        print(f"\nGenerating podcast script for: {topic}")
+        checkpoint = checkpoint or NullCheckpoint()
+        on_section = on_section or (lambda section: None)
         
+        search_queries = checkpoint.cached_json("search_queries.json", lambda: self.searcher.get_search_queries(topic))
+        search_results = checkpoint.cached_json("search_results.json", lambda: self.searcher.search(search_queries))
+        # Extract and order key concepts
+        if checkpoint.exists("concepts.json"):
+            self.build_retrieval_chain(topic, search_results)
+        concepts = checkpoint.cached_json("concepts.json", lambda: self.extract_concepts(topic, search_results))["concepts"]
+        
+        if self.mode == "parallel":
+            script = self._generate_parallel(topic, concepts, checkpoint, on_section)
+        else:
+            script = self._generate_sequential(topic, concepts, checkpoint, on_section)
+
         final_length = len(script.split())
         print(f"\nFinal script length: {final_length} words")
         return script
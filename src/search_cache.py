@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+from env import load_env
+from usage_meter import get_meter
+from rate_limiter import get_limiter
+
+# Load environment variables from .env file
+load_env()
+
+class SearchCache:
+    """
+    On-disk cache for Tavily search responses, backed by SQLite.
+    Entries expire after a per-topic-type TTL and the least recently used ones
+    are evicted once the cache holds more than max_entries responses.
+    When LLM_CACHE_MODE is "replay" expired entries are still served, so a
+    recorded run can be reproduced offline.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        general_ttl: Optional[float] = None,
+        news_ttl: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ):
+        self.path = path or os.getenv('SEARCH_CACHE_PATH', '.cache/search_cache.sqlite')
+        self.ttls = {
+            "general": general_ttl if general_ttl is not None else float(os.getenv('SEARCH_CACHE_GENERAL_TTL', str(7 * 24 * 3600))),
+            "news": news_ttl if news_ttl is not None else float(os.getenv('SEARCH_CACHE_NEWS_TTL', str(6 * 3600))),
+        }
+        self.max_entries = max_entries or int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', '5000'))
+        self.ignore_ttl = os.getenv('LLM_CACHE_MODE') == 'replay'
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, topic_type TEXT, created REAL, accessed REAL, response TEXT)"
+        )
+        self._connection.commit()
+
+    @staticmethod
+    def make_key(query: str, topic_type: str, days: int, max_results: int, search_depth: str) -> str:
+        """Builds the cache key for a search request."""
+        payload = json.dumps([query, topic_type, days, max_results, search_depth])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, topic_type: str) -> Optional[Dict]:
+        """
+        Returns the cached response for key, or None if it is missing or expired.
+        """
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT created, response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            created, response = row
+            if not self.ignore_ttl and now - created > self.ttls.get(topic_type, self.ttls["general"]):
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._connection.commit()
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._connection.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._connection.commit()
+            self.stats["hits"] += 1
+        return json.loads(response)
+
+    def put(self, key: str, topic_type: str, response: Dict):
+        """Stores a response and evicts the least recently used entries above max_entries."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, topic_type, created, accessed, response) VALUES (?, ?, ?, ?, ?)",
+                (key, topic_type, now, now, json.dumps(response)),
+            )
+            count = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                evicted = count - self.max_entries
+                self._connection.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed ASC LIMIT ?)",
+                    (evicted,),
+                )
+                self.stats["evictions"] += evicted
+            self._connection.commit()
+
+    def clear(self):
+        """Removes every cached response."""
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.commit()
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+class CachedSearchClient:
+    """
+    Drop-in wrapper around TavilyClient whose search method is served from a SearchCache.
+    """
+
+    def __init__(self, client, cache: Optional[SearchCache] = None):
+        self.client = client
+        self.cache = cache if cache is not None else SearchCache()
+
+    def search(
+        self,
+        query: str,
+        search_depth: str = "basic",
+        topic: str = "general",
+        days: int = 3,
+        max_results: int = 5,
+        **kwargs,
+    ) -> Dict:
+        # Extra options change the response shape, so those requests bypass the cache
+        if kwargs:
+            with get_meter().track("search", "tavily", search_depth):
+                return get_limiter("tavily").call(self.client.search, query=query, search_depth=search_depth,
+                                                  topic=topic, days=days, max_results=max_results, **kwargs)
+
+        key = SearchCache.make_key(query, topic, days, max_results, search_depth)
+        response = self.cache.get(key, topic)
+        if response is not None:
+            return response
+
+        with get_meter().track("search", "tavily", search_depth):
+            response = get_limiter("tavily").call(self.client.search, query=query, search_depth=search_depth,
+                                                  topic=topic, days=days, max_results=max_results)
+        self.cache.put(key, topic, response)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
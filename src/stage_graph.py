@@ -0,0 +1,89 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+from usage_meter import propagate_context
+
+@dataclass
+class Stage:
+    """A named unit of work and the stages whose results it needs"""
+    name: str
+    fn: Callable[..., Any]
+    dependencies: List[str] = field(default_factory=list)
+
+class StageGraph:
+    """
+    Small dependency-graph executor.
+    Each stage starts as soon as all of its dependencies have finished, so independent
+    stages run concurrently. A stage is called with its dependencies' results as
+    positional arguments, in the order the dependencies were declared.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+        self.stages: Dict[str, Stage] = {}
+        self.timings: Dict[str, float] = {}
+
+    def add_stage(self, name: str, fn: Callable[..., Any], dependencies: Optional[List[str]] = None) -> "StageGraph":
+        if name in self.stages:
+            raise ValueError(f"Stage '{name}' is already defined")
+        self.stages[name] = Stage(name, fn, list(dependencies or []))
+        return self
+
+    def _validate(self):
+        for stage in self.stages.values():
+            for dependency in stage.dependencies:
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage '{stage.name}' depends on unknown stage '{dependency}'")
+
+        # Kahn's algorithm: every stage must eventually become ready
+        remaining = {name: set(stage.dependencies) for name, stage in self.stages.items()}
+        while remaining:
+            ready = [name for name, dependencies in remaining.items() if not dependencies]
+            if not ready:
+                raise ValueError(f"Stages {sorted(remaining)} form a dependency cycle")
+            for name in ready:
+                del remaining[name]
+            for dependencies in remaining.values():
+                dependencies.difference_update(ready)
+
+    def _timed(self, stage: Stage, args: List[Any]) -> Any:
+        start = time.perf_counter()
+        try:
+            return stage.fn(*args)
+        finally:
+            self.timings[stage.name] = time.perf_counter() - start
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Runs every stage once its dependencies are done.
+        Returns:
+            dict: The result of each stage by name
+        Raises:
+            Exception: The first exception raised by a stage, stages not yet started are skipped
+        """
+        self._validate()
+        results: Dict[str, Any] = {}
+        pending = dict(self.stages)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers or len(self.stages) or 1) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    if all(dependency in results for dependency in stage.dependencies):
+                        args = [results[dependency] for dependency in stage.dependencies]
+                        running[executor.submit(propagate_context(self._timed), stage, args)] = name
+                        del pending[name]
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        for other in running:
+                            other.cancel()
+                        raise error
+                    results[name] = future.result()
+                    print(f"Stage '{name}' finished in {self.timings[name]:.1f}s")
+
+        return results
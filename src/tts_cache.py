@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import List, Optional, Set
+from env import load_env
+
+# Load environment variables from .env file
+load_env()
+
+def normalize_text(text: str) -> str:
+    """Text as it is sent to TTS: Unicode NFKC with runs of whitespace collapsed to single spaces"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+class TTSCache:
+    """
+    Persistent cache of synthesized speech, backed by SQLite.
+    Audio is keyed by the normalized text, voice and model of the chunk it was made from,
+    so an edited script only needs the chunks whose text changed synthesized again.
+    The least recently used entries are evicted once the audio in the cache is larger than max_bytes
+    (TTS_CACHE_MAX_MB, 1024 MB by default, about 17 hours of speech at 128 kbit/s).
+    """
+
+    def __init__(self, path: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.path = path or os.getenv('TTS_CACHE_PATH', '.cache/tts_cache.sqlite')
+        self.max_bytes = max_bytes or int(float(os.getenv('TTS_CACHE_MAX_MB', '1024')) * 1024 * 1024)
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "characters_reused": 0}
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "key TEXT PRIMARY KEY, voice TEXT, model TEXT, characters INTEGER, created REAL, accessed REAL, audio BLOB)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS chunks_accessed ON chunks (accessed)")
+        self._connection.commit()
+        # Bytes of audio in the cache, summed once here and kept up to date by put, so an insert doesn't scan the table
+        # (length() of a blob is read from the record header, the audio itself isn't loaded)
+        self._size = self._connection.execute("SELECT COALESCE(SUM(length(audio)), 0) FROM chunks").fetchone()[0]
+
+    @staticmethod
+    def make_key(text: str, voice: str, model: str) -> str:
+        """Builds the cache key of a TTS request."""
+        payload = json.dumps([normalize_text(text), voice, model])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the cached audio for key, or None if it is missing."""
+        with self._lock:
+            row = self._connection.execute("SELECT characters, audio FROM chunks WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self._connection.execute("UPDATE chunks SET accessed = ? WHERE key = ?", (time.time(), key))
+            self._connection.commit()
+            self.stats["hits"] += 1
+            self.stats["characters_reused"] += row[0]
+        return bytes(row[1])
+
+    def contains(self, keys: List[str]) -> Set[str]:
+        """Returns the keys that are cached, without counting them as hits or refreshing them."""
+        found = set()
+        with self._lock:
+            # SQLite limits the number of parameters of a statement
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._connection.execute(
+                    f"SELECT key FROM chunks WHERE key IN ({', '.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def put(self, key: str, voice: str, model: str, text: str, audio: bytes):
+        """Stores the audio of a chunk and evicts the least recently used entries above max_bytes."""
+        now = time.time()
+        with self._lock:
+            replaced = self._connection.execute("SELECT length(audio) FROM chunks WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO chunks (key, voice, model, characters, created, accessed, audio) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, voice, model, len(text), now, now, sqlite3.Binary(audio)),
+            )
+            self._size += len(audio) - (replaced[0] if replaced else 0)
+            if self._size > self.max_bytes:
+                evicted = []
+                for evicted_key, length in self._connection.execute(
+                    "SELECT key, length(audio) FROM chunks ORDER BY accessed ASC"
+                ):
+                    if self._size <= self.max_bytes:
+                        break
+                    evicted.append((evicted_key,))
+                    self._size -= length
+                self._connection.executemany("DELETE FROM chunks WHERE key = ?", evicted)
+                self.stats["evictions"] += len(evicted)
+            self._connection.commit()
+
+    def clear(self):
+        """Removes every cached chunk."""
+        with self._lock:
+            self._connection.execute("DELETE FROM chunks")
+            self._connection.commit()
+            self._size = 0
+
+_cache: Optional[TTSCache] = None
+_cache_lock = threading.Lock()
+
+def get_tts_cache() -> Optional[TTSCache]:
+    """Returns the process-wide TTS cache, None if TTS_CACHE is "off" """
+    global _cache
+    if os.getenv('TTS_CACHE', 'on') == 'off':
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = TTSCache()
+        return _cache
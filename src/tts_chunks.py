@@ -0,0 +1,250 @@
+import heapq
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Set, Tuple
+from env import load_env
+from tts_cache import normalize_text
+
+# Load environment variables from .env file
+load_env()
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+# Sentence-ending punctuation, closing quotes or brackets, then the whitespace a sentence is split on
+SENTENCE_END = re.compile(r"[.!?…]+[\"'”’)\]]*\s+")
+
+# Words whose period doesn't end the sentence (compared lowercased, without their last period)
+ABBREVIATIONS = frozenset("""
+mr mrs ms dr prof sr jr st mt ft gen col lt sgt capt cmdr adm gov sen rep rev hon pres vs
+e.g i.e cf al approx inc ltd co corp dept est fig no nos vol pp jan feb mar apr jun jul aug sep sept oct nov dec
+a.m p.m u.s u.k u.n e.u ph.d
+""".split())
+# Abbreviations that also end sentences: they do when the next word is capitalized
+SENTENCE_FINAL_ABBREVIATIONS = frozenset("etc inc ltd co corp al a.m p.m u.s u.k u.n e.u".split())
+DOTTED_ACRONYM = re.compile(r"(?:[a-z]\.)+[a-z]", re.IGNORECASE)
+
+def split_paragraphs(script: str) -> List[str]:
+    """Splits a script on blank lines, dropping empty paragraphs"""
+    return [paragraph.strip() for paragraph in PARAGRAPH_BREAK.split(script) if paragraph.strip()]
+
+def _ends_sentence(text: str, match: re.Match) -> bool:
+    """Whether the punctuation of match ends a sentence, from the word before it and the character after it"""
+    following = text[match.end():match.end() + 1]
+    if not following:
+        return True
+    capitalized = following.isupper() or not following.isalnum()
+    if not match.group().startswith("."):
+        # "Yahoo! is" or "what? she asked" go on
+        return capitalized
+    before = text[:match.start()].rsplit(None, 1)
+    word = before[-1].lstrip("\"'“‘([") if before else ""
+    if word.lower() in ABBREVIATIONS:
+        return word.lower() in SENTENCE_FINAL_ABBREVIATIONS and capitalized
+    if len(word) == 1 and word.isalpha():
+        # An initial, like "J. R. R. Tolkien"
+        return False
+    if DOTTED_ACRONYM.fullmatch(word):
+        return capitalized
+    # A lowercase word or a number after the period means it was an abbreviation ("approx. 5", "the dept. head")
+    return capitalized and not following.isdigit()
+
+def split_sentences(paragraph: str) -> List[str]:
+    """
+    Splits a paragraph into sentences.
+    Periods of decimals and of abbreviations, initials and acronyms, and punctuation followed
+    by a lowercase word, don't end sentences.
+    """
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(paragraph):
+        if _ends_sentence(paragraph, match):
+            sentences.append(paragraph[start:match.end()].strip())
+            start = match.end()
+    sentences.append(paragraph[start:].strip())
+    return [sentence for sentence in sentences if sentence]
+
+@dataclass
+class TTSCostModel:
+    """
+    Estimated synthesis time of TTS requests, used to plan the chunks of a script.
+    A request takes request_overhead seconds plus its characters at characters_per_second,
+    and parallelism requests run at the same time. A chunk that is already in the TTS cache
+    only takes cached_cost seconds to read.
+    """
+    request_overhead: float = 1.0
+    characters_per_second: float = 100.0
+    max_chars: int = 2000
+    min_chars: int = 250
+    parallelism: int = 4
+    cached_cost: float = 0.01
+    # Seconds a chunk that ends inside a paragraph is counted as costing more, for the break in prosody
+    paragraph_split_penalty: float = 0.5
+    # Seconds a chunk shorter than min_chars is counted as costing more, it is only planned when there is no other way
+    short_chunk_penalty: float = 60.0
+
+    @classmethod
+    def from_env(cls, parallelism: Optional[int] = None) -> "TTSCostModel":
+        """Reads the model from the TTS_* environment variables, parallelism defaults to TTS_MAX_WORKERS"""
+        return cls(
+            request_overhead=float(os.getenv('TTS_REQUEST_OVERHEAD', '1.0')),
+            characters_per_second=float(os.getenv('TTS_CHARS_PER_SECOND', '100')),
+            max_chars=int(os.getenv('TTS_CHUNK_MAX_CHARS', '2000')),
+            min_chars=int(os.getenv('TTS_CHUNK_MIN_CHARS', '250')),
+            parallelism=parallelism or int(os.getenv('TTS_MAX_WORKERS', '4')),
+            paragraph_split_penalty=float(os.getenv('TTS_PARAGRAPH_SPLIT_PENALTY', '0.5')),
+        )
+
+    def duration(self, characters: int, cached: bool = False) -> float:
+        if cached:
+            return self.cached_cost
+        return self.request_overhead + characters / self.characters_per_second
+
+    def wall_time(self, durations: List[float]) -> float:
+        """Time to run requests of the durations in order, each on the first free of parallelism workers"""
+        workers = [0.0] * max(self.parallelism, 1)
+        for duration in durations:
+            heapq.heappush(workers, heapq.heappop(workers) + duration)
+        return max(workers)
+
+@dataclass
+class ChunkPlan:
+    """The chunks of a script and their estimated synthesis time"""
+    chunks: List[str]
+    cached: List[bool]
+    wall_time: float
+    work: float
+
+class ChunkPlanner:
+    """
+    Splits a script into TTS chunks that minimize the estimated synthesis wall time.
+    Chunks are runs of whole sentences of at most max_chars characters (a longer sentence is
+    a chunk of its own) and at least min_chars, preferably ending at the end of a paragraph.
+    For each bound on the duration of a chunk, a dynamic program finds the chunks within the
+    bound with the least total time; the wall time of each of these plans is simulated on the
+    parallel requests, and the fastest one is kept. This balances the chunks across the requests
+    instead of leaving a short last chunk, and weighs the overhead of every extra request.
+    Chunks in the TTS cache only cost a lookup, so once a script has been synthesized, the plan
+    of an edited version keeps every chunk whose text didn't change and only re-plans the edits.
+    """
+
+    # Duration bounds tried on the first pass, before refining around the best one
+    GRID_SIZE = 32
+
+    def __init__(self, cost_model: Optional[TTSCostModel] = None,
+                 is_cached: Optional[Callable[[List[str]], Set[str]]] = None):
+        """
+        Args:
+            cost_model (TTSCostModel): Synthesis time estimates, by default from the environment
+            is_cached (callable): Returns which of a list of chunk texts are in the TTS cache
+        """
+        self.cost_model = cost_model or TTSCostModel.from_env()
+        self.is_cached = is_cached
+
+    def _sentences(self, script: str) -> Tuple[List[str], List[bool]]:
+        sentences, paragraph_ends = [], []
+        for paragraph in split_paragraphs(script):
+            paragraph_sentences = split_sentences(normalize_text(paragraph))
+            sentences.extend(paragraph_sentences)
+            paragraph_ends.extend([False] * (len(paragraph_sentences) - 1) + [True])
+        return sentences, paragraph_ends
+
+    def _candidates(self, sentences: List[str], paragraph_ends: List[bool]) -> List[List[tuple]]:
+        """For each end sentence, the (start, duration, penalty, text, cached) of the chunks that can end with it"""
+        model = self.cost_model
+        count = len(sentences)
+        ranges = []
+        for end in range(1, count + 1):
+            length = -1
+            for start in range(end - 1, -1, -1):
+                length += len(sentences[start]) + 1
+                # A sentence longer than max_chars is a chunk of its own
+                if length > model.max_chars and start < end - 1:
+                    break
+                if length >= model.min_chars or start == end - 1 or (start == 0 and end == count):
+                    ranges.append((start, end, length))
+        texts = {(start, end): " ".join(sentences[start:end]) for start, end, _ in ranges}
+        cached = self.is_cached(list(texts.values())) if self.is_cached else set()
+
+        candidates: List[List[tuple]] = [[] for _ in range(count + 1)]
+        for start, end, length in ranges:
+            text = texts[start, end]
+            penalty = model.paragraph_split_penalty if end < count and not paragraph_ends[end - 1] else 0.0
+            if length < model.min_chars and not (start == 0 and end == count):
+                penalty += model.short_chunk_penalty
+            candidates[end].append((start, model.duration(length, text in cached), penalty, text, text in cached))
+        return candidates
+
+    def _plan_within(self, candidates: List[List[tuple]], bound: float) -> Optional[List[tuple]]:
+        """The chunks no longer than bound with the least total duration and penalties, None if there are none"""
+        count = len(candidates) - 1
+        best = [float("inf")] * (count + 1)
+        best[0] = 0.0
+        choice: List[Optional[tuple]] = [None] * (count + 1)
+        for end in range(1, count + 1):
+            for candidate in candidates[end]:
+                start, duration, penalty = candidate[:3]
+                if duration > bound or best[start] == float("inf"):
+                    continue
+                total = best[start] + duration + penalty
+                if total < best[end]:
+                    best[end] = total
+                    choice[end] = candidate
+        if best[count] == float("inf"):
+            return None
+        plan = []
+        end = count
+        while end > 0:
+            plan.append(choice[end])
+            end = choice[end][0]
+        return plan[::-1]
+
+    def _evaluate(self, plan: List[tuple]) -> tuple:
+        durations = [candidate[1] for candidate in plan]
+        penalties = sum(candidate[2] for candidate in plan)
+        return (self.cost_model.wall_time(durations) + penalties, sum(durations), len(plan))
+
+    def plan(self, script: str) -> ChunkPlan:
+        """
+        Args:
+            script (str): The text to convert to speech
+        Returns:
+            ChunkPlan: The normalized text of the chunks, whether each one is cached, and the estimated times
+        """
+        sentences, paragraph_ends = self._sentences(script)
+        if not sentences:
+            return ChunkPlan([], [], 0.0, 0.0)
+        candidates = self._candidates(sentences, paragraph_ends)
+        bounds = sorted({candidate[1] for end_candidates in candidates for candidate in end_candidates})
+
+        results = {}
+
+        def evaluate(index: int):
+            if index not in results:
+                plan = self._plan_within(candidates, bounds[index])
+                results[index] = (self._evaluate(plan), plan) if plan else None
+            return results[index]
+
+        step = max(len(bounds) // self.GRID_SIZE, 1)
+        grid = sorted(set(range(len(bounds) - 1, -1, -step)))
+        for index in grid:
+            evaluate(index)
+        # Refine between the best bound of the grid and the grid points around it
+        best_index = min((index for index in grid if results[index]), key=lambda index: results[index][0])
+        position = grid.index(best_index)
+        low = grid[position - 1] if position > 0 else 0
+        high = grid[position + 1] if position + 1 < len(grid) else len(bounds) - 1
+        for index in range(low, high + 1, max((high - low) // self.GRID_SIZE, 1)):
+            evaluate(index)
+
+        (wall_time, work, _), plan = min((result for result in results.values() if result), key=lambda result: result[0])
+        return ChunkPlan(
+            chunks=[candidate[3] for candidate in plan],
+            cached=[candidate[4] for candidate in plan],
+            wall_time=wall_time,
+            work=work,
+        )
+
+def plan_chunks(script: str, cost_model: Optional[TTSCostModel] = None,
+                is_cached: Optional[Callable[[List[str]], Set[str]]] = None) -> List[str]:
+    """Returns the chunks of a script planned by ChunkPlanner"""
+    return ChunkPlanner(cost_model, is_cached).plan(script).chunks
@@ -1,17 +1,13 @@
-from langchain_openai.chat_models import ChatOpenAI
-import os
-from dotenv import load_dotenv
+from env import load_env
+from usage_meter import invoke_llm
+from clients import get_chat_model
 
 # Load environment variables from .env file
-load_dotenv()
+load_env()
 
 class TweetGenerator:
     def __init__(self):
-        self.llm = ChatOpenAI(
-            model="gpt-4o",
-            openai_api_key=os.getenv('OPENAI_API_KEY'),
-            temperature=0.8
-        )
+        self.llm = get_chat_model("gpt-4o", temperature=0.8)
 
     def generate(self, topic: str) -> str:
         """
@@ -36,14 +32,14 @@ class TweetGenerator:
         Only return the tweet text, nothing else."""
         
         # Generate the tweet
-        response = self.llm.invoke(prompt)
+        response = invoke_llm(self.llm, prompt, "tweet")
         tweet = response.content.strip()
         
         # Ensure the tweet is not longer than 280 characters
         if len(tweet) > 280:
             # If too long, generate a shorter version
             prompt += "\nIMPORTANT: The previous response was too long. Please make it shorter (under 280 characters)."
-            response = self.llm.invoke(prompt)
+            response = invoke_llm(self.llm, prompt, "tweet")
             tweet = response.content.strip()
         
         return tweet
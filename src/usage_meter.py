@@ -0,0 +1,295 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Optional
+from env import load_env
+from llm_cache import LLMCache, chain_temperature, get_llm_cache, retrieval_fingerprint
+from rate_limiter import get_limiter
+
+# Load environment variables from .env file
+load_env()
+
+# Estimated USD prices per unit, keyed by (provider, model)
+PRICES = {
+    ("openai", "gpt-4o"): {"prompt_tokens": 2.50 / 1e6, "completion_tokens": 10.00 / 1e6},
+    ("openai", "gpt-4o-mini"): {"prompt_tokens": 0.15 / 1e6, "completion_tokens": 0.60 / 1e6},
+    ("openai", "text-embedding-ada-002"): {"prompt_tokens": 0.10 / 1e6},
+    ("openai", "dall-e-3"): {"requests": 0.08},
+    ("tavily", "basic"): {"requests": 0.008},
+    ("tavily", "advanced"): {"requests": 0.016},
+    ("elevenlabs", "eleven_multilingual_v2"): {"characters": 0.30 / 1000},
+}
+
+# Tokens of the prompt templates a retrieval chain wraps the question and documents in, per LLM call
+CHAIN_PROMPT_TOKENS = 100
+
+class BudgetExceededError(RuntimeError):
+    """Raised when the next call of an episode would go over its budget, in either budget mode."""
+
+@dataclass
+class CallRecord:
+    """Usage of a single external call"""
+    stage: str
+    provider: str
+    model: str
+    latency: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    characters: int = 0
+    requests: int = 1
+    cost: float = 0.0
+
+    def estimate_cost(self) -> float:
+        prices = PRICES.get((self.provider, self.model), {})
+        return sum(getattr(self, unit) * price for unit, price in prices.items())
+
+@dataclass
+class Budget:
+    """
+    Hard limits for one episode, None means unlimited.
+    A call that would take the episode over a limit is never made, BudgetExceededError is raised
+    instead. Limits are checked with the usage estimated before each call (prompt tokens and TTS
+    characters), so the completion tokens of the calls in flight can still take the totals over
+    max_tokens and max_cost, and max_seconds only stops calls from starting after it.
+    """
+    max_cost: Optional[float] = None
+    max_seconds: Optional[float] = None
+    max_tokens: Optional[int] = None
+    max_characters: Optional[int] = None
+    # "abort" only enforces the limits, "degrade" also sets UsageMeter.degraded once degrade_at of
+    # any limit is used, so optional work is skipped while the rest of the episode still fits
+    mode: str = "abort"
+    degrade_at: float = 0.8
+
+    @classmethod
+    def from_env(cls) -> "Budget":
+        def value(name, cast):
+            raw = os.getenv(name)
+            return cast(raw) if raw else None
+        return cls(
+            max_cost=value('BUDGET_MAX_COST', float),
+            max_seconds=value('BUDGET_MAX_SECONDS', float),
+            max_tokens=value('BUDGET_MAX_TOKENS', int),
+            max_characters=value('BUDGET_MAX_CHARACTERS', int),
+            mode=os.getenv('BUDGET_MODE', 'abort'),
+            degrade_at=float(os.getenv('BUDGET_DEGRADE_AT', '0.8')),
+        )
+
+class UsageMeter:
+    """
+    Records tokens, characters, latency and estimated cost of every external call
+    of an episode, and enforces an optional Budget before each call.
+    The estimated usage of calls in flight is counted against the budget until they
+    complete, so calls made in parallel can't go over it together.
+    """
+
+    def __init__(self, budget: Optional[Budget] = None):
+        self.budget = budget or Budget()
+        self.records: List[CallRecord] = []
+        self._in_flight: List[CallRecord] = []
+        self.degraded = False
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _sum(records: List[CallRecord]) -> Dict[str, float]:
+        return {
+            "calls": sum(record.requests for record in records),
+            "latency": sum(record.latency for record in records),
+            "prompt_tokens": sum(record.prompt_tokens for record in records),
+            "completion_tokens": sum(record.completion_tokens for record in records),
+            "characters": sum(record.characters for record in records),
+            "cost": sum(record.cost for record in records),
+        }
+
+    def totals(self) -> Dict[str, float]:
+        with self._lock:
+            records = list(self.records)
+        return self._sum(records)
+
+    def _exceeded_limit(self, records: List[CallRecord], fraction: float = 1.0) -> Optional[str]:
+        """The first limit the usage of records goes over, with every limit scaled by fraction"""
+        totals = self._sum(records)
+        # Records in flight only have their estimated usage, their cost isn't set yet
+        cost = sum(record.cost or record.estimate_cost() for record in records)
+        tokens = totals["prompt_tokens"] + totals["completion_tokens"]
+        characters = totals["characters"]
+        elapsed = time.perf_counter() - self.started
+        budget = self.budget
+        if budget.max_cost is not None and cost > budget.max_cost * fraction:
+            return f"cost ${cost:.2f} > ${budget.max_cost * fraction:.2f}"
+        if budget.max_tokens is not None and tokens > budget.max_tokens * fraction:
+            return f"tokens {tokens} > {budget.max_tokens * fraction:.0f}"
+        if budget.max_characters is not None and characters > budget.max_characters * fraction:
+            return f"characters {characters} > {budget.max_characters * fraction:.0f}"
+        if budget.max_seconds is not None and elapsed > budget.max_seconds * fraction:
+            return f"elapsed {elapsed:.0f}s > {budget.max_seconds * fraction:.0f}s"
+        return None
+
+    def check_budget(self, pending: Optional[CallRecord] = None):
+        """
+        Checks the budget, including the estimated usage of the calls in flight and of a call about to be made.
+        The pending call is counted as in flight once it passes the check.
+        Raises:
+            BudgetExceededError: If the budget would be exceeded
+        """
+        with self._lock:
+            records = self.records + self._in_flight + ([pending] if pending else [])
+            exceeded = self._exceeded_limit(records)
+            degrade = None
+            if exceeded is None and self.budget.mode == "degrade" and not self.degraded:
+                degrade = self._exceeded_limit(records, self.budget.degrade_at)
+                self.degraded = degrade is not None
+            if exceeded is None and pending:
+                self._in_flight.append(pending)
+        if degrade:
+            print(f"Budget nearly used ({degrade}), degrading the episode")
+        if exceeded is not None:
+            stage = f" before {pending.stage}" if pending else ""
+            raise BudgetExceededError(f"Budget exceeded{stage}: {exceeded}")
+
+    @contextmanager
+    def track(self, stage: str, provider: str, model: str, prompt_tokens: int = 0, characters: int = 0, requests: int = 1):
+        """
+        Context manager around one external call.
+        The estimated usage passed in is checked against the budget before the call;
+        the yielded record can be updated with the actual usage inside the block.
+        """
+        record = CallRecord(stage, provider, model, prompt_tokens=prompt_tokens, characters=characters, requests=requests)
+        self.check_budget(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record.latency = time.perf_counter() - start
+            record.cost = record.estimate_cost()
+            with self._lock:
+                self._in_flight.remove(record)
+                self.records.append(record)
+
+    def report(self) -> Dict:
+        """Per-episode usage, in total and broken down by stage"""
+        with self._lock:
+            records = list(self.records)
+        stages: Dict[str, Dict] = {}
+        for record in records:
+            stage = stages.setdefault(record.stage, {
+                "calls": 0, "latency": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "characters": 0, "cost": 0.0
+            })
+            stage["calls"] += record.requests
+            stage["latency"] += record.latency
+            stage["prompt_tokens"] += record.prompt_tokens
+            stage["completion_tokens"] += record.completion_tokens
+            stage["characters"] += record.characters
+            stage["cost"] += record.cost
+        return {
+            "total": self.totals(),
+            "wall_time": time.perf_counter() - self.started,
+            "degraded": self.degraded,
+            "stages": stages,
+            "calls": [asdict(record) for record in records],
+        }
+
+    def print_report(self):
+        report = self.report()
+        print("\nUsage report:")
+        for name, stage in report["stages"].items():
+            tokens = stage["prompt_tokens"] + stage["completion_tokens"]
+            print(f"  {name}: {stage['calls']} calls, {stage['latency']:.1f}s, {tokens} tokens, "
+                  f"{stage['characters']} chars, ${stage['cost']:.4f}")
+        total = report["total"]
+        print(f"  total: {total['calls']} calls, {report['wall_time']:.1f}s wall time, ${total['cost']:.4f}")
+
+_default_meter = UsageMeter()
+_current_meter: contextvars.ContextVar[Optional[UsageMeter]] = contextvars.ContextVar("usage_meter", default=None)
+
+def get_meter() -> UsageMeter:
+    """Returns the meter of the episode being generated, or the process-wide default one"""
+    return _current_meter.get() or _default_meter
+
+@contextmanager
+def use_meter(meter: UsageMeter):
+    """Makes meter the current meter for the calls made inside the block"""
+    token = _current_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _current_meter.reset(token)
+
+def propagate_context(fn: Callable) -> Callable:
+    """
+    Wraps fn so that calls made from worker threads run in a copy of the
+    caller's context, and record their usage on the caller's meter.
+    """
+    context = contextvars.copy_context()
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return run
+
+def invoke_llm(llm, prompt: str, stage: str):
+    """
+    Invokes a chat model and records the tokens it reports.
+    Completions of cached stages are served from the LLM cache without calling the model.
+    """
+    from langchain_core.messages import AIMessage
+
+    model = getattr(llm, "model_name", "unknown")
+    cache = get_llm_cache()
+    key = LLMCache.make_key(model, getattr(llm, "temperature", None), prompt)
+    cached = cache.get(key, stage)
+    if cached is not None:
+        return AIMessage(content=cached)
+
+    with get_meter().track(stage, "openai", model, prompt_tokens=len(prompt) // 4) as call:
+        response = get_limiter("openai").call(llm.invoke, prompt, units=call.prompt_tokens)
+        usage = getattr(response, "usage_metadata", None) or {}
+        call.prompt_tokens = usage.get("input_tokens", call.prompt_tokens)
+        call.completion_tokens = usage.get("output_tokens", 0)
+    cache.put(key, stage, model, response.content)
+    return response
+
+def estimate_chain_tokens(chain, inputs: Dict) -> int:
+    """
+    Upper bound of the prompt tokens a ConversationalRetrievalChain sends for inputs, at 4 characters
+    per token: with a chat history, the history and question condensed into a standalone question,
+    then the question with the k longest documents the retriever could return, and both prompt templates.
+    """
+    question = inputs.get("question", "")
+    history = inputs.get("chat_history") or []
+    characters = len(question)
+    if history:
+        characters += len(question) + sum(len(str(part)) for turn in history for part in turn)
+    retriever = getattr(chain, "retriever", None)
+    docstore = getattr(getattr(getattr(retriever, "vectorstore", None), "docstore", None), "_dict", None) or {}
+    k = (getattr(retriever, "search_kwargs", None) or {}).get("k", 4)
+    characters += sum(sorted((len(document.page_content) for document in docstore.values()), reverse=True)[:k])
+    return characters // 4 + CHAIN_PROMPT_TOKENS * (2 if history else 1)
+
+def invoke_chain(chain, inputs: Dict, stage: str, model: str) -> Dict:
+    """
+    Invokes a LangChain chain and records the OpenAI tokens used by all of its LLM calls.
+    Answers of cached stages are served from the LLM cache, keyed on the inputs and
+    on the documents the chain retrieves from.
+    """
+    from langchain_community.callbacks import get_openai_callback
+
+    cache = get_llm_cache()
+    key = LLMCache.make_key(
+        model, chain_temperature(chain), json.dumps(inputs, sort_keys=True, default=str), retrieval_fingerprint(chain)
+    )
+    cached = cache.get(key, stage)
+    if cached is not None:
+        return {**inputs, "answer": cached}
+
+    with get_meter().track(stage, "openai", model, prompt_tokens=estimate_chain_tokens(chain, inputs)) as call:
+        with get_openai_callback() as callback:
+            result = get_limiter("openai").call(chain.invoke, inputs, units=call.prompt_tokens)
+        call.prompt_tokens = callback.prompt_tokens
+        call.completion_tokens = callback.completion_tokens
+        call.requests = max(callback.successful_requests, 1)
+    cache.put(key, stage, model, result["answer"])
+    return result